@@ -0,0 +1,154 @@
+"""Command line shared by eval_baichuan.py and eval_llama.py, which only pick the evaluator class."""
+import os
+import argparse
+import pandas as pd
+import json
+
+import sys
+import time
+EVAL_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(EVAL_DIR)
+from engine.arguments import add_engine_arguments, engine_kwargs
+from engine.core import init_distributed, is_main_process
+choices = ["A", "B", "C", "D"]
+
+
+def build_evaluator(cls, args):
+    return cls(
+        choices=choices,
+        k=args.ntrain,
+        model_name=args.model_name,
+        model_name_or_path=args.model_name_or_path,
+        device=args.device,
+        lora_model=args.lora_model,
+        lora_path=args.lora_path,
+        lora_paths=args.lora_paths,
+        early_stop=args.early_stop,
+        **engine_kwargs(args)
+    )
+
+
+def eval_subj(args, evaluator, subject_name, save_result_dir):
+    print(subject_name)
+    val_file_path = os.path.join('./val', f'{subject_name}_val.csv')
+    val_df = pd.read_csv(val_file_path)
+    if args.few_shot:
+        dev_file_path = os.path.join('./dev', f'{subject_name}_dev.csv')
+        dev_df = pd.read_csv(dev_file_path)
+        correct_ratio = evaluator.eval_subject(
+            subject_name, val_df, dev_df, few_shot=args.few_shot, save_result_dir=save_result_dir, cot=args.cot)
+    else:
+        correct_ratio = evaluator.eval_subject(
+            subject_name, val_df, few_shot=args.few_shot, save_result_dir=save_result_dir)
+    print("Acc:", correct_ratio)
+    return correct_ratio
+
+
+def eval_adapters(args, evaluator, subject_names, save_result_dir):
+    """Evaluates every adapter of `--lora_paths` on one base model and writes a comparison table."""
+    table = {}
+    for name, lora_path in evaluator.adapters.items():
+        print(f"adapter {name}: {lora_path}")
+        evaluator.set_adapter(name, lora_path)
+        adapter_dir = None
+        if save_result_dir:
+            adapter_dir = os.path.join(save_result_dir, name)
+            os.makedirs(adapter_dir, exist_ok=True)
+        table[name] = {subj: eval_subj(args, evaluator, subj, adapter_dir) for subj in subject_names}
+    table = pd.DataFrame.from_dict(table, orient='index')
+    table['average'] = table.mean(axis=1)
+    print(table.round(2).to_string())
+    if save_result_dir:
+        table.to_csv(os.path.join(save_result_dir, 'adapter_comparison.csv'))
+
+
+def test_subj(args, evaluator, subject_names, save_result_dir):
+    final_results = {}
+    final_texts = {}
+    for subject_name in subject_names:
+        print(subject_name)
+        test_file_path = os.path.join('./test', f'{subject_name}_test.csv')
+        test_df = pd.read_csv(test_file_path)
+        if args.few_shot:
+            dev_file_path = os.path.join('./dev', f'{subject_name}_dev.csv')
+            dev_df = pd.read_csv(dev_file_path)
+            pred_results, pred_texts = evaluator.test_subject(
+                subject_name, test_df, dev_df, few_shot=args.few_shot, save_result_dir=save_result_dir, cot=args.cot)
+        else:
+            pred_results, pred_texts = evaluator.test_subject(
+                subject_name, test_df, few_shot=args.few_shot, save_result_dir=save_result_dir)
+        cur_result = {str(i): j for i, j in enumerate(pred_results)}
+        final_results[subject_name] = cur_result
+        final_texts[subject_name] = pred_texts
+    return final_results, final_texts
+    # print("Acc:", correct_ratio)
+
+
+def main(cls, args):
+    _, world_size = init_distributed()
+    if world_size > 1:
+        # every rank evaluates its shard of each subject on its own GPU, only the first one writes results
+        args.device = f'cuda:{os.environ.get("LOCAL_RANK", 0)}'
+    evaluator = build_evaluator(cls, args)
+    save_result_dir = None
+    if is_main_process():
+        if not os.path.exists(r"logs"):
+                os.mkdir(r"logs")
+        run_date = time.strftime('%Y-%m-%d_%H-%M-%S', time.localtime(time.time()))
+        save_result_dir = os.path.join(r"logs", f"{args.model_name}_{run_date}")
+        os.mkdir(save_result_dir)
+    if args.test:
+        with open('subject_mapping.json') as f:
+            total_subjects = list(json.load(f).keys())
+        submission_results, raw_texts = test_subj(args, evaluator, total_subjects, save_result_dir)
+        # for subj in total_subjects:
+        #     results = test_subj(args, subj, save_result_dir)
+        #     submission_results[subj] = results
+        if save_result_dir:
+            with open(os.path.join(save_result_dir, 'submission_file.json'), 'w') as f:
+                json.dump(submission_results, f, ensure_ascii=False, indent=4)
+            with open(os.path.join(save_result_dir, 'raw_texts.json'), 'w') as f:
+                json.dump(raw_texts, f, ensure_ascii=False, indent=4)
+    elif args.lora_paths:
+        if args.subject == 'all':
+            with open('subject_mapping.json') as f:
+                total_subjects = list(json.load(f).keys())
+        else:
+            total_subjects = args.subject.split(',')
+        eval_adapters(args, evaluator, total_subjects, save_result_dir)
+    else:
+        if args.subject == 'all':
+            with open('subject_mapping.json') as f:
+                total_subjects = list(json.load(f).keys())
+                for subj in total_subjects:
+                    eval_subj(args, evaluator, subj, save_result_dir)
+        else:
+            eval_subj(args, evaluator, args.subject, save_result_dir)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--ntrain", "-k", type=int, default=5)
+    parser.add_argument("--few_shot", action="store_true")
+    parser.add_argument("--model_name", type=str, default='baichuan')
+    parser.add_argument("--model_name_or_path", type=str,
+                        default='baichuan-inc/Baichuan-7B')
+    parser.add_argument("--cot", action="store_true")
+    parser.add_argument("--subject", "-s", type=str,
+                        default="operating_system")
+    parser.add_argument("--device", type=str,
+                        default="cuda:0")
+    parser.add_argument("--lora_model", action='store_true', default=False)
+    parser.add_argument("--lora_path", type=str, default='')
+    parser.add_argument("--lora_paths", type=str, nargs='+', default=None,
+                        help="several LoRA checkpoints evaluated in turn on one loaded base model, "
+                             "-s may then list comma separated subjects")
+    parser.add_argument("--test", action='store_true', default=False)
+    parser.add_argument("--batch_size", type=int, default=1,
+                        help="questions per forward pass, launch with torchrun to also shard them across GPUs")
+    return add_engine_arguments(parser)
+
+
+def run(cls):
+    """Parses the command line and evaluates with evaluator class `cls`."""
+    main(cls, build_parser().parse_args())
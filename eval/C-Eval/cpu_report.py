@@ -0,0 +1,82 @@
+import os
+import argparse
+import json
+import time
+import pandas as pd
+from evaluators.baichuan import Baichuan_Evaluator
+from evaluators.llama import Llama_Evaluator
+
+choices = ["A", "B", "C", "D"]
+evaluators = {'baichuan': Baichuan_Evaluator, 'llama': Llama_Evaluator}
+# name -> loader options, fp32 comes first and is the reference the other variants are compared with
+variants = {
+    'fp32': dict(dtype='fp32'),
+    'bf16': dict(dtype='bf16'),
+    'int8': dict(dtype='fp32', quantize='int8'),
+    # exported to / read from --onnx_dir
+    'onnx': dict(dtype='fp32'),
+}
+
+
+def run_variant(args, load_kwargs, subjects):
+    evaluator = evaluators[args.model_type](
+        choices=choices, k=args.ntrain, model_name=args.model_type, model_name_or_path=args.model_name_or_path,
+        device='cpu', lora_model=bool(args.lora_path), lora_path=args.lora_path or None, cache_path=None,
+        batch_size=args.batch_size, num_threads=args.num_threads, **load_kwargs)
+    evaluator.model  # load outside of the timed region
+    predictions, answers = [], []
+    begin = time.time()
+    for subject_name in subjects:
+        val_df = pd.read_csv(os.path.join('./val', f'{subject_name}_val.csv'))
+        if args.limit:
+            val_df = val_df.head(args.limit)
+        dev_df = pd.read_csv(os.path.join('./dev', f'{subject_name}_dev.csv')) if args.few_shot else None
+        results, _ = evaluator.predict(subject_name, val_df, dev_df, few_shot=args.few_shot)
+        predictions += results
+        answers += list(val_df['answer'])
+    seconds = time.time() - begin
+    return predictions, answers, seconds
+
+
+def main(args):
+    if args.subject == 'all':
+        with open('subject_mapping.json') as f:
+            subjects = list(json.load(f).keys())
+    else:
+        subjects = args.subject.split(',')
+    names = ['fp32'] + [name for name in args.variants.split(',') if name != 'fp32']
+    runs = {}
+    for name in names:
+        load_kwargs = dict(variants[name], **(dict(onnx_dir=args.onnx_dir) if name == 'onnx' else {}))
+        runs[name] = run_variant(args, load_kwargs, subjects)
+    reference = runs['fp32'][0]
+    print("| variant | acc | s/question | speedup | agreement with fp32 |")
+    print("| --- | --- | --- | --- | --- |")
+    for name, (predictions, answers, seconds) in runs.items():
+        acc = 100 * sum(p == a for p, a in zip(predictions, answers)) / len(answers)
+        agreement = 100 * sum(p == r for p, r in zip(predictions, reference)) / len(reference)
+        print(f"| {name} | {acc:.2f} | {seconds / len(answers):.3f} | {runs['fp32'][2] / seconds:.2f}x | {agreement:.2f} |")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Accuracy and speed of the CPU inference variants against fp32")
+    parser.add_argument("--model_type", type=str, default='baichuan', choices=list(evaluators))
+    parser.add_argument("--model_name_or_path", type=str, default='baichuan-inc/Baichuan-7B')
+    parser.add_argument("--lora_path", type=str, default='')
+    parser.add_argument("--subject", "-s", type=str, default="operating_system",
+                        help="comma separated subjects, or `all`")
+    parser.add_argument("--limit", type=int, default=0, help="only the first questions of every subject")
+    parser.add_argument("--variants", type=str, default='fp32,bf16,int8',
+                        help=f"comma separated, out of {', '.join(variants)} (onnx needs --onnx_dir)")
+    parser.add_argument("--onnx_dir", type=str, default='')
+    parser.add_argument("--ntrain", "-k", type=int, default=5)
+    parser.add_argument("--few_shot", action="store_true")
+    parser.add_argument("--batch_size", type=int, default=1)
+    parser.add_argument("--num_threads", type=int, default=None)
+    args = parser.parse_args()
+    unknown = [name for name in args.variants.split(',') if name not in variants]
+    if unknown:
+        parser.error(f"unknown variants {', '.join(unknown)}, choose out of {', '.join(variants)}")
+    if 'onnx' in args.variants.split(',') and not args.onnx_dir:
+        parser.error("the onnx variant needs --onnx_dir")
+    main(args)
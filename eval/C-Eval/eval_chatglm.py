@@ -5,17 +5,31 @@ import torch
 import json
 from evaluators.chatglm import ChatGLM_Evaluator
 
+import sys
 import time
+EVAL_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(EVAL_DIR)
+from engine.core import init_distributed, is_main_process
 choices = ["A", "B", "C", "D"]
 
 
-def eval_subj(args, subject_name, save_result_dir):
-    evaluator = ChatGLM_Evaluator(
+def build_evaluator(args):
+    return ChatGLM_Evaluator(
         choices=choices,
         k=args.ntrain,
         model_name=args.model_name,
-        model_name_or_path=args.model_name_or_path
+        model_name_or_path=args.model_name_or_path,
+        device=args.device,
+        cache_path=None if args.no_cache else args.cache_path,
+        batch_size=args.batch_size,
+        dtype=args.dtype,
+        quantize=args.quantize,
+        onnx_dir=args.onnx_dir or None,
+        num_threads=args.num_threads
     )
+
+
+def eval_subj(args, evaluator, subject_name, save_result_dir):
     print(subject_name)
     val_file_path = os.path.join('./val', f'{subject_name}_val.csv')
     val_df = pd.read_csv(val_file_path)
@@ -30,13 +44,7 @@ def eval_subj(args, subject_name, save_result_dir):
     print("Acc:", correct_ratio)
 
 
-def test_subj(args, subject_names, save_result_dir):
-    evaluator = ChatGLM_Evaluator(
-        choices=choices,
-        k=args.ntrain,
-        model_name=args.model_name,
-        model_name_or_path=args.model_name_or_path
-    )
+def test_subj(args, evaluator, subject_names, save_result_dir):
     final_results = {}
     final_texts = {}
     for subject_name in subject_names:
@@ -59,30 +67,38 @@ def test_subj(args, subject_names, save_result_dir):
 
 
 def main(args):
-    if not os.path.exists(r"logs"):
-            os.mkdir(r"logs")
-    run_date = time.strftime('%Y-%m-%d_%H-%M-%S', time.localtime(time.time()))
-    save_result_dir = os.path.join(r"logs", f"{args.model_name}_{run_date}")
-    os.mkdir(save_result_dir)
+    _, world_size = init_distributed()
+    if world_size > 1:
+        # every rank evaluates its shard of each subject on its own GPU, only the first one writes results
+        args.device = f'cuda:{os.environ.get("LOCAL_RANK", 0)}'
+    evaluator = build_evaluator(args)
+    save_result_dir = None
+    if is_main_process():
+        if not os.path.exists(r"logs"):
+                os.mkdir(r"logs")
+        run_date = time.strftime('%Y-%m-%d_%H-%M-%S', time.localtime(time.time()))
+        save_result_dir = os.path.join(r"logs", f"{args.model_name}_{run_date}")
+        os.mkdir(save_result_dir)
     if args.test:
         with open('subject_mapping.json') as f:
             total_subjects = list(json.load(f).keys())
-        submission_results, raw_texts = test_subj(args, total_subjects, save_result_dir)
+        submission_results, raw_texts = test_subj(args, evaluator, total_subjects, save_result_dir)
         # for subj in total_subjects:
         #     results = test_subj(args, subj, save_result_dir)
         #     submission_results[subj] = results
-        with open(os.path.join(save_result_dir, 'submission_file.json'), 'w') as f:
-            json.dump(submission_results, f, ensure_ascii=False, indent=4)
-        with open(os.path.join(save_result_dir, 'raw_texts.json'), 'w') as f:
-            json.dump(raw_texts, f, ensure_ascii=False, indent=4)
+        if save_result_dir:
+            with open(os.path.join(save_result_dir, 'submission_file.json'), 'w') as f:
+                json.dump(submission_results, f, ensure_ascii=False, indent=4)
+            with open(os.path.join(save_result_dir, 'raw_texts.json'), 'w') as f:
+                json.dump(raw_texts, f, ensure_ascii=False, indent=4)
     else:
         if args.subject == 'all':
             with open('subject_mapping.json') as f:
                 total_subjects = list(json.load(f).keys())
                 for subj in total_subjects:
-                    eval_subj(args, subj, save_result_dir)
+                    eval_subj(args, evaluator, subj, save_result_dir)
         else:
-            eval_subj(args, args.subject, save_result_dir)
+            eval_subj(args, evaluator, args.subject, save_result_dir)
     
 
 
@@ -101,5 +117,17 @@ if __name__ == "__main__":
     parser.add_argument("--lora_model", action='store_true', default=False)
     parser.add_argument("--lora_path", type=str, default='')
     parser.add_argument("--test", action='store_true', default=False)
+    parser.add_argument("--cache_path", type=str, default='cache/generations.sqlite',
+                        help="SQLite file caching raw generations, keyed by model, prompt and decoding config")
+    parser.add_argument("--no_cache", action='store_true', default=False)
+    parser.add_argument("--dtype", type=str, default='auto', choices=['auto', 'fp16', 'bf16', 'fp32'],
+                        help="weight dtype, auto is fp16 on GPU and fp32 on CPU")
+    parser.add_argument("--quantize", type=str, default=None, choices=['int8'],
+                        help="int8 dynamic quantization of the Linear layers, CPU only")
+    parser.add_argument("--onnx_dir", type=str, default='',
+                        help="run the (merged) model with ONNX Runtime, exported into this directory on first use")
+    parser.add_argument("--num_threads", type=int, default=None, help="intra-op threads used on CPU")
+    parser.add_argument("--batch_size", type=int, default=1,
+                        help="questions per forward pass, launch with torchrun to also shard them across GPUs")
     args = parser.parse_args()
     main(args)
@@ -1,35 +1,124 @@
+import os
 import re
+import sys
 import string
+EVAL_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(EVAL_DIR)
+from engine.evaluator import EngineEvaluator
 
 
-class Evaluator:
+class Evaluator(EngineEvaluator):
+    # patterns tried in order on the response when it does not contain `所以答案是X。`
+    answer_patterns = [
+        r'([ABCD])是正确的',
+        r'选项([ABCD])正确',
+        r'答案为([ABCD])',
+        r'答案是([ABCD])',
+        r'答案([ABCD])',
+        r'选择([ABCD])',
+        r'答案：([ABCD])',
+        r'答：([ABCD])',
+        r'选择答案([ABCD])'
+    ]
+    # put in front of the first few-shot example
+    few_shot_header = "以下是中国关于{subject}考试的单项选择题，请选出其中的正确答案。\n\n"
+
     def __init__(self, choices, model_name, k=-1):
         self.choices = choices
         self.model_name = model_name
         self.k = k
         self.puncs = list(string.punctuation)
+        # LoRA adapters attached next to each other on the base model, name -> path
+        self.adapters = {}
+        # number of few-shot examples in the prompt of every question of the last subject
+        self.n_shots = []
 
-    def format_example(self, line, include_answer=True):
-        example = line['question']
+    def format_example(self, line, include_answer=True, cot=False, add_prompt=''):
+        example = add_prompt + line['question']
         # print(example)
         for choice in self.choices:
             example += f'\n{choice}. {line[f"{choice}"]}'
         example += '\n答案：'
         if include_answer:
-            example += f'{line["answer"]}\n\n'
+            if cot:
+                ans = "让我们一步一步思考，\n" + \
+                    line["explanation"] + f"\n所以答案是{line['answer']}。"
+            else:
+                ans = line["answer"]
+            m = (example, ans)
+            return m
         return example
 
-    def generate_few_shot_prompt(self, subject, dev_df):
-        prompt = f"以下是中国关于{subject}考试的单项选择题，请选出其中的正确答案。\n\n"
-        k = self.k
-        if self.k == -1:
-            k = dev_df.shape[0]
-        for i in range(k):
-            prompt += self.format_example(dev_df.iloc[i, :])
-        return prompt
-
-    def eval_subject(self, subject_name, test_df, dev_df=None, few_shot=False, save_result_dir=None):
-        pass
+    def format_questions(self, df):
+        """Vectorized `format_example(line, include_answer=False)` over every row of `df`."""
+        questions = df['question'].astype(str)
+        for choice in self.choices:
+            questions = questions + f'\n{choice}. ' + df[choice].astype(str)
+        return list(questions + '\n答案：')
+
+    def predict(self, subject_name, test_df, dev_df=None, few_shot=False, cot=False):
+        """Returns the extracted answers and, in few-shot mode, the raw responses of every question."""
+        rows = test_df.to_dict('records')
+        questions = self.format_questions(test_df)
+        responses = []
+        if few_shot:
+            histories = self.few_shot_histories(subject_name, questions, dev_df, cot=cot)
+            prompts = self.few_shot_prompts(subject_name, questions, histories, self.answer_generation)
+            responses = self.engine.generate(prompts, self.answer_generation, cot=cot, early_stop=self.early_stop)
+            responses = [response.strip() for response in responses]
+            # For ChatGLM, we use answer extraction in answer-only mode too.
+            results = [self.extract_cot_answer(row, response)[0] for row, response in zip(rows, responses)]
+        else:   # zero-shot by extracting answer from distribution
+            scores = self.engine.choice_scores(questions, self.dist_generation, self.choice_ids)
+            results = [self.choices[max(range(len(score)), key=score.__getitem__)] for score in scores]
+        print(f'{subject_name}: {self.engine.report()}')
+        return results, responses
+
+    def eval_subject(self, subject_name, test_df, dev_df=None, few_shot=False, cot=False, save_result_dir=None):
+        results, responses = self.predict(subject_name, test_df, dev_df, few_shot=few_shot, cot=cot)
+        answers = list(test_df['answer'])
+        score = [int(ans == answer) for ans, answer in zip(results, answers)]
+        correct_ratio = 100*sum(score)/len(answers)
+
+        if save_result_dir:
+            if few_shot:
+                test_df['model_output'] = responses
+                test_df['n_shots'] = self.n_shots
+            test_df['correctness'] = score
+            test_df.to_csv(os.path.join(
+                save_result_dir, f'{subject_name}_test.csv'))
+            with open(os.path.join(save_result_dir, f'{subject_name}_test_acc.txt'), 'w') as f:
+                f.write(f'{correct_ratio}')
+
+        return correct_ratio
+
+    def test_subject(self, subject_name, test_df, dev_df=None, few_shot=False, cot=False, save_result_dir=None):
+        return self.predict(subject_name, test_df, dev_df, few_shot=few_shot, cot=cot)
+
+    def extract_cot_answer(self, line, gen_ans):
+        m = re.findall(r'所以答案是(.+?)。', gen_ans, re.M)
+        if len(m) > 0 and m[-1] in self.choices:
+            return m[-1], True
+        # RE extraction
+        for answer_pattern in self.answer_patterns:
+            m = re.search(answer_pattern, gen_ans, re.M)
+            if m:
+                answer = m.group(1)
+                return answer, False
+        # only containing one choice-character
+        m = re.findall(r'[ABCD]', gen_ans, re.M)
+        if len(m) == 1:
+            answer = m[0]
+            return answer, False
+        answer_word_counter = 0
+        # only containing one choice-context
+        for c in self.choices:
+            if str(line[f'{c}']) in gen_ans:
+                answer = c
+                answer_word_counter += 1
+        if answer_word_counter == 1:
+            return answer, False
+        return '-', False
 
     def normalize_answer(self, s):
 
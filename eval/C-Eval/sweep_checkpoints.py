@@ -0,0 +1,124 @@
+import os
+import re
+import argparse
+import json
+import time
+import pandas as pd
+from evaluators.baichuan import Baichuan_Evaluator
+from evaluators.llama import Llama_Evaluator
+
+choices = ["A", "B", "C", "D"]
+cmexam_choices = ["A", "B", "C", "D", "E"]
+evaluators = {'baichuan': Baichuan_Evaluator, 'llama': Llama_Evaluator}
+CHECKPOINT_PATTERN = re.compile(r'^checkpoint-(\d+)$')
+
+
+def list_checkpoints(output_dir):
+    """Completed `checkpoint-*` directories of a training run as (step, path), oldest first.
+
+    The Trainer writes `trainer_state.json` last, so a checkpoint without it is still being saved.
+    """
+    checkpoints = []
+    for name in os.listdir(output_dir) if os.path.isdir(output_dir) else []:
+        match = CHECKPOINT_PATTERN.match(name)
+        path = os.path.join(output_dir, name)
+        if match and os.path.exists(os.path.join(path, 'trainer_state.json')):
+            checkpoints.append((int(match.group(1)), path))
+    return sorted(checkpoints)
+
+
+def load_benchmark(args):
+    """The fixed question subset scored for every checkpoint, name -> dataframe."""
+    benchmark = {}
+    for subject_name in args.subjects.split(',') if args.subjects else []:
+        benchmark[subject_name] = pd.read_csv(os.path.join('./val', f'{subject_name}_val.csv'))
+    if args.cmexam_file:
+        benchmark['cmexam'] = pd.read_csv(args.cmexam_file)
+    if args.limit:
+        benchmark = {name: df.head(args.limit) for name, df in benchmark.items()}
+    return benchmark
+
+
+def score_checkpoint(evaluator, benchmark):
+    """Zero-shot accuracy of the active adapter on every part of the benchmark."""
+    accuracies = {}
+    for name, df in benchmark.items():
+        if name == 'cmexam':
+            # CMExam keeps its options in one column and has five of them
+            questions = list(df['Question'].astype(str) + '\n' + df['Options'].astype(str) + '\n答案：')
+            choice_ids = [evaluator.encode_choice(evaluator.tokenizer, choice) for choice in cmexam_choices]
+            scores = evaluator.engine.choice_scores(questions, evaluator.dist_generation, choice_ids)
+            results = [cmexam_choices[max(range(len(score)), key=score.__getitem__)] for score in scores]
+            print(f'{name}: {evaluator.engine.report()}')
+            answers = list(df['Answer'])
+        else:
+            results, _ = evaluator.predict(name, df)
+            answers = list(df['answer'])
+        accuracies[name] = 100 * sum(result == answer for result, answer in zip(results, answers)) / len(answers)
+    return accuracies
+
+
+def main(args):
+    results_path = args.results or os.path.join(args.output_dir, 'eval_sweep.csv')
+    scored = pd.read_csv(results_path) if os.path.exists(results_path) else pd.DataFrame(columns=['step'])
+    scored_steps = set(scored['step'].astype(int))
+    benchmark = load_benchmark(args)
+    # the base model is loaded once, every checkpoint only adds its adapter
+    evaluator = evaluators[args.model_type](
+        choices=choices, k=args.ntrain, model_name=args.model_type, model_name_or_path=args.model_name_or_path,
+        device=args.device, cache_path=None if args.no_cache else args.cache_path, batch_size=args.batch_size,
+        token_cache_dir=args.token_cache_dir or None)
+    while True:
+        pending = [(step, path) for step, path in list_checkpoints(args.output_dir) if step not in scored_steps]
+        for step, path in pending:
+            name = os.path.basename(path)
+            print(f"scoring {name}")
+            begin = time.time()
+            try:
+                evaluator.set_adapter(name, path)
+            except (OSError, ValueError) as e:
+                # deleted by save_total_limit while we were waiting for it
+                print(f"skipping {name}: {e}")
+                continue
+            try:
+                accuracies = score_checkpoint(evaluator, benchmark)
+            except (OSError, ValueError) as e:
+                # the adapter of a lazily loaded model is only read here
+                print(f"skipping {name}: {e}")
+                continue
+            finally:
+                evaluator.remove_adapter(name)
+            row = {'step': step, 'checkpoint': name, **accuracies,
+                   'average': sum(accuracies.values()) / len(accuracies), 'seconds': time.time() - begin}
+            print(json.dumps(row, ensure_ascii=False))
+            scored = pd.concat([scored, pd.DataFrame([row])], ignore_index=True).sort_values('step')
+            scored.to_csv(results_path, index=False)
+            scored_steps.add(step)
+        training_done = os.path.exists(os.path.join(args.output_dir, 'train_results.json'))
+        if not args.watch or (training_done and not pending):
+            break
+        time.sleep(args.watch)
+    print(scored.round(2).to_string(index=False))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Score every checkpoint-* of a LoRA training run on a fixed subset")
+    parser.add_argument("--output_dir", type=str, required=True, help="output_dir of the training run")
+    parser.add_argument("--model_type", type=str, default='baichuan', choices=list(evaluators))
+    parser.add_argument("--model_name_or_path", type=str, default='baichuan-inc/Baichuan-7B',
+                        help="base model the adapters were trained on")
+    parser.add_argument("--subjects", "-s", type=str, default="clinical_medicine,basic_medicine,physician",
+                        help="comma separated C-Eval subjects, scored on their val split")
+    parser.add_argument("--cmexam_file", type=str, default='', help="also score the questions of a CMExam csv")
+    parser.add_argument("--limit", type=int, default=0, help="only the first questions of every part")
+    parser.add_argument("--results", type=str, default='', help="csv of accuracy per step, output_dir/eval_sweep.csv by default")
+    parser.add_argument("--watch", type=int, default=0,
+                        help="poll output_dir every N seconds for new checkpoints until training has finished")
+    parser.add_argument("--ntrain", "-k", type=int, default=5)
+    parser.add_argument("--device", type=str, default="cuda:0")
+    parser.add_argument("--batch_size", type=int, default=8)
+    parser.add_argument("--cache_path", type=str, default='cache/generations.sqlite')
+    parser.add_argument("--no_cache", action='store_true', default=False)
+    parser.add_argument("--token_cache_dir", type=str, default='cache/prompt_tokens')
+    args = parser.parse_args()
+    main(args)
@@ -11,7 +11,10 @@ import argparse
 import pandas as pd
 from eval.CMExam.evaluators.baichuan import Baichuan_Evaluator
 
+import sys
 import time
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from engine.arguments import add_engine_arguments, engine_kwargs
 choices = ["A", "B", "C", "D", "E"]
 
 def main(args):
@@ -21,7 +24,8 @@ def main(args):
         model_name=args.model_name,
         model_name_or_path=args.model_name_or_path,
         lora_model=args.lora_model,
-        device='cuda:0'
+        device=args.device,
+        **engine_kwargs(args)
     )
     if not os.path.exists(r"logs"):
         os.mkdir(r"logs")
@@ -34,7 +38,8 @@ def main(args):
         dev_file_path = os.path.join('', 'data/val.csv')
         dev_df = pd.read_csv(dev_file_path)
         correct_ratio = evaluator.eval_subject(
-            "医疗", val_df, dev_df, few_shot=args.few_shot, save_result_dir=save_result_dir, cot=args.cot)
+            "医疗", val_df, dev_df, few_shot=args.few_shot, save_result_dir=save_result_dir, cot=args.cot,
+            early_stop=args.early_stop)
     else:
         correct_ratio = evaluator.eval_subject(
             "医疗", val_df, few_shot=args.few_shot, save_result_dir=save_result_dir)
@@ -51,7 +56,9 @@ if __name__ == "__main__":
                         default='baichuan-inc/Baichuan-7B')
     parser.add_argument("--lora_model", type=str, default='')
     parser.add_argument("--cot", action="store_true")
+    parser.add_argument("--batch_size", type=int, default=1)
     parser.add_argument("--device", type=str,
                         default="cuda:0")
+    add_engine_arguments(parser)
     args = parser.parse_args()
     main(args)
@@ -0,0 +1,103 @@
+import hashlib
+from collections import Counter
+from .suite import CorpusStats
+
+
+class TextMetrics(CorpusStats):
+    """Running corpus BLEU and mean ROUGE-1/2/L, fed one hypothesis/reference pair at a time.
+
+    No text is kept: BLEU only needs its counts and ROUGE keeps running sums instead of per-pair rows, so
+    memory stays constant. The sums make `compute` differ from `text_metrics` in the last float digits at
+    most. Accumulators of parallel workers combine with `merge`.
+    """
+
+    def __init__(self, tokenize=list, bleu_orders=(1, 2, 4), smooth=False, legacy_rouge=True):
+        super(TextMetrics, self).__init__(max(bleu_orders, default=0), legacy_rouge)
+        self.tokenize = tokenize
+        self.bleu_orders = bleu_orders
+        self.smooth = smooth
+        self.rouge = [0.] * 9
+        self.count = 0
+
+    def update(self, hypothesis, reference, tokens=None):
+        """Adds a pair; `tokens`, its pre-segmented (hypothesis, reference) BLEU tokens, replaces `tokenize`."""
+        self.add(hypothesis, reference, self.tokenize, tokens)
+
+    def add_rouge(self, scores):
+        self.rouge = [a + b for a, b in zip(self.rouge, scores)]
+        self.count += 1
+
+    def rouge_means(self):
+        return [total / max(self.count, 1) for total in self.rouge]
+
+    def merge_rouge(self, other):
+        self.rouge = [a + b for a, b in zip(self.rouge, other.rouge)]
+        self.count += other.count
+
+    def compute(self):
+        if not self.count:
+            return {}
+        return self.metrics(self.bleu_orders, self.smooth)
+
+    def __len__(self):
+        return self.count
+
+
+class UniqueSentences:
+    """Running `unique_sentence_percent`; only an 8-byte digest of every distinct sentence is kept."""
+
+    def __init__(self):
+        self.digests = set()
+        self.count = 0
+
+    @staticmethod
+    def digest(tokens):
+        text = '\x1f'.join(str(token) for token in tokens)
+        return int.from_bytes(hashlib.blake2b(text.encode('utf-8'), digest_size=8).digest(), 'little')
+
+    def update(self, tokens):
+        self.digests.add(self.digest(tokens))
+        self.count += 1
+
+    def merge(self, other):
+        self.digests |= other.digests
+        self.count += other.count
+        return self
+
+    def compute(self):
+        return len(self.digests) / max(self.count, 1), len(self.digests)
+
+
+class FeatureMetrics:
+    """Running `feature_matching_ratio`, `feature_coverage_ratio` and `feature_diversity`.
+
+    Only how many sentences mention each feature is kept: the pairwise overlaps summed by
+    `feature_diversity` are the pairs of sentences sharing a feature, sum of c * (c - 1) / 2 over features.
+    """
+
+    def __init__(self, feature_set):
+        self.feature_set = feature_set
+        self.feature_counts = Counter()
+        self.matched = 0
+        self.count = 0
+
+    def update(self, tokens, test_feature=None):
+        features = {token for token in tokens if token in self.feature_set}
+        self.feature_counts.update(features)
+        self.matched += test_feature in features
+        self.count += 1
+
+    def merge(self, other):
+        self.feature_counts.update(other.feature_counts)
+        self.matched += other.matched
+        self.count += other.count
+        return self
+
+    def compute(self):
+        pairs = sum(c * (c - 1) // 2 for c in self.feature_counts.values())
+        denominator = self.count * (self.count - 1) / 2
+        return {
+            'matching_ratio': self.matched / max(self.count, 1),
+            'coverage_ratio': len(self.feature_counts) / len(self.feature_set),
+            'diversity': pairs / denominator if denominator else 0.,
+        }
@@ -70,6 +70,28 @@ def compute_bleu(reference_corpus, translation_corpus, max_order=4,
       if possible_matches > 0:
         possible_matches_by_order[order-1] += possible_matches
 
+  return bleu_from_counts(matches_by_order, possible_matches_by_order,
+                          translation_length, reference_length, max_order,
+                          smooth)
+
+
+def bleu_from_counts(matches_by_order, possible_matches_by_order,
+                     translation_length, reference_length, max_order=4,
+                     smooth=False):
+  """Computes BLEU from the corpus n-gram statistics gathered by compute_bleu.
+
+  Args:
+    matches_by_order: clipped n-gram matches of every order, summed over the
+        corpus.
+    possible_matches_by_order: n-grams of every order in the translations.
+    translation_length: number of tokens of all translations.
+    reference_length: number of tokens of the shortest references.
+    max_order: Maximum n-gram order to use when computing BLEU score.
+    smooth: Whether or not to apply Lin et al. 2004 smoothing.
+
+  Returns:
+    Same tuple as compute_bleu.
+  """
   precisions = [0] * max_order
   for i in range(0, max_order):
     if smooth:
@@ -2,7 +2,7 @@ from __future__ import absolute_import, division, print_function
 
 import math
 import numpy as np
-import heapq
+from collections import namedtuple
 
 
 def evaluate_old(predict, groundtruth, topk=10):
@@ -214,7 +214,7 @@ def dcg_at_k(r, k, method=1):
     Returns:
         Discounted cumulative gain
     """
-    r = np.asfarray(r)[:k]
+    r = np.asarray(r, dtype=float)[:k]
     if r.size:
         if method == 0:
             return r[0] + np.sum(r[1:] / np.log2(np.arange(2, r.size + 1)))
@@ -284,54 +284,146 @@ def evaluate_once(topk_preds, groundtruth):
     }
 
 
-def evaluate_all(user_item_scores, groudtruth, topk=10):
+class CSRScores(namedtuple('CSRScores', ['indptr', 'indices', 'data', 'shape'])):
+    """User x item scores in CSR layout; `scipy.sparse.csr_matrix` can be passed as well.
+
+    Only the stored entries of a row are candidate items of that user.
+    """
+
+
+def _dcg_tables(topk):
+    """log2 discount of every rank and ideal DCG of every hit count, `idcg[h]` with the `h` hits ranked first."""
+    discount = np.log2(np.arange(2, topk + 2))
+    idcg = np.concatenate([[0.0], np.cumsum(1.0 / discount)])
+    return discount, idcg
+
+
+def _score_chunk(scores, start, stop):
+    """Dense scores of users [start, stop) and the mask of their candidate items."""
+    if hasattr(scores, 'indptr'):
+        indptr = np.asarray(scores.indptr[start:stop + 1])
+        dense = np.full((stop - start, scores.shape[1]), -np.inf)
+        rows = np.repeat(np.arange(stop - start), np.diff(indptr))
+        dense[rows, scores.indices[indptr[0]:indptr[-1]]] = scores.data[indptr[0]:indptr[-1]]
+        valid = np.zeros(dense.shape, dtype=bool)
+        valid[rows, scores.indices[indptr[0]:indptr[-1]]] = True
+        return dense, valid
+    dense = np.asarray(scores[start:stop])
+    return dense, np.ones(dense.shape, dtype=bool)
+
+
+def _groundtruth_keys(groundtruth, start, stop, num_items):
+    """`row * num_items + item` of every relevant item of users [start, stop), rows counted from `start`."""
+    if hasattr(groundtruth, 'indptr'):
+        indptr = np.asarray(groundtruth.indptr[start:stop + 1])
+        rows = np.repeat(np.arange(stop - start), np.diff(indptr))
+        items = np.asarray(groundtruth.indices[indptr[0]:indptr[-1]])
+    elif isinstance(groundtruth, np.ndarray):
+        rows, items = np.nonzero(groundtruth[start:stop])
+    else:
+        lists = groundtruth[start:stop]
+        rows = np.repeat(np.arange(stop - start), [len(items) for items in lists])
+        items = np.fromiter((item for items in lists for item in items), dtype=np.int64, count=len(rows))
+    return np.unique(rows.astype(np.int64) * num_items + items)
+
+
+def _top_k(scores, valid, topk, rng):
+    """Top `topk` items of every row, best first, ties broken uniformly at random by `rng`."""
+    selected = np.argpartition(-scores, topk - 1, axis=1)[:, :topk]
+    selected_scores = np.take_along_axis(scores, selected, axis=1)
+    kth = selected_scores.min(axis=1, keepdims=True)
+    # only rows with items left out at the k-th score need a draw: the items above it are all in and
+    # the tied ones compete on random noise
+    crowded = np.nonzero((scores == kth).sum(axis=1) > (selected_scores == kth).sum(axis=1))[0]
+    if crowded.size:
+        rows, row_kth = scores[crowded], kth[crowded]
+        key = np.where(rows > row_kth, 2.0, -1.0)
+        tied = (rows == row_kth) & valid[crowded]
+        key[tied] = rng.random(np.count_nonzero(tied))
+        selected[crowded] = np.argpartition(-key, topk - 1, axis=1)[:, :topk]
+        selected_scores = np.take_along_axis(scores, selected, axis=1)
+    order = np.lexsort((rng.random(selected.shape), -selected_scores), axis=1)
+    return np.take_along_axis(selected, order, axis=1)
+
+
+def evaluate_matrix(scores, groundtruth, topk=10, seed=None, chunk_size=None):
+    """Evaluate top-k recommendations of a user x item score matrix, vectorized over users.
+    Args:
+        scores: dense array (e.g. a `np.memmap`) or CSR matrix (`CSRScores`, `scipy.sparse.csr_matrix`)
+                of shape (num_users, num_items). Make sure larger score means better recommendation.
+        groundtruth: per user row, the relevant item columns: a list of item lists, a CSR matrix or
+                     a dense array whose nonzero entries are relevant.
+        topk: int
+        seed: seed of the noise breaking score ties, for a given `chunk_size`.
+        chunk_size: users scored at once, by default as many as fit about 4M matrix entries; memory
+                    stays bounded by the chunk whatever the number of users.
+    Returns:
+        Sums of precision, recall, NDCG, hit, AP and reciprocal rank over users, and the user count;
+        averaged by `evaluate_all`. Metrics equal `evaluate_once` on the same top-k lists.
+    """
+    num_users, num_items = scores.shape
+    chunk_size = chunk_size or max(1, (1 << 22) // max(num_items, 1))
+    rng = np.random.default_rng(seed)
+    discount, idcg = _dcg_tables(topk)
+    sums = dict.fromkeys(['precision', 'recall', 'ndcg', 'hit', 'map', 'mrr'], 0.0)
+    for start in range(0, num_users, chunk_size):
+        stop = min(start + chunk_size, num_users)
+        dense, valid = _score_chunk(scores, start, stop)
+        k = min(topk, num_items)
+        selected = _top_k(dense, valid, k, rng)
+        # users with fewer than `topk` candidates are ranked on the candidates they have
+        ranked = np.take_along_axis(valid, selected, axis=1)
+        num_ranked = ranked.sum(axis=1)
+
+        gt_keys = _groundtruth_keys(groundtruth, start, stop, num_items)
+        num_relevant = np.bincount(gt_keys // num_items, minlength=stop - start)
+        keys = np.arange(stop - start, dtype=np.int64)[:, None] * num_items + selected
+        rel = np.isin(keys, gt_keys) & ranked
+
+        hits = rel.sum(axis=1)
+        ranks = np.arange(1, k + 1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            sums['precision'] += np.sum(hits / num_ranked)
+            sums['recall'] += np.sum(hits / num_relevant)
+            sums['ndcg'] += np.sum(np.where(hits > 0, np.sum(rel / discount[:k], axis=1) / idcg[hits], 0.0))
+            sums['map'] += np.sum(np.where(
+                hits > 0, np.sum(np.cumsum(rel, axis=1) / ranks * rel, axis=1) / hits, 0.0))
+        sums['hit'] += np.sum(hits > 0)
+        sums['mrr'] += np.sum(np.where(hits > 0, 1.0 / (np.argmax(rel, axis=1) + 1), 0.0))
+    return sums, num_users
+
+
+def evaluate_all(user_item_scores, groudtruth, topk=10, seed=None, chunk_size=None):
     """Evaluate all user-items performance.
     Args:
-        user_item_scores: dict with key = <item_id>, value = <user_item_score>.
+        user_item_scores: dict with key = <user_id>, value = dict with key = <item_id>, value = <user_item_score>.
                      Make sure larger score means better recommendation.
         groudtruth: dict with key = <user_id>, value = list of <item_id>.
         topk: int
+        seed: seed of the noise breaking score ties, random if None.
+        chunk_size: users scored at once by `evaluate_matrix`.
     Returns:
     """
-    avg_prec, avg_recall, avg_ndcg, avg_hit = 0.0, 0.0, 0.0, 0.0
-    rs = []
-    cnt = 0
+    item_index = {}
+    indptr, indices, data, relevant = [0], [], [], []
     for uid in user_item_scores:
-        # [Important] Use shuffle to break ties!!!
-        ui_scores = list(user_item_scores[uid].items())
-        np.random.shuffle(ui_scores)  # break ties
-        # topk_preds = heapq.nlargest(topk, user_item_scores[uid], key=user_item_scores[uid].get)  # list of k <item_id>
-        topk_preds = heapq.nlargest(topk, ui_scores, key=lambda x: x[1]) # list of k tuples
-        topk_preds = [x[0] for x in topk_preds]  # list of k <item_id>
-        # print(topk_preds, groudtruth[uid])
-        result = evaluate_once(topk_preds, groudtruth[uid])
-        avg_prec += result["precision@k"]
-        avg_recall += result["recall@k"]
-        avg_ndcg += result["ndcg@k"]
-        avg_hit += result["hit@k"]
-        rs.append(result["rel"])
-        cnt += 1
-
-        # [CAVEAT] Following code calculates metrics for each gt item.
-        # for iid in groudtruth[uid]:
-        #     result = evaluate_once(topk_preds, [iid])
-        #     avg_prec += result["precision@k"]
-        #     avg_recall += result["recall@k"]
-        #     avg_ndcg += result["ndcg@k"]
-        #     avg_hit += result["hit@k"]
-        #     rs.append(result["rel"])
-        #     cnt += 1
-
-    avg_prec = avg_prec / cnt
-    avg_recall = avg_recall / cnt
-    avg_ndcg = avg_ndcg / cnt
-    avg_hit = avg_hit / cnt
-    map_ = mean_average_precision(rs)
-    mrr = mean_reciprocal_rank(rs)
+        for iid, score in user_item_scores[uid].items():
+            indices.append(item_index.setdefault(iid, len(item_index)))
+            data.append(score)
+        indptr.append(len(indices))
+        relevant.append([item_index.setdefault(iid, len(item_index)) for iid in set(groudtruth[uid])])
+    scores = CSRScores(np.asarray(indptr, dtype=np.int64), np.asarray(indices, dtype=np.int64),
+                       np.asarray(data, dtype=np.float64), (len(user_item_scores), len(item_index)))
+    sums, cnt = evaluate_matrix(scores, relevant, topk, seed, chunk_size)
+
+    avg_prec = sums['precision'] / cnt
+    avg_recall = sums['recall'] / cnt
+    avg_ndcg = sums['ndcg'] / cnt
+    avg_hit = sums['hit'] / cnt
+    map_ = sums['map'] / cnt
+    mrr = sums['mrr'] / cnt
     msg = "\nNDCG@{}\tRec@{}\tHits@{}\tPrec@{}\tMAP@{}\tMRR@{}".format(topk, topk, topk, topk, topk, topk)
     msg += "\n{:.4f}\t{:.4f}\t{:.4f}\t{:.4f}\t{:.4f}\t{:.4f}".format(avg_ndcg, avg_recall, avg_hit, avg_prec, map_, mrr)
-    # msg = "NDCG@{}\tRec@{}\tMAP@{}".format(topk, topk, topk)
-    # msg += "\n{:.4f}\t{:.4f}\t{:.4f}".format(avg_ndcg, avg_recall, map)
     print(msg)
     res = {
         'ndcg': avg_ndcg,
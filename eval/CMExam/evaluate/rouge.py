@@ -56,7 +56,11 @@ def _len_lcs(x, y):
   """
   Returns the length of the Longest Common Subsequence between sequences x
   and y.
-  Source: http://www.algorithmist.com/index.php/Longest_Common_Subsequence
+
+  Bit-parallel algorithm of Hyyro (2004): every token of the shorter sequence
+  is one bit of a Python int, and each token of the longer one updates all of
+  them with a few big-int operations. Runs in O(nm/w) time and O(min(n, m))
+  memory, without building the DP table.
 
   Args:
     x: sequence of words
@@ -65,9 +69,20 @@ def _len_lcs(x, y):
   Returns
     integer: Length of LCS between x and y
   """
-  table = _lcs(x, y)
-  n, m = len(x), len(y)
-  return table[n, m]
+  if len(x) > len(y):
+    x, y = y, x
+  n = len(x)
+  if n == 0:
+    return 0
+  masks = {}
+  for i, token in enumerate(x):
+    masks[token] = masks.get(token, 0) | (1 << i)
+  full = (1 << n) - 1
+  v = full
+  for token in y:
+    u = v & masks.get(token, 0)
+    v = ((v + u) | (v - u)) & full
+  return n - bin(v).count("1")
 
 
 def _lcs(x, y):
@@ -77,23 +92,27 @@ def _lcs(x, y):
   in O(nm) time where n = len(x) and m = len(y).
   Source: http://www.algorithmist.com/index.php/Longest_Common_Subsequence
 
+  Each row is the running maximum of the previous row and its diagonal
+  matches, so it is computed with NumPy instead of one Python step per cell.
+
   Args:
     x: collection of words
     y: collection of words
 
   Returns:
-    Table of dictionary of coord and len lcs
+    (n + 1) x (m + 1) array, table[i, j] is the len lcs of x[:i] and y[:j]
   """
   n, m = len(x), len(y)
-  table = dict()
-  for i in range(n + 1):
-    for j in range(m + 1):
-      if i == 0 or j == 0:
-        table[i, j] = 0
-      elif x[i - 1] == y[j - 1]:
-        table[i, j] = table[i - 1, j - 1] + 1
-      else:
-        table[i, j] = max(table[i - 1, j], table[i, j - 1])
+  table = np.zeros((n + 1, m + 1), dtype=np.int32)
+  if n == 0 or m == 0:
+    return table
+  ids = {}
+  y_ids = np.array([ids.setdefault(token, len(ids)) for token in y])
+  for i in range(1, n + 1):
+    matches = y_ids == ids.get(x[i - 1], -1)
+    row = table[i - 1, 1:].copy()
+    np.maximum(row, np.where(matches, table[i - 1, :-1] + 1, 0), out=row)
+    np.maximum.accumulate(row, out=table[i, 1:])
   return table
 
 
@@ -111,20 +130,17 @@ def _recon_lcs(x, y):
   """
   i, j = len(x), len(y)
   table = _lcs(x, y)
-
-  def _recon(i, j):
-    """private recon calculation"""
-    if i == 0 or j == 0:
-      return []
-    elif x[i - 1] == y[j - 1]:
-      return _recon(i - 1, j - 1) + [(x[i - 1], i)]
+  recon = []
+  # walked back iteratively, long character-split texts exceed the recursion limit
+  while i > 0 and j > 0:
+    if x[i - 1] == y[j - 1]:
+      recon.append(x[i - 1])
+      i, j = i - 1, j - 1
     elif table[i - 1, j] > table[i, j - 1]:
-      return _recon(i - 1, j)
+      i -= 1
     else:
-      return _recon(i, j - 1)
-
-  recon_tuple = tuple(map(lambda x: x[0], _recon(i, j)))
-  return recon_tuple
+      j -= 1
+  return tuple(reversed(recon))
 
 
 def rouge_n(evaluated_sentences, reference_sentences, n=2):
@@ -155,7 +171,21 @@ def rouge_n(evaluated_sentences, reference_sentences, n=2):
   # Gets the overlapping ngrams between evaluated and reference
   overlapping_ngrams = evaluated_ngrams.intersection(reference_ngrams)
   overlapping_count = len(overlapping_ngrams)
+  return _f_p_r_ngrams(overlapping_count, evaluated_count, reference_count)
+
 
+def _f_p_r_ngrams(overlapping_count, evaluated_count, reference_count):
+  """
+  Computes ROUGE-N from the number of distinct n-grams of both sides.
+
+  Args:
+    overlapping_count: number of n-grams found on both sides
+    evaluated_count: number of n-grams of the evaluated sentences
+    reference_count: number of n-grams of the reference sentences
+
+  Returns:
+    A tuple (f1, precision, recall) for ROUGE-N
+  """
   # Handle edge case. This isn't mathematically correct, but it's good enough
   if evaluated_count == 0:
     precision = 0.0
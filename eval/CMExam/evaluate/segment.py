@@ -0,0 +1,94 @@
+import os
+import json
+import sqlite3
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+
+
+def _init_worker():
+    # the dictionary is loaded once per worker, not once per chunk
+    import jieba
+    jieba.setLogLevel(60)
+    jieba.initialize()
+
+
+def _cut(texts):
+    import jieba
+    return [jieba.lcut(text) for text in texts]
+
+
+class Segmenter:
+    """jieba words of many texts, each distinct text segmented once.
+
+    Segmentations are cached in SQLite keyed by a hash of the text and the jieba version, so re-scoring a
+    prediction file never loads the jieba dictionary again. Texts missing from the cache are segmented
+    in a process pool when `num_workers > 1`; the pool is kept until `close`, so segmenting a file chunk by
+    chunk loads the dictionary once per worker.
+    """
+
+    def __init__(self, cache_path=None, num_workers=1, chunk_size=512):
+        self.num_workers = num_workers
+        self.chunk_size = chunk_size
+        self._conn = None
+        self._executor = None
+        if cache_path:
+            dirname = os.path.dirname(cache_path)
+            if dirname:
+                os.makedirs(dirname, exist_ok=True)
+            self._conn = sqlite3.connect(cache_path, timeout=60)
+            self._conn.execute('CREATE TABLE IF NOT EXISTS segments (key TEXT PRIMARY KEY, tokens TEXT)')
+        self._salt = None
+
+    def make_key(self, text):
+        if self._salt is None:
+            # importing jieba is cheap, its dictionary is only loaded by the first segmentation
+            import jieba
+            self._salt = f'jieba-{jieba.__version__}'.encode('utf-8')
+        return hashlib.blake2b(text.encode('utf-8'), digest_size=16, key=self._salt).hexdigest()
+
+    def lookup(self, keys):
+        found = {}
+        if self._conn is None:
+            return found
+        # sqlite limits the number of bound parameters
+        for start in range(0, len(keys), 500):
+            batch = keys[start:start + 500]
+            rows = self._conn.execute(
+                f'SELECT key, tokens FROM segments WHERE key IN ({",".join("?" * len(batch))})', batch)
+            found.update((key, json.loads(tokens)) for key, tokens in rows)
+        return found
+
+    def store(self, segmented):
+        if self._conn is None:
+            return
+        with self._conn:
+            self._conn.executemany('INSERT OR REPLACE INTO segments VALUES (?, ?)',
+                                   [(key, json.dumps(tokens, ensure_ascii=False)) for key, tokens in segmented.items()])
+
+    def cut(self, texts):
+        chunks = [texts[start:start + self.chunk_size] for start in range(0, len(texts), self.chunk_size)]
+        if self.num_workers <= 1 or len(chunks) < 2:
+            _init_worker()
+            return [tokens for chunk in chunks for tokens in _cut(chunk)]
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(self.num_workers, initializer=_init_worker)
+        return [tokens for segmented in self._executor.map(_cut, chunks) for tokens in segmented]
+
+    def segment(self, texts):
+        """Token lists of `texts`, in order."""
+        keys = {text: self.make_key(text) for text in texts}
+        tokens = self.lookup(list(set(keys.values())))
+        missing = [text for text, key in keys.items() if key not in tokens]
+        if missing:
+            segmented = dict(zip((keys[text] for text in missing), self.cut(missing)))
+            self.store(segmented)
+            tokens.update(segmented)
+        return [tokens[keys[text]] for text in texts]
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
@@ -0,0 +1,167 @@
+import numpy as np
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from .bleu import bleu_from_counts
+from .rouge import _f_p_r_lcs, _f_p_r_ngrams, _len_lcs
+
+# token ids start at 1, so the n-grams of order k are exactly the ints in [BASE ** (k - 1), BASE ** k)
+NGRAM_BASE = 1 << 32
+
+
+class TokenIds:
+    """Gives every distinct token an int; one instance per hypothesis/reference pair keeps the ids small."""
+
+    def __init__(self):
+        self.ids = {}
+
+    def __call__(self, tokens):
+        ids = self.ids
+        return [ids.setdefault(token, len(ids) + 1) for token in tokens]
+
+
+def ngram_ids(ids, max_order):
+    """All n-grams of `ids` up to `max_order` as ints, one list per order."""
+    orders = [ids]
+    for order in range(1, max_order):
+        orders.append([prefix * NGRAM_BASE + token for prefix, token in zip(orders[-1], ids[order:])])
+    return orders
+
+
+def rouge_tokens(text):
+    """Characters of `text`, split the way `rouge()` splits the space-joined characters."""
+    return ' '.join(list(text)).split(' ')
+
+
+def jieba_tokens(text):
+    """jieba words of `text`; a module-level function, so it can be sent to worker processes."""
+    import jieba
+    return jieba.lcut(text)
+
+
+def pair_stats(hypothesis, reference, tokenize=list, max_order=4, tokens=None, legacy_rouge=True):
+    """BLEU counts (matches and possible n-grams per order, both lengths) and ROUGE-1/2/L (f, p, r) of a pair.
+
+    BLEU is counted on `tokens`, the (hypothesis, reference) token lists, if given; `max_order=0` skips it.
+    With `legacy_rouge`, ROUGE scores the reference against the hypothesis, the way evaluate_chatglm.py always
+    has, which swaps precision and recall.
+    """
+    vocab = TokenIds()
+    matches, possible = [], []
+    hypothesis_length = reference_length = 0
+    if max_order:
+        hyp_tokens, ref_tokens = tokens or (tokenize(hypothesis), tokenize(reference))
+        hyp, ref = vocab(hyp_tokens), vocab(ref_tokens)
+        for hyp_ngrams, ref_ngrams in zip(ngram_ids(hyp, max_order), ngram_ids(ref, max_order)):
+            matches.append(sum((Counter(hyp_ngrams) & Counter(ref_ngrams)).values()))
+            possible.append(len(hyp_ngrams))
+        hypothesis_length, reference_length = len(hyp), len(ref)
+
+    hyp, ref = vocab(rouge_tokens(hypothesis)), vocab(rouge_tokens(reference))
+    if legacy_rouge:
+        hyp, ref = ref, hyp
+    scores = []
+    for hyp_ngrams, ref_ngrams in zip(ngram_ids(hyp, 2), ngram_ids(ref, 2)):
+        hyp_ngrams, ref_ngrams = set(hyp_ngrams), set(ref_ngrams)
+        scores += _f_p_r_ngrams(len(hyp_ngrams & ref_ngrams), len(hyp_ngrams), len(ref_ngrams))
+    scores += _f_p_r_lcs(_len_lcs(hyp, ref), len(ref), len(hyp))
+    return matches, possible, hypothesis_length, reference_length, scores
+
+
+class CorpusStats:
+    """Sufficient statistics of BLEU and ROUGE over a slice of the corpus.
+
+    BLEU keeps the clipped matches and possible n-grams per order and the two lengths, ROUGE the per-pair
+    (f, p, r) of ROUGE-1/2/L. Stats of consecutive slices `merge` into exactly the stats of the whole
+    corpus, so the scores do not depend on how the corpus was split.
+    """
+
+    def __init__(self, max_order=4, legacy_rouge=True):
+        self.max_order = max_order
+        self.legacy_rouge = legacy_rouge
+        self.matches = [0] * max_order
+        self.possible = [0] * max_order
+        self.hypothesis_length = 0
+        self.reference_length = 0
+        self.rouge = []
+
+    def add(self, hypothesis, reference, tokenize=list, tokens=None):
+        """Adds one hypothesis/reference pair of texts."""
+        matches, possible, hypothesis_length, reference_length, scores = pair_stats(
+            hypothesis, reference, tokenize, self.max_order, tokens, self.legacy_rouge)
+        self.matches = [a + b for a, b in zip(self.matches, matches)]
+        self.possible = [a + b for a, b in zip(self.possible, possible)]
+        self.hypothesis_length += hypothesis_length
+        self.reference_length += reference_length
+        self.add_rouge(scores)
+
+    def add_rouge(self, scores):
+        self.rouge.append(scores)
+
+    def merge_rouge(self, other):
+        self.rouge += other.rouge
+
+    def rouge_means(self):
+        return [np.mean(column) for column in zip(*self.rouge)]
+
+    def merge(self, other):
+        """Appends the stats of the slice following this one."""
+        self.matches = [a + b for a, b in zip(self.matches, other.matches)]
+        self.possible = [a + b for a, b in zip(self.possible, other.possible)]
+        self.hypothesis_length += other.hypothesis_length
+        self.reference_length += other.reference_length
+        self.merge_rouge(other)
+        return self
+
+    def metrics(self, bleu_orders=(1, 2, 4), smooth=False):
+        metrics = {}
+        for n in bleu_orders:
+            bleu = bleu_from_counts(self.matches[:n], self.possible[:n], self.hypothesis_length,
+                                    self.reference_length, n, smooth)[0]
+            metrics[f'BLEU-{n}'] = bleu * 100
+        # (f, p, r) per ROUGE variant
+        means = self.rouge_means()
+        for i, name in enumerate(['rouge_1', 'rouge_2', 'rouge_l']):
+            f, p, r = means[3 * i:3 * i + 3]
+            metrics.update({f'{name}/f_score': f * 100, f'{name}/r_score': r * 100, f'{name}/p_score': p * 100})
+        return metrics
+
+
+def corpus_stats(hypotheses, references, tokenize=list, max_order=4, tokens=None, legacy_rouge=True):
+    stats = CorpusStats(max_order, legacy_rouge)
+    for i, (hypothesis, reference) in enumerate(zip(hypotheses, references)):
+        stats.add(hypothesis, reference, tokenize, tokens and (tokens[0][i], tokens[1][i]))
+    return stats
+
+
+def _shard_stats(args):
+    return corpus_stats(*args)
+
+
+def text_metrics(hypotheses, references, tokenize=list, bleu_orders=(1, 2, 4), smooth=False, num_workers=1,
+                 tokens=None, legacy_rouge=True):
+    """Corpus BLEU-n for every n of `bleu_orders` and ROUGE-1/2/L of hypothesis/reference texts, in one pass.
+
+    BLEU is computed on `tokenize(text)` (e.g. `jieba_tokens`), ROUGE on characters; each text is tokenized
+    once and its n-grams of every order are extracted together. Scores are percentages and equal to
+    `bleu_score(references, hypotheses)` and, with `legacy_rouge`, to `rouge_score(hypotheses, references)` as
+    evaluate_chatglm.py called it; `legacy_rouge=False` gives `rouge_score(references, hypotheses)`. With `num_workers > 1` contiguous shards are scored
+    in a process pool (`tokenize` must be picklable) and their stats merged in order, giving the same scores.
+
+    `tokens`, the BLEU token lists of the hypotheses and of the references (e.g. from a `Segmenter`), replaces
+    `tokenize`. With `bleu_orders=()` only the character ROUGE is computed, without any segmentation.
+    """
+    max_order = max(bleu_orders, default=0)
+    if num_workers <= 1 or len(hypotheses) < 2 * num_workers:
+        return corpus_stats(hypotheses, references, tokenize, max_order, tokens, legacy_rouge).metrics(
+            bleu_orders, smooth)
+    hypotheses, references = list(hypotheses), list(references)
+    # a few shards per worker, so a slow shard does not leave the other cores idle
+    shard_size = -(-len(hypotheses) // (4 * num_workers))
+    shards = [(hypotheses[start:start + shard_size], references[start:start + shard_size], tokenize, max_order,
+               tokens and (tokens[0][start:start + shard_size], tokens[1][start:start + shard_size]), legacy_rouge)
+              for start in range(0, len(hypotheses), shard_size)]
+    stats = CorpusStats(max_order, legacy_rouge)
+    with ProcessPoolExecutor(num_workers) as executor:
+        for shard in executor.map(_shard_stats, shards):
+            stats.merge(shard)
+    return stats.metrics(bleu_orders, smooth)
@@ -1,10 +1,17 @@
 import os
+import json
 import math
 import torch
 import heapq
-import random
+import queue
 import pickle
+import random
+import hashlib
 import datetime
+import threading
+import numpy as np
+from array import array
+from collections import Counter
 from .rouge import rouge
 from .bleu import compute_bleu
 
@@ -44,15 +51,8 @@ def two_seq_same(sa, sb):
 
 
 def unique_sentence_percent(sequence_batch):
-    unique_seq = []
-    for seq in sequence_batch:
-        count = 0
-        for uni_seq in unique_seq:
-            if two_seq_same(seq, uni_seq):
-                count += 1
-                break
-        if count == 0:
-            unique_seq.append(seq)
+    # sequences are equal exactly when their tuples are, so a set finds the unique ones in one pass
+    unique_seq = set(tuple(seq) for seq in sequence_batch)
 
     return len(unique_seq) / len(sequence_batch), len(unique_seq)
 
@@ -89,11 +89,9 @@ def feature_coverage_ratio(feature_batch, feature_set):
 def feature_diversity(feature_batch):
     list_len = len(feature_batch)
 
-    total_count = 0
-    for i, x in enumerate(feature_batch):
-        for j in range(i + 1, list_len):
-            y = feature_batch[j]
-            total_count += len(x & y)
+    # the summed pairwise intersections count, for every feature, the pairs of sets sharing it
+    feature_count = Counter(fea for fea_set in feature_batch for fea in fea_set)
+    total_count = sum(count * (count - 1) // 2 for count in feature_count.values())
 
     denominator = list_len * (list_len - 1) / 2
     return total_count / denominator
@@ -164,58 +162,143 @@ class EntityDictionary:
         return len(self.idx2entity)
 
 
+class Reviews:
+    """Reviews of a split, columns of the whole corpus indexed by `index`; no per-review Python objects.
+
+    Review texts are word ids in one flat int32 array, review `j` spans `text_offsets[j]:text_offsets[j + 1]`.
+    `reviews[i]` still gives the dict of the i-th review of the split.
+    """
+
+    def __init__(self, columns, index):
+        self.columns = columns
+        self.index = index
+
+    def __len__(self):
+        return len(self.index)
+
+    def __getitem__(self, i):
+        j = self.index[i]
+        start, stop = self.columns['text_offsets'][j:j + 2]
+        return {'user': int(self.columns['user'][j]),
+                'item': int(self.columns['item'][j]),
+                'rating': self.columns['rating'][j].item(),
+                'text': self.columns['text_ids'][start:stop].tolist(),
+                'feature': int(self.columns['feature'][j])}
+
+    def tensors(self, seq_len, pad, bos, eos):
+        """user, item, rating, `sentence_format`ted seq and feature tensors of the split."""
+        columns, index = self.columns, self.index
+        starts = columns['text_offsets'][index]
+        lengths = np.minimum(columns['text_offsets'][index + 1] - starts, seq_len)
+        seq = np.full((len(index), seq_len + 2), pad, dtype=np.int64)
+        seq[:, 0] = bos
+        rows = np.repeat(np.arange(len(index)), lengths)
+        positions = np.arange(len(rows)) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+        seq[rows, positions + 1] = columns['text_ids'][np.repeat(starts, lengths) + positions]
+        seq[np.arange(len(index)), lengths + 1] = eos
+        return (torch.from_numpy(columns['user'][index].astype(np.int64)),
+                torch.from_numpy(columns['item'][index].astype(np.int64)),
+                torch.from_numpy(columns['rating'][index].astype(np.float32)),
+                torch.from_numpy(seq),
+                torch.from_numpy(columns['feature'][index].astype(np.int64)[:, None]))
+
+
 class DataLoader:
-    def __init__(self, data_path, index_dir, vocab_size):
+    COLUMNS = ('user', 'item', 'rating', 'feature', 'text_ids', 'text_offsets')
+
+    def __init__(self, data_path, index_dir, vocab_size, cache_dir=None):
         self.word_dict = WordDictionary()
         self.user_dict = EntityDictionary()
         self.item_dict = EntityDictionary()
         self.max_rating = float('-inf')
         self.min_rating = float('inf')
-        self.initialize(data_path)
-        self.word_dict.keep_most_frequent(vocab_size)
-        self.__unk = self.word_dict.word2idx['<unk>']
         self.feature_set = set()
-        self.train, self.valid, self.test = self.load_data(data_path, index_dir)
+        path = os.path.join(cache_dir, self.make_key(data_path, vocab_size)) if cache_dir else None
+        if path and os.path.exists(f'{path}.json'):
+            columns = self.load_cache(path)
+        else:
+            columns = self.initialize(data_path, vocab_size)
+            if path:
+                os.makedirs(cache_dir, exist_ok=True)
+                self.save_cache(path, columns)
+        self.__unk = self.word_dict.word2idx['<unk>']
+        self.train, self.valid, self.test = [Reviews(columns, np.asarray(index, dtype=np.int64))
+                                             for index in self.load_index(index_dir)]
+
+    @staticmethod
+    def make_key(data_path, vocab_size):
+        stat = os.stat(data_path)
+        key = f'{os.path.abspath(data_path)}:{stat.st_size}:{stat.st_mtime_ns}:{vocab_size}'
+        return hashlib.sha256(key.encode('utf-8')).hexdigest()
 
-    def initialize(self, data_path):
+    def initialize(self, data_path, vocab_size):
+        """Reads the reviews once: dictionaries, ratings and the word ids of every review as flat arrays."""
         assert os.path.exists(data_path)
-        reviews = pickle.load(open(data_path, 'rb'))
-        for review in reviews:
+        with open(data_path, 'rb') as f:
+            reviews = pickle.load(f)
+        columns = {name: np.empty(len(reviews), dtype=np.int32) for name in ('user', 'item', 'feature')}
+        columns['rating'] = np.empty(len(reviews), dtype=np.float64)
+        columns['text_offsets'] = np.zeros(len(reviews) + 1, dtype=np.int64)
+        # word ids before `keep_most_frequent` renumbers the vocabulary
+        text_ids = array('i')
+        word2idx = self.word_dict.word2idx
+        for row, review in enumerate(reviews):
             self.user_dict.add_entity(review['user'])
             self.item_dict.add_entity(review['item'])
+            columns['user'][row] = self.user_dict.entity2idx[review['user']]
+            columns['item'][row] = self.item_dict.entity2idx[review['item']]
             (fea, adj, tem, sco) = review['template']
-            self.word_dict.add_sentence(tem)
+            for w in tem.split():
+                self.word_dict.add_word(w)
+                text_ids.append(word2idx[w])
+            columns['text_offsets'][row + 1] = len(text_ids)
             self.word_dict.add_word(fea)
+            columns['feature'][row] = word2idx[fea]
             rating = review['rating']
+            columns['rating'][row] = rating
             if self.max_rating < rating:
                 self.max_rating = rating
             if self.min_rating > rating:
                 self.min_rating = rating
+        del reviews
 
-    def load_data(self, data_path, index_dir):
-        data = []
-        reviews = pickle.load(open(data_path, 'rb'))
-        for review in reviews:
-            (fea, adj, tem, sco) = review['template']
-            data.append({'user': self.user_dict.entity2idx[review['user']],
-                         'item': self.item_dict.entity2idx[review['item']],
-                         'rating': review['rating'],
-                         'text': self.seq2ids(tem),
-                         'feature': self.word_dict.word2idx.get(fea, self.__unk)})
-            if fea in self.word_dict.word2idx:
-                self.feature_set.add(fea)
-            else:
-                self.feature_set.add('<unk>')
-
-        train_index, valid_index, test_index = self.load_index(index_dir)
-        train, valid, test = [], [], []
-        for idx in train_index:
-            train.append(data[idx])
-        for idx in valid_index:
-            valid.append(data[idx])
-        for idx in test_index:
-            test.append(data[idx])
-        return train, valid, test
+        old_idx2word = self.word_dict.idx2word
+        self.word_dict.keep_most_frequent(vocab_size)
+        word2idx = self.word_dict.word2idx
+        remap = np.array([word2idx.get(w, word2idx['<unk>']) for w in old_idx2word], dtype=np.int32)
+        columns['text_ids'] = remap[np.frombuffer(text_ids, dtype=np.int32)]
+        for fea in np.unique(columns['feature']):
+            self.feature_set.add(old_idx2word[fea] if old_idx2word[fea] in word2idx else '<unk>')
+        columns['feature'] = remap[columns['feature']]
+        return columns
+
+    def save_cache(self, path, columns):
+        # written under temporary names and renamed, the json last, so a partial cache is never read
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        for name in self.COLUMNS:
+            with open(tmp_path, 'wb') as f:
+                np.save(f, columns[name])
+            os.replace(tmp_path, f'{path}.{name}.npy')
+        meta = {'idx2word': self.word_dict.idx2word, 'users': self.user_dict.idx2entity,
+                'items': self.item_dict.idx2entity, 'max_rating': self.max_rating, 'min_rating': self.min_rating,
+                'feature_set': sorted(self.feature_set)}
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False)
+        os.replace(tmp_path, f'{path}.json')
+
+    def load_cache(self, path):
+        """Dictionaries of a cached corpus, and its columns memory-mapped."""
+        with open(f'{path}.json', encoding='utf-8') as f:
+            meta = json.load(f)
+        self.word_dict.idx2word = meta['idx2word']
+        self.word_dict.word2idx = {w: i for i, w in enumerate(meta['idx2word'])}
+        for entity_dict, entities in ((self.user_dict, meta['users']), (self.item_dict, meta['items'])):
+            entity_dict.idx2entity = entities
+            entity_dict.entity2idx = {e: i for i, e in enumerate(entities)}
+        self.max_rating = meta['max_rating']
+        self.min_rating = meta['min_rating']
+        self.feature_set = set(meta['feature_set'])
+        return {name: np.load(f'{path}.{name}.npy', mmap_mode='r') for name in self.COLUMNS}
 
     def seq2ids(self, seq):
         return [self.word_dict.word2idx.get(w, self.__unk) for w in seq.split()]
@@ -240,46 +323,148 @@ def sentence_format(sentence, max_len, pad, bos, eos):
 
 
 class Batchify:
-    def __init__(self, data, word2idx, seq_len=15, batch_size=128, shuffle=False):
+    """Batches of (user, item, rating, seq, feature), reshuffled at every new epoch if `shuffle`.
+
+    All columns live in one packed int64 tensor (the float32 rating as its bits); a batch is gathered with a
+    single `index_select` and split into contiguous column tensors, pinned when CUDA is available. They are
+    fresh tensors unless `reuse_buffers`, which copies them into a few preallocated sets instead: those are
+    overwritten by later batches, so a batch must not be kept past the next `next_batch` call. With `prefetch`,
+    a background thread gathers the next batch while the current one is used; `step` still counts the batches
+    returned and `close` stops the thread. Without a `seed`, the shuffles follow `random.seed` as `random.shuffle`
+    did.
+    """
+
+    def __init__(self, data, word2idx, seq_len=15, batch_size=128, shuffle=False, prefetch=False, pin_memory=None,
+                 seed=None, reuse_buffers=False):
         bos = word2idx['<bos>']
         eos = word2idx['<eos>']
         pad = word2idx['<pad>']
-        u, i, r, t, f = [], [], [], [], []
-        for x in data:
-            u.append(x['user'])
-            i.append(x['item'])
-            r.append(x['rating'])
-            t.append(sentence_format(x['text'], seq_len, pad, bos, eos))
-            f.append([x['feature']])
-
-        self.user = torch.tensor(u, dtype=torch.int64).contiguous()
-        self.item = torch.tensor(i, dtype=torch.int64).contiguous()
-        self.rating = torch.tensor(r, dtype=torch.float).contiguous()
-        self.seq = torch.tensor(t, dtype=torch.int64).contiguous()
-        self.feature = torch.tensor(f, dtype=torch.int64).contiguous()
+        if isinstance(data, Reviews):
+            user, item, rating, seq, feature = data.tensors(seq_len, pad, bos, eos)
+        else:
+            u, i, r, t, f = [], [], [], [], []
+            for x in data:
+                u.append(x['user'])
+                i.append(x['item'])
+                r.append(x['rating'])
+                t.append(sentence_format(x['text'], seq_len, pad, bos, eos))
+                f.append([x['feature']])
+
+            user = torch.tensor(u, dtype=torch.int64)
+            item = torch.tensor(i, dtype=torch.int64)
+            rating = torch.tensor(r, dtype=torch.float)
+            seq = torch.tensor(t, dtype=torch.int64).reshape(len(t), seq_len + 2)
+            feature = torch.tensor(f, dtype=torch.int64).reshape(len(f), 1)
+        # columns: user, item, rating bits, feature, seq
+        self.packed = torch.cat([user[:, None], item[:, None], rating.view(torch.int32).to(torch.int64)[:, None],
+                                 feature, seq], dim=1).contiguous()
         self.shuffle = shuffle
         self.batch_size = batch_size
         self.sample_num = len(data)
-        self.index_list = list(range(self.sample_num))
         self.total_step = int(math.ceil(self.sample_num / self.batch_size))
         self.step = 0
-
-    def next_batch(self):
-        if self.step == self.total_step:
-            self.step = 0
+        self.generator = torch.Generator()
+        self.generator.manual_seed(seed if seed is not None else random.getrandbits(63))
+        self.index = torch.arange(self.sample_num)
+        if pin_memory is None:
+            pin_memory = torch.cuda.is_available()
+        self.pin_memory = pin_memory
+        # only the gathering thread writes the packed batch, it is split into the returned columns right away
+        self._gathered = torch.empty((batch_size, self.packed.shape[1]), dtype=torch.int64)
+        # the batch being returned, the one being gathered and one waiting in the queue never share a buffer
+        self.buffers = [self.empty_columns(batch_size) for _ in range(3 if prefetch else 1)] if reuse_buffers else None
+        self.prefetch = prefetch
+        self._produced = 0
+        self._produce_step = 0
+        self._queue = None
+        self._thread = None
+        self._stop = threading.Event()
+
+    @property
+    def user(self):
+        return self.packed[:, 0]
+
+    @property
+    def item(self):
+        return self.packed[:, 1]
+
+    @property
+    def rating(self):
+        return self.packed[:, 2].to(torch.int32).view(torch.float32)
+
+    @property
+    def feature(self):
+        return self.packed[:, 3:4]
+
+    @property
+    def seq(self):
+        return self.packed[:, 4:]
+
+    def empty_columns(self, size):
+        """Uninitialised user, item, rating, seq and feature tensors of a batch of `size`."""
+        seq_width = self.packed.shape[1] - 4
+        return (torch.empty(size, dtype=torch.int64, pin_memory=self.pin_memory),
+                torch.empty(size, dtype=torch.int64, pin_memory=self.pin_memory),
+                torch.empty(size, dtype=torch.float32, pin_memory=self.pin_memory),
+                torch.empty((size, seq_width), dtype=torch.int64, pin_memory=self.pin_memory),
+                torch.empty((size, 1), dtype=torch.int64, pin_memory=self.pin_memory))
+
+    def gather(self):
+        """Gathers the batch following the last gathered one, returns its step and its columns."""
+        if self._produce_step == self.total_step:
+            self._produce_step = 0
             if self.shuffle:
-                random.shuffle(self.index_list)
+                self.index = torch.randperm(self.sample_num, generator=self.generator)
 
-        start = self.step * self.batch_size
+        start = self._produce_step * self.batch_size
         offset = min(start + self.batch_size, self.sample_num)
-        self.step += 1
-        index = self.index_list[start:offset]
-        user = self.user[index]  # (batch_size,)
-        item = self.item[index]
-        rating = self.rating[index]
-        seq = self.seq[index]  # (batch_size, seq_len)
-        feature = self.feature[index]  # (batch_size, 1)
-        return user, item, rating, seq, feature
+        self._produce_step += 1
+        batch = self._gathered[:offset - start]
+        torch.index_select(self.packed, 0, self.index[start:offset], out=batch)
+        if self.buffers is None:
+            columns = self.empty_columns(offset - start)
+        else:
+            columns = [column[:offset - start] for column in self.buffers[self._produced % len(self.buffers)]]
+            self._produced += 1
+        user, item, rating, seq, feature = columns
+        user.copy_(batch[:, 0])  # (batch_size,)
+        item.copy_(batch[:, 1])
+        rating.view(torch.int32).copy_(batch[:, 2])
+        seq.copy_(batch[:, 4:])  # (batch_size, seq_len)
+        feature.copy_(batch[:, 3:4])  # (batch_size, 1)
+        return self._produce_step, (user, item, rating, seq, feature)
+
+    def _prefetch_loop(self):
+        while not self._stop.is_set():
+            batch = self.gather()
+            while not self._stop.is_set():
+                try:
+                    self._queue.put(batch, timeout=0.1)
+                    break
+                except queue.Full:
+                    pass
+
+    def next_batch(self):
+        if self.prefetch:
+            if self._stop.is_set():
+                raise RuntimeError('next_batch after close')
+            if self._thread is None:
+                # a queue of one batch, so the thread is at most two batches ahead of the three buffers
+                self._queue = queue.Queue(maxsize=1)
+                self._thread = threading.Thread(target=self._prefetch_loop, daemon=True)
+                self._thread.start()
+            self.step, batch = self._queue.get()
+        else:
+            self.step, batch = self.gather()
+        return batch
+
+    def close(self):
+        """Stops the prefetch thread; the batches it gathered ahead are dropped."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+            self._queue = None
 
 
 def now_time():
@@ -1,35 +1,152 @@
+import os
 import re
+import sys
 import string
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(BASE_DIR)
+sys.path.append(os.path.dirname(BASE_DIR))
+from evaluate.accumulators import TextMetrics
+from evaluate.suite import jieba_tokens
+from engine.evaluator import EngineEvaluator
 
 
-class Evaluator:
+class Evaluator(EngineEvaluator):
+    # put in front of the first few-shot example
+    few_shot_header = "以下是中国关于{subject}考试的选择题，请选出其中的正确答案。\n\n"
+
     def __init__(self, choices, model_name, k=-1):
         self.choices = choices
         self.model_name = model_name
         self.k = k
         self.puncs = list(string.punctuation)
+        # LoRA adapters attached next to each other on the base model, name -> path
+        self.adapters = {}
+        # number of few-shot examples in the prompt of every question of the last subject
+        self.n_shots = []
 
-    def format_example(self, line, include_answer=True):
-        example = line['question']
+    def format_example(self, line, include_answer=True, cot=False, add_prompt=''):
+        example = add_prompt + line['Question']
         # print(example)
-        for choice in self.choices:
-            example += f'\n{choice}. {line[f"{choice}"]}'
+        # for choice in self.choices:
+        #     example += f'\n{choice}. {line[f"{choice}"]}'
+        example += f'\n{line["Options"]}'
         example += '\n答案：'
         if include_answer:
-            example += f'{line["answer"]}\n\n'
+            if cot:
+                ans = "让我们一步一步思考，\n" + \
+                    line["Explanation"] + f"\n所以答案是{line['Answer']}。"
+            else:
+                ans = line["Answer"]
+            m = (example, ans)
+            return m
         return example
 
-    def generate_few_shot_prompt(self, subject, dev_df):
-        prompt = f"以下是中国关于{subject}考试的单项选择题，请选出其中的正确答案。\n\n"
-        k = self.k
-        if self.k == -1:
-            k = dev_df.shape[0]
-        for i in range(k):
-            prompt += self.format_example(dev_df.iloc[i, :])
-        return prompt
-
-    def eval_subject(self, subject_name, test_df, dev_df=None, few_shot=False, save_result_dir=None):
-        pass
+    def format_questions(self, df):
+        """Vectorized `format_example(line, include_answer=False)` over every row of `df`."""
+        return list(df['Question'].astype(str) + '\n' + df['Options'].astype(str) + '\n答案：')
+
+    def explanation_scorer(self, subject_name, rows, num_reports=10):
+        """`on_batch` callback printing running BLEU/ROUGE of the CoT explanations against `Explanation`."""
+        metrics = TextMetrics(tokenize=jieba_tokens)
+        step = max(len(rows) // num_reports, 1)
+        next_report = [step]
+
+        def on_batch(indices, responses):
+            for i, response in zip(indices, responses):
+                reference = rows[i]['Explanation']
+                metrics.update(self.extract_explanation(response), reference if isinstance(reference, str) else '')
+            if len(metrics) >= next_report[0] or len(metrics) == len(rows):
+                next_report[0] = len(metrics) + step
+                scores = metrics.compute()
+                print(f'{subject_name}: {len(metrics)}/{len(rows)} explanations, '
+                      + ', '.join(f'{k} {scores[k]:.2f}' for k in ('BLEU-1', 'BLEU-4', 'rouge_l/f_score')))
+        return on_batch
+
+    @staticmethod
+    def extract_explanation(response):
+        """The reasoning of a CoT response, without the `让我们一步一步思考，` lead-in and the final answer."""
+        response = response.strip().split('所以答案是')[0]
+        if response.startswith('让我们一步一步思考，'):
+            response = response[len('让我们一步一步思考，'):]
+        return response.strip().replace(' ', '')
+
+    def eval_subject(self, subject_name, test_df, dev_df=None, few_shot=False, cot=False, save_result_dir=None, num_beams=1,
+                     do_sample=False, top_p=0.7, temperature=0.95, logits_processor=None, max_new_tokens=50,
+                     early_stop=False, output_scores=False, **kwargs):
+        rows = test_df.to_dict('records')
+        questions = self.format_questions(test_df)
+        if few_shot:
+            generation = self.answer_generation.updated(
+                processors=logits_processor or (), num_beams=num_beams, do_sample=do_sample, top_p=top_p,
+                temperature=temperature, max_new_tokens=max_new_tokens, output_scores=output_scores, **kwargs)
+            histories = self.few_shot_histories(subject_name, questions, dev_df, cot=cot)
+            prompts = self.few_shot_prompts(subject_name, questions, histories, generation)
+            on_batch = self.explanation_scorer(subject_name, rows) if cot else None
+            responses = self.engine.generate(prompts, generation, cot=cot, early_stop=early_stop, on_batch=on_batch)
+            responses = [response.strip() for response in responses]
+            # For ChatGLM, we use answer extraction in answer-only mode too.
+            results = [self.extract_cot_answer(row, response)[0] for row, response in zip(rows, responses)]
+        else:   # zero-shot by extracting answer from distribution
+            scores = self.engine.choice_scores(questions, self.dist_generation, self.choice_ids)
+            results = [self.choices[max(range(len(score)), key=score.__getitem__)] for score in scores]
+        print(f'{subject_name}: {self.engine.report()}')
+
+        answers = list(test_df['Answer'])
+        score = [int(ans == answer) for ans, answer in zip(results, answers)]
+        correct_ratio = 100*sum(score)/len(answers)
+
+        if save_result_dir:
+            if few_shot:
+                test_df['model_output'] = responses
+                test_df['n_shots'] = self.n_shots
+            test_df['correctness'] = score
+            test_df.to_csv(os.path.join(
+                save_result_dir, f'{subject_name}_test.csv'))
+
+        return correct_ratio
+
+    def extract_cot_answer(self, line, gen_ans):
+        m = re.findall(r'所以答案是(.+?)。', gen_ans, re.M)
+        if len(m) > 0 and m[-1] in self.choices:
+            return m[-1], True
+        answer_patterns = [
+            # r'([ABCD])是正确的',
+            # r'选项([ABCD])正确',
+            # r'答案为([ABCD])',
+            # r'答案是([ABCD])',
+            # r'答案([ABCD])',
+            # r'选择([ABCD])',
+            # r'答案：([ABCD])',
+            # r'选择答案([ABCD])',
+            r'([A-Z]+)',
+        ]
+        # RE extraction
+        for answer_pattern in answer_patterns:
+            m = re.search(answer_pattern, gen_ans, re.M)
+            if m:
+                answer = m.group(1)
+                return answer, False
+        # only containing one choice-character
+        m = re.findall(r'[ABCDE]', gen_ans, re.M)
+        if len(m) == 1:
+            answer = m[0]
+            return answer, False
+        answer_word_counter = 0
+        # only containing one choice-context
+        opions = line["Options"].split("\n")
+        options_dict = {}
+        for option in opions:
+            answer = option.split(" ")[0]
+            contet = option.split(" ")[1]
+            options_dict[answer] = contet
+
+        for c in self.choices:
+            if c in options_dict.keys() and options_dict[c] in gen_ans:
+                answer = c
+                answer_word_counter += 1
+        if answer_word_counter == 1:
+            return answer, False
+        return '-', False
 
     def normalize_answer(self, s):
 
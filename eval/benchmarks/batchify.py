@@ -0,0 +1,118 @@
+import os
+import sys
+import math
+import time
+import random
+import argparse
+
+import torch
+
+EVAL_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(EVAL_DIR, 'CMExam'))
+from evaluate.utils import Batchify, Reviews
+
+WORD2IDX = {'<bos>': 0, '<eos>': 1, '<pad>': 2, '<unk>': 3}
+
+
+class LegacyBatchify:
+    """Five tensors indexed with a Python list per batch, `random.shuffle` per epoch; kept as the reference."""
+
+    def __init__(self, batchify, batch_size=128, shuffle=False):
+        self.user, self.item, self.rating = batchify.user.clone(), batchify.item.clone(), batchify.rating.clone()
+        self.seq, self.feature = batchify.seq.clone(), batchify.feature.clone()
+        self.shuffle = shuffle
+        self.batch_size = batch_size
+        self.sample_num = len(self.user)
+        self.index_list = list(range(self.sample_num))
+        self.total_step = int(math.ceil(self.sample_num / self.batch_size))
+        self.step = 0
+
+    def next_batch(self):
+        if self.step == self.total_step:
+            self.step = 0
+            if self.shuffle:
+                random.shuffle(self.index_list)
+        start = self.step * self.batch_size
+        offset = min(start + self.batch_size, self.sample_num)
+        self.step += 1
+        index = self.index_list[start:offset]
+        return self.user[index], self.item[index], self.rating[index], self.seq[index], self.feature[index]
+
+
+def make_reviews(num_samples, seq_len, seed=0):
+    """Random columns in the `DataLoader` layout, texts of 1 to 2 * seq_len words."""
+    generator = torch.Generator().manual_seed(seed)
+    lengths = torch.randint(1, 2 * seq_len, (num_samples,), generator=generator)
+    offsets = torch.zeros(num_samples + 1, dtype=torch.int64)
+    offsets[1:] = torch.cumsum(lengths, 0)
+    columns = {
+        'user': torch.randint(0, 100000, (num_samples,), generator=generator, dtype=torch.int32).numpy(),
+        'item': torch.randint(0, 20000, (num_samples,), generator=generator, dtype=torch.int32).numpy(),
+        'rating': (torch.randint(1, 11, (num_samples,), generator=generator) / 2).double().numpy(),
+        'feature': torch.randint(4, 20000, (num_samples,), generator=generator, dtype=torch.int32).numpy(),
+        'text_ids': torch.randint(4, 20000, (int(offsets[-1]),), generator=generator, dtype=torch.int32).numpy(),
+        'text_offsets': offsets.numpy(),
+    }
+    return Reviews(columns, torch.arange(num_samples).numpy())
+
+
+def check(seq_len, batch_size):
+    reviews = make_reviews(1000, seq_len)
+    mismatches = 0
+    for prefetch, reuse_buffers in ((False, False), (True, False), (False, True), (True, True)):
+        batchify = Batchify(reviews, WORD2IDX, seq_len, batch_size, prefetch=prefetch, reuse_buffers=reuse_buffers)
+        legacy = LegacyBatchify(batchify, batch_size)
+        # two epochs in order, also across the wrap-around
+        for _ in range(2 * batchify.total_step):
+            batch, expected = batchify.next_batch(), legacy.next_batch()
+            mismatches += not all(torch.equal(a, b) and a.is_contiguous() for a, b in zip(batch, expected))
+            mismatches += batchify.step != legacy.step
+        batchify.close()
+        shuffled = Batchify(reviews, WORD2IDX, seq_len, batch_size, shuffle=True, prefetch=prefetch, seed=0,
+                            reuse_buffers=reuse_buffers)
+        for epoch in range(3):
+            users = torch.cat([shuffled.next_batch()[0].clone() for _ in range(shuffled.total_step)])
+            # every sample exactly once per epoch
+            mismatches += not torch.equal(users.sort().values, shuffled.user.sort().values)
+            mismatches += shuffled.step != shuffled.total_step
+        shuffled.close()
+    return mismatches
+
+
+def epoch_seconds(batchify, work):
+    batchify.next_batch()
+    while batchify.step != batchify.total_step:
+        batchify.next_batch()
+    begin = time.time()
+    for _ in range(batchify.total_step):
+        user, item, rating, seq, feature = batchify.next_batch()
+        if work is not None:
+            # stands in for the training step, which releases the GIL like a real forward pass
+            torch.mm(work, work)
+    return time.time() - begin
+
+
+def main(args):
+    print(f'{check(args.seq_len, 32)} mismatches against the legacy batching')
+    reviews = make_reviews(args.num_samples, args.seq_len)
+    batchify = Batchify(reviews, WORD2IDX, args.seq_len, args.batch_size, shuffle=True, seed=0)
+    legacy = LegacyBatchify(batchify, args.batch_size, shuffle=True)
+    prefetched = Batchify(reviews, WORD2IDX, args.seq_len, args.batch_size, shuffle=True, prefetch=True, seed=0,
+                          reuse_buffers=True)
+    print(f'sample_num {args.num_samples}, batch_size {args.batch_size}, {batchify.total_step} steps per epoch')
+    for work_size in (0, args.work_size):
+        work = torch.randn(work_size, work_size) if work_size else None
+        times = [epoch_seconds(b, work) for b in (legacy, batchify, prefetched)]
+        print(f'{"batching only" if work is None else f"with a {work_size}x{work_size} matmul per step"}: '
+              f'legacy {times[0]:.2f}s, index_select {times[1]:.2f}s, with prefetch {times[2]:.2f}s per epoch')
+    prefetched.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Equality check and epoch time of the review batching")
+    parser.add_argument("--num_samples", type=int, default=2000000)
+    parser.add_argument("--seq_len", type=int, default=15)
+    parser.add_argument("--batch_size", type=int, default=128)
+    parser.add_argument("--work_size", type=int, default=128, help="side of the matmul standing in for a training step")
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,71 @@
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+
+import pandas as pd
+
+EVAL_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(EVAL_DIR)
+from engine.retrieval import ANALYZERS, ExemplarIndex, ExemplarRetriever
+
+# common CJK ideographs, random runs of them segment into a vocabulary of realistic size
+CHARS = [chr(0x4e00 + i) for i in range(0, 6000, 3)]
+
+
+def load_texts(path, limit):
+    df = pd.read_csv(path)
+    if 'Options' in df:
+        texts = df['Question'].astype(str) + '\n' + df['Options'].astype(str)
+    else:
+        texts = df['question'].astype(str)
+        for choice in 'ABCD':
+            texts = texts + f'\n{choice}. ' + df[choice].astype(str)
+    return list(texts)[:limit] if limit else list(texts)
+
+
+def synthetic_texts(n, seed):
+    rng = random.Random(seed)
+    return [''.join(rng.choice(CHARS) for _ in range(rng.randint(20, 80))) + '\nA 甲\nB 乙\nC 丙\nD 丁'
+            for _ in range(n)]
+
+
+def main(args):
+    pool = load_texts(args.pool, args.pool_size) if args.pool else synthetic_texts(args.pool_size, 0)
+    questions = load_texts(args.questions, args.num_questions) if args.questions \
+        else synthetic_texts(args.num_questions, 1)
+    begin = time.time()
+    index = ExemplarIndex.build(pool, args.max_features, args.analyzer)
+    build = time.time() - begin
+    with tempfile.TemporaryDirectory() as cache_dir:
+        retriever = ExemplarRetriever(cache_dir, args.max_features, args.analyzer)
+        begin = time.time()
+        retriever.index(pool)
+        cold = time.time() - begin
+        # a new retriever, as a later run would create, reads the index back memory-mapped
+        retriever = ExemplarRetriever(cache_dir, args.max_features, args.analyzer)
+        begin = time.time()
+        retriever.select(pool, questions[:1], args.k)
+        warm = time.time() - begin
+        begin = time.time()
+        selected = retriever.select(pool, questions, args.k)
+        query = time.time() - begin
+    assert (selected == index.top_k(questions, args.k)).all()
+    print(f'{args.analyzer}: pool {len(pool)} exemplars, {len(index.vocabulary)} features, {len(questions)} questions, k={args.k}')
+    print(f'build {build:.3f}s, build and save {cold:.3f}s, load from disk {warm:.3f}s')
+    print(f'query {1000 * query / len(questions):.3f}ms per question')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Times the few-shot exemplar index build and the top-k selection")
+    parser.add_argument("--pool", type=str, default='', help="dev/val csv used as exemplar pool, synthetic if empty")
+    parser.add_argument("--questions", type=str, default='', help="test csv, synthetic if empty")
+    parser.add_argument("--pool_size", type=int, default=7000)
+    parser.add_argument("--num_questions", type=int, default=7000)
+    parser.add_argument("--max_features", type=int, default=4096)
+    parser.add_argument("--analyzer", type=str, default='chars', choices=ANALYZERS)
+    parser.add_argument("-k", type=int, default=5)
+    args = parser.parse_args()
+    main(args)
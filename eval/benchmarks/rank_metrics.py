@@ -0,0 +1,95 @@
+import os
+import sys
+import time
+import heapq
+import argparse
+
+import numpy as np
+
+EVAL_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(EVAL_DIR, 'CMExam'))
+from evaluate import metrics4rec
+from evaluate.metrics4rec import CSRScores, evaluate_matrix
+
+METRICS = ['precision', 'recall', 'ndcg', 'hit', 'map', 'mrr']
+
+
+def legacy_sums(user_item_scores, groundtruth, topk):
+    """Per-user `heapq.nlargest` and `evaluate_once`, as `evaluate_all` used to score, kept as the reference."""
+    sums = dict.fromkeys(METRICS, 0.0)
+    rs = []
+    for uid in user_item_scores:
+        topk_preds = [iid for iid, _ in heapq.nlargest(topk, user_item_scores[uid].items(), key=lambda x: x[1])]
+        result = metrics4rec.evaluate_once(topk_preds, groundtruth[uid])
+        for name in ['precision', 'recall', 'ndcg', 'hit']:
+            sums[name] += result[f'{name}@k']
+        rs.append(result['rel'])
+    sums['map'] = metrics4rec.mean_average_precision(rs) * len(rs)
+    sums['mrr'] = metrics4rec.mean_reciprocal_rank(rs) * len(rs)
+    return sums
+
+
+def make_data(num_users, num_items, num_relevant, seed=0, density=None):
+    """Tie-free random scores, dense or with a random subset of candidate items per user, and relevant items."""
+    rng = np.random.default_rng(seed)
+    groundtruth = [rng.choice(num_items, rng.integers(1, num_relevant + 1), replace=False).tolist()
+                   for _ in range(num_users)]
+    if density is None:
+        return rng.permutation(num_users * num_items).reshape(num_users, num_items).astype(np.float64), groundtruth
+    counts = rng.binomial(num_items, density, num_users)
+    indices = np.concatenate([np.sort(rng.choice(num_items, count, replace=False)) for count in counts])
+    indptr = np.concatenate([[0], np.cumsum(counts)])
+    data = rng.permutation(len(indices)).astype(np.float64)
+    return CSRScores(indptr, indices, data, (num_users, num_items)), groundtruth
+
+
+def as_dicts(scores, groundtruth):
+    if isinstance(scores, np.ndarray):
+        return {u: dict(enumerate(row)) for u, row in enumerate(scores.tolist())}, dict(enumerate(groundtruth))
+    return ({u: dict(zip(scores.indices[scores.indptr[u]:scores.indptr[u + 1]].tolist(),
+                         scores.data[scores.indptr[u]:scores.indptr[u + 1]].tolist()))
+             for u in range(scores.shape[0])}, dict(enumerate(groundtruth)))
+
+
+def check(topk, num_users, num_items):
+    mismatches = 0
+    for density in (None, 0.05):
+        for chunk_size in (1, 7, None):
+            scores, groundtruth = make_data(num_users, num_items, 2 * topk, density=density)
+            sums, _ = evaluate_matrix(scores, groundtruth, topk, seed=0, chunk_size=chunk_size)
+            reference = legacy_sums(*as_dicts(scores, groundtruth), topk)
+            mismatches += not all(np.isclose(sums[name], reference[name], rtol=1e-12) for name in METRICS)
+    # all scores tied: every top-k is a uniformly random sample, so hits@k averages k * relevant / items
+    scores = np.zeros((num_users, num_items))
+    groundtruth = [[0]] * num_users
+    sums, _ = evaluate_matrix(scores, groundtruth, topk, seed=0)
+    mismatches += abs(sums['hit'] / num_users - topk / num_items) > 5 * np.sqrt(topk / num_items / num_users)
+    return mismatches
+
+
+def main(args):
+    print(f'{check(args.topk, 500, 200)} mismatches against per-user evaluate_once')
+    scores, groundtruth = make_data(args.num_users, args.num_items, 2 * args.topk, seed=1)
+    scores = scores.astype(np.float32)
+    begin = time.time()
+    sums, cnt = evaluate_matrix(scores, groundtruth, args.topk, seed=0)
+    seconds = time.time() - begin
+    sample = args.legacy_users
+    dicts = as_dicts(scores[:sample], groundtruth[:sample])
+    begin = time.time()
+    legacy_sums(*dicts, args.topk)
+    legacy_seconds = (time.time() - begin) / sample * args.num_users
+    print(f'{args.num_users} users x {args.num_items} items, top-{args.topk}: '
+          + ', '.join(f'{name} {sums[name] / cnt:.4f}' for name in METRICS))
+    print(f'evaluate_matrix {seconds:.2f}s, per-user loop {legacy_seconds:.1f}s (estimated from {sample} users), '
+          f'{legacy_seconds / seconds:.0f}x faster')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Exact-equality check and timing of the vectorized ranking metrics")
+    parser.add_argument("--num_users", type=int, default=100000)
+    parser.add_argument("--num_items", type=int, default=1000)
+    parser.add_argument("--topk", type=int, default=10)
+    parser.add_argument("--legacy_users", type=int, default=2000, help="users scored with the per-user loop")
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,142 @@
+import os
+import sys
+import time
+import pickle
+import random
+import itertools
+import resource
+import argparse
+import tempfile
+import subprocess
+
+import torch
+
+EVAL_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(EVAL_DIR, 'CMExam'))
+from evaluate.utils import Batchify, DataLoader, EntityDictionary, WordDictionary
+
+
+class LegacyDataLoader:
+    """The two-pass loader keeping a dict per review, kept as the reference."""
+
+    def __init__(self, data_path, index_dir, vocab_size):
+        self.word_dict = WordDictionary()
+        self.user_dict = EntityDictionary()
+        self.item_dict = EntityDictionary()
+        self.max_rating = float('-inf')
+        self.min_rating = float('inf')
+        reviews = pickle.load(open(data_path, 'rb'))
+        for review in reviews:
+            self.user_dict.add_entity(review['user'])
+            self.item_dict.add_entity(review['item'])
+            (fea, adj, tem, sco) = review['template']
+            self.word_dict.add_sentence(tem)
+            self.word_dict.add_word(fea)
+            self.max_rating = max(self.max_rating, review['rating'])
+            self.min_rating = min(self.min_rating, review['rating'])
+        self.word_dict.keep_most_frequent(vocab_size)
+        unk = self.word_dict.word2idx['<unk>']
+        self.feature_set = set()
+        data = []
+        reviews = pickle.load(open(data_path, 'rb'))
+        for review in reviews:
+            (fea, adj, tem, sco) = review['template']
+            data.append({'user': self.user_dict.entity2idx[review['user']],
+                         'item': self.item_dict.entity2idx[review['item']],
+                         'rating': review['rating'],
+                         'text': [self.word_dict.word2idx.get(w, unk) for w in tem.split()],
+                         'feature': self.word_dict.word2idx.get(fea, unk)})
+            self.feature_set.add(fea if fea in self.word_dict.word2idx else '<unk>')
+        self.train, self.valid, self.test = [[data[i] for i in index]
+                                             for index in DataLoader.load_index(self, index_dir)]
+
+
+def make_corpus(work_dir, num_reviews, num_words, seed=0):
+    """A review pickle in the (feature, adjective, template, sentiment) format and an 8:1:1 split."""
+    rng = random.Random(seed)
+    # Zipf-like word frequencies, so the vocabulary cut drops the rare words
+    words = [f'w{i}' for i in range(num_words)]
+    cum_weights = list(itertools.accumulate(1 / (i + 1) for i in range(num_words)))
+    reviews = []
+    for _ in range(num_reviews):
+        text = rng.choices(words, cum_weights=cum_weights, k=rng.randint(3, 30))
+        reviews.append({'user': f'u{rng.randrange(num_reviews // 20 + 1)}', 'item': f'i{rng.randrange(num_reviews // 50 + 1)}',
+                        'rating': rng.randint(1, 5), 'template': (text[0], 'good', ' '.join(text), 1)})
+    data_path = os.path.join(work_dir, 'reviews.pickle')
+    with open(data_path, 'wb') as f:
+        pickle.dump(reviews, f)
+    order = list(range(num_reviews))
+    rng.shuffle(order)
+    cut1, cut2 = int(0.8 * num_reviews), int(0.9 * num_reviews)
+    for name, index in (('train', order[:cut1]), ('validation', order[cut1:cut2]), ('test', order[cut2:])):
+        with open(os.path.join(work_dir, f'{name}.index'), 'w') as f:
+            f.write(' '.join(map(str, index)))
+    return data_path
+
+
+def check(work_dir, vocab_size):
+    data_path = make_corpus(work_dir, 20000, 5000, seed=1)
+    legacy = LegacyDataLoader(data_path, work_dir, vocab_size)
+    mismatches = 0
+    for cache_dir in (None, os.path.join(work_dir, 'cache'), os.path.join(work_dir, 'cache')):
+        corpus = DataLoader(data_path, work_dir, vocab_size, cache_dir=cache_dir)
+        mismatches += corpus.word_dict.idx2word != legacy.word_dict.idx2word
+        mismatches += corpus.user_dict.idx2entity != legacy.user_dict.idx2entity
+        mismatches += corpus.item_dict.idx2entity != legacy.item_dict.idx2entity
+        mismatches += corpus.feature_set != legacy.feature_set
+        mismatches += (corpus.max_rating, corpus.min_rating) != (legacy.max_rating, legacy.min_rating)
+        for split, reference in ((corpus.train, legacy.train), (corpus.valid, legacy.valid), (corpus.test, legacy.test)):
+            mismatches += [split[i] for i in range(len(split))] != reference
+            for seq_len in (5, 15):
+                tensors = Batchify(split, corpus.word_dict.word2idx, seq_len)
+                expected = Batchify(reference, legacy.word_dict.word2idx, seq_len)
+                mismatches += not all(torch.equal(getattr(tensors, name), getattr(expected, name))
+                                      for name in ('user', 'item', 'rating', 'seq', 'feature'))
+    return mismatches
+
+
+def current_rss():
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * resource.getpagesize() / 2 ** 20
+
+
+def measure(args):
+    # torch alone takes hundreds of MB, only the growth over the imports is the loader's
+    base_rss = current_rss()
+    begin = time.time()
+    if args.measure == 'legacy':
+        corpus = LegacyDataLoader(args.data_path, args.work_dir, args.vocab_size)
+    else:
+        corpus = DataLoader(args.data_path, args.work_dir, args.vocab_size,
+                            cache_dir=os.path.join(args.work_dir, 'cache') if args.measure != 'uncached' else None)
+    seconds = time.time() - begin
+    loaded_rss = current_rss() - base_rss
+    batchify = Batchify(corpus.train, corpus.word_dict.word2idx)
+    total = time.time() - begin
+    print(f'{args.measure}: load {seconds:.1f}s, RSS +{loaded_rss:.0f} MB; with train tensors {total:.1f}s, '
+          f'RSS +{current_rss() - base_rss:.0f} MB ({len(batchify.seq)} train reviews)')
+
+
+def main(args):
+    with tempfile.TemporaryDirectory() as work_dir:
+        print(f'{check(work_dir, args.vocab_size)} mismatches against the legacy loader', flush=True)
+        data_path = make_corpus(work_dir, args.num_reviews, args.num_words)
+        print(f'{args.num_reviews} reviews, {os.path.getsize(data_path) / 2 ** 20:.0f} MB pickle', flush=True)
+        for loader in ('legacy', 'uncached', 'cold cache', 'warm cache'):
+            subprocess.run([sys.executable, __file__, '--measure', loader, '--data_path', data_path,
+                            '--work_dir', work_dir, '--vocab_size', str(args.vocab_size)], check=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Equality check, load time and memory of the review DataLoader")
+    parser.add_argument("--num_reviews", type=int, default=1000000)
+    parser.add_argument("--num_words", type=int, default=50000)
+    parser.add_argument("--vocab_size", type=int, default=20000)
+    parser.add_argument("--measure", type=str, default='', help=argparse.SUPPRESS)
+    parser.add_argument("--data_path", type=str, default='', help=argparse.SUPPRESS)
+    parser.add_argument("--work_dir", type=str, default='', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.measure:
+        measure(args)
+    else:
+        main(args)
@@ -0,0 +1,103 @@
+import os
+import sys
+import time
+import random
+import argparse
+
+import pandas as pd
+
+EVAL_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(EVAL_DIR, 'CMExam'))
+from evaluate import rouge
+
+
+def legacy_lcs(x, y):
+    """The dict-backed DP table `rouge._lcs` used to build, kept as the reference."""
+    n, m = len(x), len(y)
+    table = dict()
+    for i in range(n + 1):
+        for j in range(m + 1):
+            if i == 0 or j == 0:
+                table[i, j] = 0
+            elif x[i - 1] == y[j - 1]:
+                table[i, j] = table[i - 1, j - 1] + 1
+            else:
+                table[i, j] = max(table[i - 1, j], table[i, j - 1])
+    return table
+
+
+def legacy_len_lcs(x, y):
+    return legacy_lcs(x, y)[len(x), len(y)]
+
+
+def legacy_recon_lcs(x, y):
+    table = legacy_lcs(x, y)
+
+    def _recon(i, j):
+        if i == 0 or j == 0:
+            return []
+        elif x[i - 1] == y[j - 1]:
+            return _recon(i - 1, j - 1) + [(x[i - 1], i)]
+        elif table[i - 1, j] > table[i, j - 1]:
+            return _recon(i - 1, j)
+        else:
+            return _recon(i, j - 1)
+
+    return tuple(token for token, _ in _recon(len(x), len(y)))
+
+
+def mutate(text, rng, rate=0.3):
+    """A fake model explanation: the reference with characters dropped, replaced and inserted."""
+    chars = []
+    for char in text:
+        draw = rng.random()
+        if draw < rate / 3:
+            continue
+        chars.append(rng.choice(text) if draw < 2 * rate / 3 else char)
+        if draw > 1 - rate / 3:
+            chars.append(rng.choice(text))
+    return ''.join(chars)
+
+
+def make_pairs(path, num_pairs, seed=0):
+    """(hypothesis, reference) explanations split per character, as `evaluate_chatglm.py` scores them."""
+    rng = random.Random(seed)
+    explanations = [text for text in pd.read_csv(path)['Explanation'].dropna().astype(str) if text]
+    pairs = []
+    for _ in range(num_pairs):
+        reference = rng.choice(explanations)
+        pairs.append((list(mutate(reference, rng)), list(reference)))
+    return pairs
+
+
+def main(args):
+    # equality with the legacy implementation is covered by tests/test_rouge_lcs.py
+    pairs = make_pairs(args.data, args.num_pairs)
+    sample = pairs[:args.legacy_pairs]
+    begin = time.time()
+    for x, y in sample:
+        legacy_len_lcs(x, y)
+    legacy_seconds = (time.time() - begin) / len(sample) * len(pairs)
+    begin = time.time()
+    for x, y in pairs:
+        rouge._len_lcs(x, y)
+    seconds = time.time() - begin
+    begin = time.time()
+    for x, y in pairs[:args.legacy_pairs]:
+        rouge._recon_lcs(x, y)
+    recon_seconds = (time.time() - begin) / len(sample) * len(pairs)
+    tokens = sum(len(x) + len(y) for x, y in pairs) / len(pairs)
+    print(f'{len(pairs)} explanation pairs, {tokens:.0f} characters per pair')
+    print(f'LCS length: {seconds:.2f}s, legacy table {legacy_seconds:.1f}s (estimated from {len(sample)} pairs), '
+          f'{legacy_seconds / seconds:.0f}x faster')
+    print(f'LCS reconstruction (union LCS only): {recon_seconds:.1f}s (estimated from {len(sample)} pairs)')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Timing of the ROUGE-L LCS kernels against the legacy table")
+    parser.add_argument("--data", type=str, default=os.path.join(EVAL_DIR, 'CMExam', 'data', 'test_10.csv'),
+                        help="CMExam csv whose Explanation column is sampled into fake prediction pairs")
+    parser.add_argument("--num_pairs", type=int, default=10000)
+    parser.add_argument("--legacy_pairs", type=int, default=200, help="pairs timed with the legacy code")
+    args = parser.parse_args()
+    main(args)
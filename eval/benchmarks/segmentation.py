@@ -0,0 +1,52 @@
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+EVAL_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(EVAL_DIR, 'CMExam'))
+from evaluate.segment import Segmenter
+from evaluate.suite import jieba_tokens, text_metrics
+from rouge_lcs import make_pairs
+
+
+def timed(fn, *args, **kwargs):
+    begin = time.time()
+    result = fn(*args, **kwargs)
+    return result, time.time() - begin
+
+
+def main(args):
+    pairs = make_pairs(args.data, args.num_rows)
+    hypotheses = [''.join(hypothesis) for hypothesis, _ in pairs]
+    references = [''.join(reference) for _, reference in pairs]
+    baseline, seconds = timed(text_metrics, hypotheses, references, tokenize=jieba_tokens,
+                              num_workers=args.num_workers)
+    print(f'{len(pairs)} rows, jieba per pair: {seconds:.1f}s')
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        cache_path = os.path.join(cache_dir, 'segments.sqlite')
+        for run in ['cold cache', 'warm cache']:
+            segmenter = Segmenter(cache_path, num_workers=args.num_workers)
+            segmented, segment_seconds = timed(segmenter.segment, hypotheses + references)
+            segmenter.close()
+            tokens = segmented[:len(hypotheses)], segmented[len(hypotheses):]
+            metrics, seconds = timed(text_metrics, hypotheses, references, num_workers=args.num_workers,
+                                     tokens=tokens)
+            assert metrics == baseline, f'{run}: segmented tokens changed the scores'
+            print(f'{run}: segmentation {segment_seconds:.2f}s, scoring {seconds:.1f}s')
+
+    metrics, seconds = timed(text_metrics, hypotheses, references, bleu_orders=(), num_workers=args.num_workers)
+    assert all(metrics[name] == baseline[name] for name in metrics)
+    print(f'ROUGE only, characters: {seconds:.1f}s')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Times cached jieba segmentation and the character ROUGE path")
+    parser.add_argument("--data", type=str, default=os.path.join(EVAL_DIR, 'CMExam', 'data', 'test_10.csv'),
+                        help="CMExam csv whose Explanation column is sampled into fake prediction pairs")
+    parser.add_argument("--num_rows", type=int, default=20000)
+    parser.add_argument("--num_workers", type=int, default=os.cpu_count())
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,91 @@
+import os
+import sys
+import time
+import random
+import argparse
+
+EVAL_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(EVAL_DIR, 'CMExam'))
+from evaluate import utils
+from evaluate.accumulators import FeatureMetrics, UniqueSentences
+
+
+def legacy_unique_sentence_percent(sequence_batch):
+    """The pairwise `two_seq_same` scan `utils.unique_sentence_percent` used to run, kept as the reference."""
+    unique_seq = []
+    for seq in sequence_batch:
+        if not any(utils.two_seq_same(seq, uni_seq) for uni_seq in unique_seq):
+            unique_seq.append(seq)
+    return len(unique_seq) / len(sequence_batch), len(unique_seq)
+
+
+def legacy_feature_diversity(feature_batch):
+    list_len = len(feature_batch)
+    total_count = 0
+    for i, x in enumerate(feature_batch):
+        for j in range(i + 1, list_len):
+            total_count += len(x & feature_batch[j])
+    return total_count / (list_len * (list_len - 1) / 2)
+
+
+def make_sequences(num_sequences, vocab_size, seed=0):
+    """Generated explanations as token ids: short templates over a small vocabulary, so many repeat."""
+    rng = random.Random(seed)
+    templates = [[rng.randrange(vocab_size) for _ in range(rng.randint(3, 15))] for _ in range(num_sequences // 4)]
+    sequences = []
+    for _ in range(num_sequences):
+        seq = list(rng.choice(templates))
+        if rng.random() < 0.5:
+            seq[rng.randrange(len(seq))] = rng.randrange(vocab_size)
+        sequences.append(seq)
+    return sequences
+
+
+def timed(fn, *args):
+    begin = time.time()
+    result = fn(*args)
+    return result, time.time() - begin
+
+
+def main(args):
+    rng = random.Random(1)
+    sequences = make_sequences(args.num_sequences, args.vocab_size)
+    feature_set = set(rng.sample(range(args.vocab_size), args.num_features))
+    feature_batch = utils.feature_detect(sequences, feature_set)
+
+    sample = sequences[:args.legacy_sequences]
+    mismatches = 0
+    for n in range(2, len(sample) + 1, max(len(sample) // 20, 1)):
+        mismatches += utils.unique_sentence_percent(sample[:n]) != legacy_unique_sentence_percent(sample[:n])
+        mismatches += utils.feature_diversity(feature_batch[:n]) != legacy_feature_diversity(feature_batch[:n])
+
+    unique, unique_seconds = timed(utils.unique_sentence_percent, sequences)
+    diversity, diversity_seconds = timed(utils.feature_diversity, feature_batch)
+    accumulators = UniqueSentences(), FeatureMetrics(feature_set)
+    for seq in sequences:
+        accumulators[0].update(seq)
+        accumulators[1].update(seq)
+    mismatches += accumulators[0].compute() != unique
+    mismatches += accumulators[1].compute()['diversity'] != diversity
+    print(f'{mismatches} mismatches against the pairwise implementations and the accumulators')
+
+    # both legacy functions are quadratic, the full corpus is estimated from the sample
+    scale = (len(sequences) / len(sample)) ** 2
+    _, legacy_unique_seconds = timed(legacy_unique_sentence_percent, sample)
+    _, legacy_diversity_seconds = timed(legacy_feature_diversity, feature_batch[:len(sample)])
+    print(f'{len(sequences)} sequences, {unique[1]} unique, feature diversity {diversity:.4f}')
+    print(f'unique_sentence_percent: {unique_seconds:.3f}s, pairwise {legacy_unique_seconds * scale:.0f}s '
+          f'(estimated from {len(sample)} sequences)')
+    print(f'feature_diversity: {diversity_seconds:.3f}s, pairwise {legacy_diversity_seconds * scale:.0f}s '
+          f'(estimated from {len(sample)} sequences)')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Exact-equality check and timing of the sentence uniqueness and "
+                                                 "feature diversity metrics")
+    parser.add_argument("--num_sequences", type=int, default=100000)
+    parser.add_argument("--vocab_size", type=int, default=2000)
+    parser.add_argument("--num_features", type=int, default=200)
+    parser.add_argument("--legacy_sequences", type=int, default=2000, help="sequences scored with the legacy code")
+    args = parser.parse_args()
+    main(args)
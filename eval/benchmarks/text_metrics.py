@@ -0,0 +1,38 @@
+import os
+import sys
+import time
+import argparse
+
+EVAL_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(EVAL_DIR, 'CMExam'))
+from evaluate.suite import jieba_tokens, text_metrics
+from rouge_lcs import make_pairs
+
+
+def main(args):
+    pairs = make_pairs(args.data, args.num_rows)
+    hypotheses = [''.join(hypothesis) for hypothesis, _ in pairs]
+    references = [''.join(reference) for _, reference in pairs]
+    tokenize = jieba_tokens if args.jieba else list
+    baseline = None
+    for num_workers in args.num_workers:
+        begin = time.time()
+        metrics = text_metrics(hypotheses, references, tokenize=tokenize, num_workers=num_workers)
+        seconds = time.time() - begin
+        baseline = baseline or (metrics, seconds)
+        assert metrics == baseline[0], f'{num_workers} workers changed the scores'
+        print(f'{num_workers} workers: {seconds:.1f}s, {len(pairs) / seconds:.0f} rows/s, '
+              f'{baseline[1] / seconds:.2f}x the first run')
+    for name, value in baseline[0].items():
+        print(f'{name} {value:7.4f}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Times BLEU/ROUGE over a large prediction file with a process pool")
+    parser.add_argument("--data", type=str, default=os.path.join(EVAL_DIR, 'CMExam', 'data', 'test_10.csv'),
+                        help="CMExam csv whose Explanation column is sampled into fake prediction pairs")
+    parser.add_argument("--num_rows", type=int, default=100000)
+    parser.add_argument("--num_workers", type=int, nargs='+', default=sorted({1, 2, 4, os.cpu_count()}))
+    parser.add_argument("--jieba", action='store_true', default=False, help="BLEU on jieba words instead of characters")
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,54 @@
+def add_engine_arguments(parser):
+    """Flags of the evaluation engine shared by the Baichuan and LLaMA command lines of C-Eval and CMExam."""
+    parser.add_argument("--cache_path", type=str, default='cache/generations.sqlite',
+                        help="SQLite file caching raw generations, keyed by model, prompt and decoding config")
+    parser.add_argument("--no_cache", action='store_true', default=False)
+    parser.add_argument("--max_prompt_tokens", type=int, default=2048,
+                        help="few-shot examples are dropped from the end until question and answer fit; 0 keeps all k")
+    parser.add_argument("--shot_retrieval", type=str, default='', choices=['', 'chars', 'jieba'],
+                        help="few-shot examples are the k dev rows most similar to each question instead of the first k, "
+                             "TF-IDF over character n-grams or jieba words")
+    parser.add_argument("--shot_index_dir", type=str, default='cache/shot_index',
+                        help="TF-IDF indexes of the dev pools, memory-mapped on later runs; empty to keep them in memory")
+    parser.add_argument("--static_cache", action='store_true', default=False,
+                        help="preallocated KV cache and torch.compile'd forward, prompts padded to 64-token buckets")
+    parser.add_argument("--draft_model", type=str, default='',
+                        help="small model sharing the tokenizer, drafts tokens verified by the evaluated model")
+    parser.add_argument("--draft_layers", type=int, default=0,
+                        help="draft with the first N layers of the evaluated model instead of --draft_model")
+    parser.add_argument("--num_draft_tokens", type=int, default=4)
+    parser.add_argument("--continuous_batching", action='store_true', default=False,
+                        help="stream questions through an in-process server, finished answers free their slot at once")
+    parser.add_argument("--token_cache_dir", type=str, default='cache/prompt_tokens',
+                        help="tokenized prompts of every subject, memory-mapped on later runs; empty to disable")
+    parser.add_argument("--dtype", type=str, default='auto', choices=['auto', 'fp16', 'bf16', 'fp32'],
+                        help="weight dtype, auto is fp16 on GPU and fp32 on CPU")
+    parser.add_argument("--quantize", type=str, default=None, choices=['int8'],
+                        help="int8 dynamic quantization of the Linear layers, CPU only")
+    parser.add_argument("--onnx_dir", type=str, default='',
+                        help="run the (merged) model with ONNX Runtime, exported into this directory on first use")
+    parser.add_argument("--num_threads", type=int, default=None, help="intra-op threads used on CPU")
+    parser.add_argument("--early_stop", action='store_true', default=False,
+                        help="stop generating once the answer letter (or the CoT answer sentence) is emitted")
+    return parser
+
+
+def engine_kwargs(args):
+    """Evaluator keyword arguments of the `add_engine_arguments` flags, empty strings meaning disabled."""
+    return dict(
+        cache_path=None if args.no_cache else args.cache_path,
+        batch_size=args.batch_size,
+        token_cache_dir=args.token_cache_dir or None,
+        continuous_batching=args.continuous_batching,
+        draft_model=args.draft_model or None,
+        draft_layers=args.draft_layers,
+        num_draft_tokens=args.num_draft_tokens,
+        static_cache=args.static_cache,
+        max_prompt_tokens=args.max_prompt_tokens,
+        shot_retrieval=args.shot_retrieval or None,
+        shot_index_dir=args.shot_index_dir or None,
+        dtype=args.dtype,
+        quantize=args.quantize,
+        onnx_dir=args.onnx_dir or None,
+        num_threads=args.num_threads,
+    )
@@ -0,0 +1,117 @@
+import numpy as np
+import torch
+from transformers.generation.stopping_criteria import StoppingCriteriaList
+
+from engine.loader import attach_adapter
+from engine.stopping import AnswerStoppingCriteria
+
+
+class CausalLMBackend:
+    """Batched generation and choice scoring with a Hugging Face causal LM.
+
+    The model is created by `load_model` on first use, so runs served entirely from the generation cache
+    never load the weights. `decode_offset` keeps that many prompt tokens in front of the decoded response
+    (the C-Eval evaluators decode from the trailing `答：` of the prompt).
+    """
+
+    def __init__(self, tokenizer, load_model, decode_offset=0):
+        self.tokenizer = tokenizer
+        # left padding keeps every prompt right before its generated tokens in a batch
+        self.tokenizer.padding_side = 'left'
+        if self.tokenizer.pad_token is None:
+            self.tokenizer.pad_token = self.tokenizer.unk_token or self.tokenizer.eos_token
+        self.load_model = load_model
+        self.decode_offset = decode_offset
+        self.adapter = None
+        # adapters attached after construction, name -> path
+        self.extra_adapters = {}
+        self._model = None
+
+    @property
+    def model(self):
+        if self._model is None:
+            self._model = self.load_model()
+            for name, path in self.extra_adapters.items():
+                self._model = attach_adapter(self._model, name, path)
+            if self.adapter is not None:
+                self._model.set_adapter(self.adapter)
+        return self._model
+
+    def add_adapter(self, name, path):
+        """Attaches one more LoRA adapter to the (possibly not yet loaded) base model."""
+        if self._model is not None:
+            self._model = attach_adapter(self._model, name, path)
+        self.extra_adapters[name] = path
+
+    def remove_adapter(self, name):
+        self.extra_adapters.pop(name, None)
+        if self.adapter == name:
+            self.adapter = None
+        # an adapter whose files could not be read was never attached
+        if self._model is not None and name in (getattr(self._model, 'peft_config', None) or {}):
+            self._model.delete_adapter(name)
+
+    def set_adapter(self, name):
+        """Activates one of the LoRA adapters attached by `load_model(adapters=...)`.
+
+        Applied lazily, so switching to an adapter whose results are all cached never loads the model.
+        """
+        self.adapter = name
+        if self._model is not None:
+            self._model.set_adapter(name)
+
+    def encode(self, prompts, input_ids=None):
+        """Left-padded batch of the prompts, from the pre-tokenized `input_ids` when given."""
+        if input_ids is None:
+            inputs = self.tokenizer(prompts, return_tensors="pt", padding=True)
+            return inputs.to(self.model.device)
+        return self.pad(input_ids, max(len(ids) for ids in input_ids))
+
+    def pad(self, input_ids, width):
+        """Left-pads token id lists to `width` columns."""
+        batch = torch.full((len(input_ids), width), self.tokenizer.pad_token_id, dtype=torch.long)
+        attention_mask = torch.zeros((len(input_ids), width), dtype=torch.long)
+        for row, ids in enumerate(input_ids):
+            batch[row, width - len(ids):] = torch.from_numpy(np.asarray(ids, dtype=np.int64))
+            attention_mask[row, width - len(ids):] = 1
+        return {"input_ids": batch.to(self.model.device), "attention_mask": attention_mask.to(self.model.device)}
+
+    @torch.no_grad()
+    def generate(self, prompts, generation, cot=False, early_stop=False, input_ids=None):
+        inputs = self.encode(prompts, input_ids)
+        prompt_length = inputs["input_ids"].shape[1]
+        stopping_criteria = StoppingCriteriaList()
+        if early_stop:
+            criteria = AnswerStoppingCriteria(self.tokenizer, prompt_length, cot=cot)
+            stopping_criteria.append(criteria)
+        outputs = self.model.generate(
+            **inputs, return_dict_in_generate=True, stopping_criteria=stopping_criteria,
+            **generation.generate_kwargs(self.model))
+        responses = []
+        for i, sequence in enumerate(outputs.sequences.tolist()):
+            tokens = sequence[prompt_length:]
+            if early_stop:
+                tokens = criteria.truncate(i, tokens)
+            elif self.tokenizer.eos_token_id in tokens:
+                # drop the padding of sequences that finished before the rest of the batch
+                tokens = tokens[:tokens.index(self.tokenizer.eos_token_id) + 1]
+            tokens = sequence[prompt_length - self.decode_offset:prompt_length] + tokens
+            responses.append(self.tokenizer.decode(tokens))
+        return responses
+
+    @torch.no_grad()
+    def choice_scores(self, prompts, generation, choice_ids, input_ids=None):
+        """Scores of the choice tokens at the first decode step, one list per prompt."""
+        inputs = self.encode(prompts, input_ids)
+        outputs = self.model.generate(
+            **inputs, return_dict_in_generate=True, output_scores=True, **generation.generate_kwargs(self.model))
+        return outputs.scores[0][:, choice_ids].float().tolist()
+
+
+class ChatBackend(CausalLMBackend):
+    """Backend for models exposing `chat(tokenizer, query, history)` (ChatGLM); prompts are (query, history)."""
+
+    @torch.no_grad()
+    def generate(self, prompts, generation, cot=False, early_stop=False, input_ids=None):
+        return [self.model.chat(self.tokenizer, query, history=history, do_sample=False)[0]
+                for query, history in prompts]
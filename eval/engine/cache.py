@@ -0,0 +1,119 @@
+import os
+import json
+import sqlite3
+import hashlib
+import threading
+
+WEIGHT_SUFFIXES = ('.bin', '.safetensors', '.pt', '.pth', '.model')
+CONFIG_SUFFIXES = ('.json', '.py', '.txt')
+
+
+def fingerprint_path(path, hash_weights=False):
+    """Fingerprint a local model / adapter directory or a hub id.
+
+    By default weight files contribute only their name, size and mtime so the
+    fingerprint is cheap even for 13B checkpoints; config and tokenizer files are
+    hashed by content. With `hash_weights=True` the weight bytes are hashed too.
+    """
+    h = hashlib.sha256()
+    if not path:
+        return ''
+    if os.path.isdir(path):
+        files = sorted(os.listdir(path))
+        root = path
+    elif os.path.isfile(path):
+        root, name = os.path.split(path)
+        files = [name]
+    else:
+        # hub id, the name is all we know without downloading
+        h.update(path.encode('utf-8'))
+        return h.hexdigest()
+    for name in files:
+        file_path = os.path.join(root, name)
+        if not os.path.isfile(file_path):
+            continue
+        if name.endswith(WEIGHT_SUFFIXES) and not hash_weights:
+            stat = os.stat(file_path)
+            h.update(f'{name}:{stat.st_size}:{int(stat.st_mtime)}'.encode('utf-8'))
+        elif name.endswith(WEIGHT_SUFFIXES + CONFIG_SUFFIXES):
+            h.update(name.encode('utf-8'))
+            with open(file_path, 'rb') as f:
+                for chunk in iter(lambda: f.read(1 << 20), b''):
+                    h.update(chunk)
+    return h.hexdigest()
+
+
+def model_fingerprint(model_name_or_path, lora_path=None, tokenizer=None, hash_weights=False, **extra):
+    """Fingerprint of everything that can change a generation besides the prompt."""
+    parts = {
+        'model': fingerprint_path(model_name_or_path, hash_weights),
+        # adapters are small and successive checkpoints often share size and mtime, so always hash their bytes
+        'lora': fingerprint_path(lora_path, hash_weights=True) if lora_path else '',
+        **extra,
+    }
+    if tokenizer is not None:
+        parts['tokenizer'] = f'{tokenizer.__class__.__name__}:{len(tokenizer)}'
+    return hashlib.sha256(json.dumps(parts, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+class GenerationCache:
+    """SQLite-backed cache of raw model outputs.
+
+    Entries are keyed by the model fingerprint, the exact prompt and the decoding
+    config, and hold the raw response (or the choice scores) before any answer
+    extraction, so re-scoring a run never needs the model.
+    """
+
+    def __init__(self, path, fingerprint, commit_every=64):
+        dirname = os.path.dirname(path)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+        self.path = path
+        self.fingerprint = fingerprint
+        self.commit_every = commit_every
+        self.hits = 0
+        self.misses = 0
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS generations (key TEXT PRIMARY KEY, value TEXT)')
+        self._conn.commit()
+
+    def make_key(self, kind, prompt, gen_kwargs=None):
+        payload = [self.fingerprint, kind, prompt, gen_kwargs or {}]
+        return hashlib.sha256(
+            json.dumps(payload, sort_keys=True, ensure_ascii=False, default=str).encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        with self._lock:
+            row = self._conn.execute('SELECT value FROM generations WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, key, value):
+        with self._lock:
+            self._conn.execute('INSERT OR REPLACE INTO generations (key, value) VALUES (?, ?)',
+                               (key, json.dumps(value, ensure_ascii=False)))
+            self._pending += 1
+            if self._pending >= self.commit_every:
+                self._conn.commit()
+                self._pending = 0
+
+    def flush(self):
+        with self._lock:
+            self._conn.commit()
+            self._pending = 0
+
+    def close(self):
+        self.flush()
+        self._conn.close()
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
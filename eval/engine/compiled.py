@@ -0,0 +1,94 @@
+import time
+from dataclasses import dataclass
+
+import torch
+import torch._inductor.config
+from transformers import GenerationConfig
+
+from engine.backends import CausalLMBackend
+
+
+@dataclass
+class CompileStats:
+    shapes: int = 0
+    warmup_seconds: float = 0.
+
+    def report(self):
+        return f'{self.shapes} new shapes compiled in {self.warmup_seconds:.1f}s'
+
+    def reset(self):
+        # compiled shapes stay warm across subjects, only the counters restart
+        self.shapes = 0
+        self.warmup_seconds = 0.
+
+
+class CompiledBackend(CausalLMBackend):
+    """Generation with a preallocated static KV cache and a `torch.compile`d forward.
+
+    Batches are padded to `batch_size` rows (repeating the last prompt) and prompts are left-padded to a
+    multiple of `bucket` tokens, so only a handful of shapes ever reach the compiler. The first batch of
+    every shape pays the compilation; the shapes already seen are remembered for the whole run (they stay
+    compiled across subjects) and the warm-up time is reported apart from the model time.
+    """
+
+    def __init__(self, tokenizer, load_model, decode_offset=0, batch_size=1, bucket=64):
+        if not hasattr(GenerationConfig(), 'cache_implementation'):
+            raise ValueError("the static KV cache needs transformers>=4.38")
+        super().__init__(tokenizer, load_model, decode_offset=decode_offset)
+        self.batch_size = batch_size
+        self.bucket = bucket
+        self.stats = CompileStats()
+        self._warm_shapes = set()
+        self._setups = {}
+
+    @property
+    def model(self):
+        if self._model is None:
+            model = super().model
+            # CUDA graphs replay the decode step on GPU, the default inductor mode is used on CPU
+            mode = 'reduce-overhead' if model.device.type == 'cuda' else None
+            model.forward = torch.compile(model.forward, mode=mode)
+        return self._model
+
+    def encode(self, prompts, input_ids=None):
+        input_ids = list(input_ids) + [input_ids[-1]] * (self.batch_size - len(input_ids))
+        width = max(len(ids) for ids in input_ids)
+        return self.pad(input_ids, -(-width // self.bucket) * self.bucket)
+
+    def static(self, generation):
+        """`generation` with the static cache, memoized so its per-model GenerationConfig is built once."""
+        setup = self._setups.get(id(generation))
+        if setup is None:
+            # the original is kept alongside, so its id cannot be reused by another setup
+            setup = self._setups[id(generation)] = (generation, generation.updated(cache_implementation='static'))
+        return setup[1]
+
+    def run(self, input_ids, generation, compute):
+        """Runs `compute` on the padded shape of `input_ids`, timing it as warm-up if the shape is new."""
+        width = -(-max(len(ids) for ids in input_ids) // self.bucket) * self.bucket
+        shape = (width, tuple(sorted(generation.params.items())))
+        # compiled graphs are also kept on disk, so later runs skip most of the warm-up; the setting is only
+        # patched while this backend compiles, other `torch.compile` users of the process keep their own
+        with torch._inductor.config.patch(fx_graph_cache=True):
+            if shape in self._warm_shapes:
+                return compute()
+            begin = time.time()
+            outputs = compute()
+        self._warm_shapes.add(shape)
+        self.stats.shapes += 1
+        self.stats.warmup_seconds += time.time() - begin
+        return outputs
+
+    def generate(self, prompts, generation, cot=False, early_stop=False, input_ids=None):
+        generation = self.static(generation)
+        if input_ids is None:
+            input_ids = self.tokenizer(list(prompts))['input_ids']
+        return self.run(input_ids, generation, lambda: super(CompiledBackend, self).generate(
+            prompts, generation, cot=cot, early_stop=early_stop, input_ids=input_ids))[:len(prompts)]
+
+    def choice_scores(self, prompts, generation, choice_ids, input_ids=None):
+        generation = self.static(generation)
+        if input_ids is None:
+            input_ids = self.tokenizer(list(prompts))['input_ids']
+        return self.run(input_ids, generation, lambda: super(CompiledBackend, self).choice_scores(
+            prompts, generation, choice_ids, input_ids=input_ids))[:len(prompts)]
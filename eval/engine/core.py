@@ -0,0 +1,134 @@
+import os
+import time
+from dataclasses import dataclass
+
+import torch
+import torch.distributed as dist
+
+
+def init_distributed():
+    """Joins the process group when launched with torchrun and returns (rank, world_size)."""
+    world_size = int(os.environ.get('WORLD_SIZE', 1))
+    if world_size > 1 and not dist.is_initialized():
+        dist.init_process_group('nccl' if torch.cuda.is_available() else 'gloo')
+        if torch.cuda.is_available():
+            torch.cuda.set_device(int(os.environ.get('LOCAL_RANK', 0)))
+    return shard_info()
+
+
+def shard_info():
+    if dist.is_available() and dist.is_initialized():
+        return dist.get_rank(), dist.get_world_size()
+    return 0, 1
+
+
+def is_main_process():
+    return shard_info()[0] == 0
+
+
+@dataclass
+class EngineStats:
+    prompts: int = 0
+    cache_hits: int = 0
+    batches: int = 0
+    model_seconds: float = 0.
+
+    def report(self):
+        computed = self.prompts - self.cache_hits
+        per_prompt = self.model_seconds / computed if computed else 0.
+        return (f'{self.prompts} prompts, {self.cache_hits} from cache, {self.batches} batches, '
+                f'{self.model_seconds:.1f}s in model ({per_prompt:.3f}s/prompt)')
+
+    def reset(self):
+        self.prompts = self.cache_hits = self.batches = 0
+        self.model_seconds = 0.
+
+
+class EvalEngine:
+    """Model-agnostic evaluation loop shared by every evaluator.
+
+    Prompts are looked up in the generation cache, the remaining ones are sorted by length and sent to the
+    backend in batches. With `prompt_tokens` (a `PromptTokenCache`) string prompts are tokenized once per
+    tokenizer and prompt list and read back from disk afterwards, so the backend only pads ready ids. Under torchrun every rank handles an interleaved shard of the prompts and the results
+    are all-gathered, so each rank returns the full list.
+    """
+
+    def __init__(self, backend, cache=None, batch_size=1, prompt_tokens=None):
+        self.backend = backend
+        self.cache = cache
+        self.prompt_tokens = prompt_tokens
+        self.batch_size = batch_size
+        self.stats = EngineStats()
+
+    def report(self, reset=True):
+        """Engine statistics, plus the backend's own ones if it keeps any (e.g. draft acceptance)."""
+        stats = [self.stats] + ([self.backend.stats] if hasattr(self.backend, 'stats') else [])
+        report = ', '.join(part.report() for part in stats)
+        if reset:
+            for part in stats:
+                part.reset()
+        return report
+
+    def generate(self, prompts, generation, cot=False, early_stop=False, on_batch=None):
+        """Responses to `prompts`; `on_batch(indices, responses)` is called as soon as a part of them is known."""
+        key_params = generation.cache_params()
+        if early_stop:
+            key_params['early_stop'] = 'cot' if cot else 'choice'
+        return self._run('answer', prompts, key_params,
+                         lambda batch, input_ids: self.backend.generate(
+                             batch, generation, cot=cot, early_stop=early_stop, input_ids=input_ids),
+                         on_batch=on_batch)
+
+    def choice_scores(self, prompts, generation, choice_ids):
+        key_params = {**generation.cache_params(), 'choice_ids': list(choice_ids)}
+        return self._run('dist', prompts, key_params,
+                         lambda batch, input_ids: self.backend.choice_scores(
+                             batch, generation, choice_ids, input_ids=input_ids))
+
+    def _run(self, kind, prompts, key_params, compute, on_batch=None):
+        rank, world_size = shard_info()
+        results = [None] * len(prompts)
+        keys = [None] * len(prompts)
+        shard = list(range(rank, len(prompts), world_size))
+        if self.cache is not None:
+            for i in shard:
+                keys[i] = self.cache.make_key(kind, prompts[i], key_params)
+                results[i] = self.cache.get(keys[i])
+        todo = [i for i in shard if results[i] is None]
+        if on_batch is not None and len(todo) < len(shard):
+            cached = [i for i in shard if results[i] is not None]
+            on_batch(cached, [results[i] for i in cached])
+        self.stats.prompts += len(shard)
+        self.stats.cache_hits += len(shard) - len(todo)
+        tokens = None
+        if todo and self.prompt_tokens is not None and all(isinstance(prompt, str) for prompt in prompts):
+            # the whole list rather than this rank's misses, so the entry is shared by runs and ranks
+            tokens = self.prompt_tokens.get(prompts)
+            lengths = tokens.lengths()
+        else:
+            lengths = [len(str(prompt)) for prompt in prompts]
+        # longest prompts first, so that batches hold prompts of similar length and OOMs show up early
+        todo.sort(key=lambda i: lengths[i], reverse=True)
+        # a continuous batching backend schedules the prompts itself and gets all of them at once
+        step = max(len(todo), 1) if getattr(self.backend, 'continuous_batching', False) else self.batch_size
+        for start in range(0, len(todo), step):
+            batch = todo[start:start + step]
+            begin = time.time()
+            outputs = compute([prompts[i] for i in batch], None if tokens is None else [tokens[i] for i in batch])
+            self.stats.model_seconds += time.time() - begin
+            self.stats.batches += 1
+            for i, output in zip(batch, outputs):
+                results[i] = output
+                if keys[i] is not None:
+                    self.cache.put(keys[i], output)
+            if on_batch is not None:
+                on_batch(batch, outputs)
+        if self.cache is not None:
+            self.cache.flush()
+        if world_size > 1:
+            gathered = [None] * world_size
+            dist.all_gather_object(gathered, [(i, results[i]) for i in shard])
+            for part in gathered:
+                for i, output in part:
+                    results[i] = output
+        return results
@@ -0,0 +1,98 @@
+import os
+import json
+import hashlib
+
+import numpy as np
+
+from engine.cache import fingerprint_path
+
+
+def tokenizer_fingerprint(tokenizer):
+    """Class, vocabulary size and tokenizer files, everything that can change the ids of a prompt."""
+    parts = {
+        'class': tokenizer.__class__.__name__,
+        'size': len(tokenizer),
+        'files': fingerprint_path(getattr(tokenizer, 'name_or_path', '')),
+    }
+    return hashlib.sha256(json.dumps(parts, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+class TokenizedPrompts:
+    """Token ids of a list of prompts, kept as one flat int32 array plus `len + 1` offsets."""
+
+    def __init__(self, ids, offsets):
+        self.ids = ids
+        self.offsets = offsets
+
+    @classmethod
+    def encode(cls, tokenizer, prompts, chunk_size=512):
+        """Tokenizes the prompts in chunks of `chunk_size`, so fast tokenizers can batch the work."""
+        chunks, lengths = [], []
+        for start in range(0, len(prompts), chunk_size):
+            for ids in tokenizer(list(prompts[start:start + chunk_size]))['input_ids']:
+                chunks.append(np.asarray(ids, dtype=np.int32))
+                lengths.append(len(ids))
+        offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        ids = np.concatenate(chunks) if chunks else np.zeros(0, dtype=np.int32)
+        return cls(ids, offsets)
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        mmap_mode = 'r' if mmap else None
+        return cls(np.load(f'{path}.ids.npy', mmap_mode=mmap_mode),
+                   np.load(f'{path}.offsets.npy', mmap_mode=mmap_mode))
+
+    def save(self, path):
+        # written under a temporary name and renamed, so concurrent ranks never read a partial file
+        for suffix, array in (('ids', self.ids), ('offsets', self.offsets)):
+            tmp_path = f'{path}.{suffix}.{os.getpid()}.tmp'
+            with open(tmp_path, 'wb') as f:
+                np.save(f, array)
+            os.replace(tmp_path, f'{path}.{suffix}.npy')
+
+    def lengths(self):
+        return np.diff(self.offsets)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index):
+        return self.ids[self.offsets[index]:self.offsets[index + 1]]
+
+
+class PromptTokenCache:
+    """On-disk cache of tokenized prompts, memory-mapped on later runs.
+
+    Entries are keyed by the tokenizer fingerprint and the exact prompt list, so a subject is tokenized once
+    per tokenizer and prompt template, and every later run only reads the ids back.
+    """
+
+    def __init__(self, cache_dir, tokenizer):
+        os.makedirs(cache_dir, exist_ok=True)
+        self.cache_dir = cache_dir
+        self.tokenizer = tokenizer
+        self.fingerprint = tokenizer_fingerprint(tokenizer)
+        self.hits = 0
+        self.misses = 0
+
+    def make_key(self, prompts):
+        h = hashlib.sha256(self.fingerprint.encode('utf-8'))
+        for prompt in prompts:
+            encoded = prompt.encode('utf-8')
+            # length prefix, so that prompt boundaries are part of the key
+            h.update(len(encoded).to_bytes(8, 'little'))
+            h.update(encoded)
+        return h.hexdigest()
+
+    def get(self, prompts):
+        path = os.path.join(self.cache_dir, self.make_key(prompts))
+        if os.path.exists(f'{path}.ids.npy') and os.path.exists(f'{path}.offsets.npy'):
+            tokens = TokenizedPrompts.load(path)
+            if len(tokens) == len(prompts):
+                self.hits += 1
+                return tokens
+        self.misses += 1
+        tokens = TokenizedPrompts.encode(self.tokenizer, prompts)
+        tokens.save(path)
+        return tokens
@@ -0,0 +1,126 @@
+from functools import partial
+
+from engine.backends import CausalLMBackend
+from engine.cache import GenerationCache, model_fingerprint
+from engine.compiled import CompiledBackend
+from engine.core import EvalEngine
+from engine.dataset import PromptTokenCache
+from engine.loader import load_model
+from engine.prompts import FewShotBudget, encode_choice
+from engine.retrieval import ExemplarRetriever
+from engine.server import ServerBackend
+from engine.speculative import SpeculativeBackend, truncated_copy
+
+
+def build_backend(tokenizer, load, batch_size=1, decode_offset=0, draft_model=None, draft_layers=0,
+                  num_draft_tokens=4, static_cache=False, continuous_batching=False, draft_kwargs=None):
+    """The backend picked by the evaluator flags, speculative decoding first, then static cache, then the server.
+
+    `load` creates the target model, `draft_kwargs` are passed to `load_model` for a separate `draft_model`.
+    """
+    if draft_model or draft_layers:
+        # a separate small model sharing the tokenizer, or the first `draft_layers` layers of the target
+        load_draft = (lambda target: load_model(draft_model, **(draft_kwargs or {}))) if draft_model \
+            else partial(truncated_copy, num_layers=draft_layers)
+        return SpeculativeBackend(tokenizer, load, load_draft, decode_offset=decode_offset,
+                                  num_draft_tokens=num_draft_tokens, check_prompts=2)
+    if static_cache:
+        return CompiledBackend(tokenizer, load, decode_offset=decode_offset, batch_size=batch_size)
+    if continuous_batching:
+        # questions are streamed through an in-process server, `batch_size` bounds the running batch
+        return ServerBackend(tokenizer, load, decode_offset=decode_offset, max_batch_size=batch_size)
+    return CausalLMBackend(tokenizer, load, decode_offset=decode_offset)
+
+
+class EngineEvaluator:
+    """Engine glue shared by the C-Eval and CMExam evaluators.
+
+    Expects `model_name`, `k`, `few_shot_header`, `adapters`, `format_example` and `format_questions` from
+    the benchmark evaluator it is mixed into.
+    """
+
+    encode_choice = staticmethod(encode_choice)
+
+    def init_engine(self, backend, prompt_builder, choice_ids, answer_generation, dist_generation,
+                    model_name_or_path, lora_path=None, cache_path=None, batch_size=1, load_kwargs=None, token_cache_dir=None, early_stop=False,
+                    max_prompt_tokens=None, shot_retrieval=None, shot_index_dir=None):
+        """Wires the model family specific pieces into the shared evaluation engine."""
+        self.tokenizer = backend.tokenizer
+        self.prompt_builder = prompt_builder
+        self.choice_ids = choice_ids
+        self.answer_generation = answer_generation
+        self.dist_generation = dist_generation
+        self.early_stop = early_stop
+        self.model_name_or_path = model_name_or_path
+        self.fingerprint_extra = {
+            k: str(v) for k, v in (load_kwargs or {}).items() if k in ('dtype', 'quantize', 'onnx_dir') and v}
+        cache = None
+        if cache_path:
+            cache = GenerationCache(cache_path, model_fingerprint(
+                model_name_or_path, lora_path, self.tokenizer, evaluator=self.model_name, **self.fingerprint_extra))
+        prompt_tokens = PromptTokenCache(token_cache_dir, self.tokenizer) if token_cache_dir else None
+        self.engine = EvalEngine(backend, cache=cache, batch_size=batch_size, prompt_tokens=prompt_tokens)
+        self.shot_budget = None
+        if max_prompt_tokens:
+            self.shot_budget = FewShotBudget(self.tokenizer, prompt_builder, max_prompt_tokens, prompt_tokens)
+        self.retriever = ExemplarRetriever(shot_index_dir, analyzer=shot_retrieval) if shot_retrieval else None
+
+    @property
+    def model(self):
+        return self.engine.backend.model
+
+    def set_adapter(self, name, lora_path):
+        """Switches to another LoRA adapter, attaching it first if it is not one of `lora_paths`.
+
+        The base model stays loaded, only the adapter weights are read.
+        """
+        if name not in self.adapters:
+            self.engine.backend.add_adapter(name, lora_path)
+            self.adapters[name] = lora_path
+        self.engine.backend.set_adapter(name)
+        if self.engine.cache is not None:
+            # unmerged adapters round differently from merged weights, so they get their own cache entries
+            self.engine.cache.fingerprint = model_fingerprint(
+                self.model_name_or_path, lora_path, self.tokenizer, evaluator=self.model_name, lora_mode='unmerged',
+                **self.fingerprint_extra)
+
+    def remove_adapter(self, name):
+        """Frees an adapter that will not be evaluated again."""
+        self.adapters.pop(name, None)
+        self.engine.backend.remove_adapter(name)
+
+    def generate_few_shot_prompt(self, subject, dev_df, cot=False):
+        message = []
+        k = self.k
+        if self.k == -1:
+            k = dev_df.shape[0]
+        message.append(self.format_example(
+            dev_df.iloc[0, :], cot=cot, add_prompt=self.few_shot_header.format(subject=subject)))
+        for i in range(1, k):
+            message.append(self.format_example(dev_df.iloc[i, :], cot=cot))
+        return message
+
+    def few_shot_histories(self, subject_name, questions, dev_df, cot=False):
+        """Few-shot examples of every question: the first `k` dev rows, or the `k` most similar with retrieval."""
+        if self.retriever is None:
+            return [self.generate_few_shot_prompt(subject_name, dev_df, cot=cot)] * len(questions)
+        k = dev_df.shape[0] if self.k == -1 else self.k
+        selected = self.retriever.select(self.format_questions(dev_df), questions, k)
+        shots = [self.format_example(row, cot=cot) for row in dev_df.to_dict('records')]
+        header = self.few_shot_header.format(subject=subject_name)
+        return [[(header + shots[indices[0]][0], shots[indices[0]][1])] + [shots[i] for i in indices[1:]]
+                for indices in selected]
+
+    def few_shot_prompts(self, subject_name, questions, histories, generation):
+        """Prompts with as many leading examples of their history as `max_prompt_tokens` leaves room for.
+
+        Room for the question and `max_new_tokens` of answer is kept; the shots used are kept in `n_shots`.
+        """
+        if self.shot_budget is None:
+            self.n_shots = [len(history) for history in histories]
+            return [self.prompt_builder(question, history) for question, history in zip(questions, histories)]
+        prompts, self.n_shots = self.shot_budget.fit(
+            questions, histories, reserve=generation.params.get('max_new_tokens') or 0)
+        print(f'{subject_name}: {sum(self.n_shots) / max(len(self.n_shots), 1):.2f} of '
+              f'{max(map(len, histories), default=0)} shots within {self.shot_budget.max_prompt_tokens} tokens')
+        return prompts
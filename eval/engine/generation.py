@@ -0,0 +1,68 @@
+import copy
+from dataclasses import dataclass, field
+from types import MappingProxyType
+from typing import Any, Dict, Mapping, Tuple
+
+import torch
+from transformers.generation.logits_process import LogitsProcessor
+from transformers.generation.utils import LogitsProcessorList
+
+
+class InvalidScoreLogitsProcessor(LogitsProcessor):
+    """Replaces the scores of rows containing NaN/Inf with a fixed distribution.
+
+    The check is a masked fill over the whole batch, so unlike `if torch.isnan(scores).any()` it never
+    forces a device-to-host sync per decode step.
+    """
+
+    def __init__(self, fallback_token_id=5, fallback_score=5e4):
+        self.fallback_token_id = fallback_token_id
+        self.fallback_score = fallback_score
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor) -> torch.FloatTensor:
+        invalid = ~torch.isfinite(scores).all(dim=-1, keepdim=True)
+        scores = scores.masked_fill(invalid, 0.)
+        scores[..., self.fallback_token_id] = scores[..., self.fallback_token_id].masked_fill(
+            invalid[..., 0], self.fallback_score)
+        return scores
+
+
+@dataclass(frozen=True)
+class GenerationSetup:
+    """Decoding parameters and logits processors, built once per evaluator and never mutated.
+
+    `generate_kwargs` hands out a fresh `LogitsProcessorList` over the same processor tuple on every call,
+    so nothing can accumulate across questions. The `GenerationConfig` is derived once per model from the
+    model's own config (keeping its eos/pad ids) updated with `params`.
+    """
+    params: Mapping[str, Any]
+    processors: Tuple[LogitsProcessor, ...] = ()
+    _configs: Dict[int, Any] = field(default_factory=dict, repr=False, compare=False)
+
+    @classmethod
+    def create(cls, processors=(InvalidScoreLogitsProcessor(),), **params):
+        return cls(MappingProxyType(dict(params)), tuple(processors))
+
+    def updated(self, processors=(), **params):
+        """Returns a setup with `params` overridden and `processors` appended, or self if nothing changes."""
+        if not processors and all(self.params.get(k, object()) == v for k, v in params.items()):
+            return self
+        return GenerationSetup(MappingProxyType({**self.params, **params}), self.processors + tuple(processors))
+
+    def generation_config(self, model):
+        config = self._configs.get(id(model))
+        if config is None:
+            config = copy.deepcopy(model.generation_config)
+            config.update(**self.params)
+            self._configs[id(model)] = config
+        return config
+
+    def generate_kwargs(self, model):
+        kwargs = {"generation_config": self.generation_config(model)}
+        if self.processors:
+            kwargs["logits_processor"] = LogitsProcessorList(self.processors)
+        return kwargs
+
+    def cache_params(self):
+        """JSON-serializable view of the decoding params, used in generation cache keys."""
+        return dict(self.params)
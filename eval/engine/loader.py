@@ -0,0 +1,101 @@
+import os
+import time
+import resource
+
+import torch
+from peft import PeftModel
+from transformers import AutoModelForCausalLM
+
+DTYPES = {'fp16': torch.float16, 'bf16': torch.bfloat16, 'fp32': torch.float32}
+
+
+def resolve_dtype(dtype, device):
+    """`auto` is fp16 on GPU and fp32 on CPU, where fp16 kernels are slow or missing."""
+    if dtype in (None, 'auto'):
+        return torch.float32 if device == 'cpu' else torch.float16
+    return DTYPES[dtype] if isinstance(dtype, str) else dtype
+
+
+def adapter_names(lora_paths):
+    """Unique adapter names for `lora_paths`, from the directory names (`checkpoint-500`, ...)."""
+    names = {}
+    for path in lora_paths:
+        name = os.path.basename(os.path.normpath(path)).replace('.', '_')
+        if name in names:
+            name = f'{name}_{len(names)}'
+        names[name] = path
+    return names
+
+
+def load_model(model_name_or_path, lora_path=None, device='cuda:0', device_map=None, model_class=AutoModelForCausalLM,
+               dtype='auto', quantize=None, onnx_dir=None, num_threads=None, adapters=None):
+    """Loads a model for evaluation, with an optional LoRA adapter merged into the weights.
+
+    `adapters` (name -> path) instead attaches several LoRA adapters without merging them, so that they can
+    be switched with `set_adapter` on the same base weights.
+    Weights are created on the meta device and filled in the target dtype straight from the checkpoint
+    (memory-mapped when it is in safetensors), on the GPU given by `device` unless `device_map` dispatches
+    them with accelerate, so no fp32 copy is ever materialized in host RAM. On CPU the model can be int8 dynamically quantized (`quantize='int8'`, Linear layers only) or exported
+    to ONNX Runtime (`onnx_dir`), and `num_threads` sets the intra-op thread count.
+    """
+    if device == 'cpu':
+        device_map = None
+        if num_threads:
+            torch.set_num_threads(num_threads)
+    if lora_path and adapters:
+        raise ValueError("either merge one LoRA adapter or attach several, not both")
+    if onnx_dir:
+        if lora_path or adapters:
+            raise ValueError("merge the LoRA adapter with scripts/merge_peft_adapter.py before exporting to ONNX")
+        return load_onnx_model(model_name_or_path, onnx_dir)
+    begin = time.time()
+    kwargs = {"trust_remote_code": True, "resume_download": True, "torch_dtype": resolve_dtype(dtype, device),
+              "low_cpu_mem_usage": True}
+    if device_map:
+        kwargs["device_map"] = device_map
+    elif device != 'cpu':
+        kwargs["device_map"] = {"": device}
+    model = model_class.from_pretrained(model_name_or_path, **kwargs)
+    if lora_path:
+        model = PeftModel.from_pretrained(model, lora_path, **({"device_map": device_map} if device_map else {}))
+        model = model.merge_and_unload()
+        print("Loaded lora model")
+    elif adapters:
+        for name, path in adapters.items():
+            model = attach_adapter(model, name, path, device_map)
+        print(f"Loaded {len(adapters)} lora adapters")
+    if not device_map:
+        model = model.to(device)
+    model.eval()
+    if quantize == 'int8':
+        if device != 'cpu':
+            raise ValueError("int8 dynamic quantization is only supported with --device cpu")
+        model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    elif quantize:
+        raise ValueError(f"unknown quantization {quantize}")
+    # ru_maxrss is in KB on Linux
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024 ** 2
+    print(f"Loaded {model_name_or_path} in {time.time() - begin:.1f}s, peak RSS {peak_rss:.2f} GB")
+    return model
+
+
+def attach_adapter(model, name, path, device_map=None):
+    """Loads the LoRA adapter at `path` next to the ones already attached, wrapping a base model on first use."""
+    peft_kwargs = {"device_map": device_map} if device_map else {}
+    if isinstance(model, PeftModel):
+        model.load_adapter(path, adapter_name=name, **peft_kwargs)
+        return model
+    return PeftModel.from_pretrained(model, path, adapter_name=name, **peft_kwargs)
+
+
+def load_onnx_model(model_name_or_path, onnx_dir):
+    """Exports the model to ONNX Runtime once into `onnx_dir` and reuses the export afterwards."""
+    try:
+        from optimum.onnxruntime import ORTModelForCausalLM
+    except ImportError:
+        raise ImportError("ONNX Runtime inference needs `pip install optimum[onnxruntime]`")
+    if os.path.isdir(onnx_dir) and os.listdir(onnx_dir):
+        return ORTModelForCausalLM.from_pretrained(onnx_dir)
+    model = ORTModelForCausalLM.from_pretrained(model_name_or_path, export=True, trust_remote_code=True)
+    model.save_pretrained(onnx_dir)
+    return model
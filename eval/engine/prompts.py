@@ -0,0 +1,77 @@
+import numpy as np
+
+from engine.dataset import TokenizedPrompts
+
+
+def encode_choice(tokenizer, choice):
+    """Id of the token the model emits for option letter `choice`, the first token of the letter without bos."""
+    return tokenizer.encode(choice, add_special_tokens=False)[0]
+
+
+class RawPromptBuilder:
+    """The query is sent as is, few-shot examples (query, answer) go in front of it, one paragraph each."""
+
+    def __call__(self, query, history=None):
+        return ''.join(f'{old_query}{response}\n\n' for old_query, response in history or []) + query
+
+
+class RoundPromptBuilder:
+    """`[Round n]` chat format used by the Baichuan and LLaMA evaluators, history is a list of (query, answer)."""
+
+    def __call__(self, query, history=None):
+        if history is None:
+            history = []
+        prompt = ""
+        for i, (old_query, response) in enumerate(history):
+            prompt += "[Round {}]\n\n问：{}\n\n答：{}\n\n".format(i + 1, old_query, response)
+        prompt += "[Round {}]\n\n问：{}\n\n答：".format(len(history) + 1, query)
+        return prompt
+
+
+class ChatPromptBuilder:
+    """Keeps query and history apart for backends that format the conversation themselves (ChatGLM `chat`)."""
+
+    def __call__(self, query, history=None):
+        return query, [list(turn) for turn in history or []]
+
+
+class FewShotBudget:
+    """Decides per question how many leading few-shot examples fit in `max_prompt_tokens`.
+
+    Every example is rendered on its own by the (string) prompt builder and counted once, through the prompt
+    token cache when one is given, so a dev set is tokenized once per template. Examples are taken in order
+    while the question and `reserve` answer tokens still fit. The assembled prompts are then counted for
+    real, and the rare one that tokenization across example boundaries pushed over the limit loses a shot.
+    """
+
+    def __init__(self, tokenizer, prompt_builder, max_prompt_tokens, prompt_tokens=None):
+        self.tokenizer = tokenizer
+        self.prompt_builder = prompt_builder
+        self.max_prompt_tokens = max_prompt_tokens
+        self.prompt_tokens = prompt_tokens
+
+    def count(self, prompts, cached=True):
+        if cached and self.prompt_tokens is not None:
+            return self.prompt_tokens.get(prompts).lengths().astype(np.int64)
+        return TokenizedPrompts.encode(self.tokenizer, prompts).lengths()
+
+    def fit(self, questions, histories, reserve=0):
+        """Returns the prompts of `questions` and how many leading shots of their `histories` each one holds."""
+        limit = self.max_prompt_tokens - reserve
+        shots = list(dict.fromkeys(shot for history in histories for shot in history))
+        costs = self.count([self.prompt_builder('', [])] + [self.prompt_builder('', [shot]) for shot in shots])
+        shot_costs = dict(zip(shots, np.maximum(costs[1:] - costs[0], 0)))
+        question_costs = self.count([self.prompt_builder(question, []) for question in questions])
+        n_shots = [int(np.searchsorted(np.cumsum([shot_costs[shot] for shot in history]), limit - cost, side='right'))
+                   for history, cost in zip(histories, question_costs)]
+        prompts = [self.prompt_builder(question, history[:n]) for question, history, n in zip(questions, histories, n_shots)]
+        # the engine tokenizes the same list again, so this count is a cache hit there
+        lengths = self.count(prompts)
+        over = [i for i in range(len(prompts)) if lengths[i] > limit and n_shots[i] > 0]
+        while over:
+            for i in over:
+                n_shots[i] -= 1
+                prompts[i] = self.prompt_builder(questions[i], histories[i][:n_shots[i]])
+            lengths = self.count([prompts[i] for i in over], cached=False)
+            over = [i for i, length in zip(over, lengths) if length > limit and n_shots[i] > 0]
+        return prompts, n_shots
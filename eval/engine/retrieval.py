@@ -0,0 +1,144 @@
+import os
+import json
+import math
+import hashlib
+from collections import Counter
+
+import numpy as np
+
+try:
+    import jieba
+except ImportError:
+    jieba = None
+
+ANALYZERS = ('chars', 'jieba')
+
+
+def segment(text, analyzer='chars'):
+    """Terms of `text`: characters and character bigrams, or jieba words; whitespace is dropped.
+
+    Character n-grams need no dictionary and cost a few microseconds per question, jieba segmentation
+    takes about half a millisecond.
+    """
+    if analyzer == 'jieba':
+        if jieba is None:
+            raise ImportError("the jieba analyzer needs `pip install jieba`")
+        return [word for word in jieba.lcut(text) if word.strip()]
+    chars = [char for char in text if not char.isspace()]
+    return chars + [a + b for a, b in zip(chars, chars[1:])]
+
+
+class ExemplarIndex:
+    """TF-IDF vectors of an exemplar pool, L2-normalized so a dot product is the cosine similarity.
+
+    The vocabulary is the `max_features` terms found in most exemplars. Vectors are a dense float32
+    matrix, saved as `.npy` and memory-mapped when the same pool is indexed again.
+    """
+
+    def __init__(self, vocabulary, idf, vectors, analyzer='chars'):
+        self.vocabulary = vocabulary
+        self.idf = idf
+        self.vectors = vectors
+        self.analyzer = analyzer
+
+    @classmethod
+    def build(cls, texts, max_features=4096, analyzer='chars'):
+        docs = [Counter(segment(text, analyzer)) for text in texts]
+        df = Counter(term for doc in docs for term in doc)
+        terms = sorted(df, key=lambda term: (-df[term], term))[:max_features]
+        vocabulary = {term: i for i, term in enumerate(terms)}
+        idf = np.array([math.log((1 + len(docs)) / (1 + df[term])) + 1 for term in terms], dtype=np.float32)
+        index = cls(vocabulary, idf, None, analyzer)
+        index.vectors = index.vectorize(docs)
+        return index
+
+    def vectorize(self, docs):
+        """Normalized vectors of term counters, sublinear term frequency."""
+        vectors = np.zeros((len(docs), len(self.vocabulary)), dtype=np.float32)
+        for row, doc in enumerate(docs):
+            for term, count in doc.items():
+                column = self.vocabulary.get(term)
+                if column is not None:
+                    vectors[row, column] = 1 + math.log(count)
+        vectors *= self.idf
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
+
+    def embed(self, texts):
+        return self.vectorize([Counter(segment(text, self.analyzer)) for text in texts])
+
+    def top_k(self, queries, k, batch_size=1024):
+        """Indices of the `k` exemplars most similar to every query, most similar first."""
+        k = min(k, len(self.vectors))
+        selected = np.zeros((len(queries), k), dtype=np.int64)
+        for start in range(0, len(queries), batch_size):
+            scores = self.embed(queries[start:start + batch_size]) @ self.vectors.T
+            if k < scores.shape[1]:
+                top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            else:
+                top = np.broadcast_to(np.arange(scores.shape[1]), scores.shape)
+            # stable sort, ties keep the pool order
+            order = np.argsort(-np.take_along_axis(scores, top, axis=1), axis=1, kind='stable')
+            selected[start:start + batch_size] = np.take_along_axis(top, order, axis=1)
+        return selected
+
+    def save(self, path):
+        # written under temporary names and renamed, so a concurrent run never reads a partial index
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'vocabulary': self.vocabulary, 'idf': self.idf.tolist(), 'analyzer': self.analyzer}, f,
+                      ensure_ascii=False)
+        os.replace(tmp_path, f'{path}.json')
+        with open(tmp_path, 'wb') as f:
+            np.save(f, self.vectors)
+        os.replace(tmp_path, f'{path}.npy')
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        with open(f'{path}.json', encoding='utf-8') as f:
+            meta = json.load(f)
+        return cls(meta['vocabulary'], np.asarray(meta['idf'], dtype=np.float32),
+                   np.load(f'{path}.npy', mmap_mode='r' if mmap else None), meta['analyzer'])
+
+
+class ExemplarRetriever:
+    """Picks the few-shot exemplars most similar to each question from a pool.
+
+    Indexes are keyed by the exact pool texts, kept in memory for the run and, with `cache_dir`, on disk
+    for later runs.
+    """
+
+    def __init__(self, cache_dir=None, max_features=4096, analyzer='chars'):
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+        self.cache_dir = cache_dir
+        self.max_features = max_features
+        self.analyzer = analyzer
+        self._indexes = {}
+
+    def make_key(self, texts):
+        h = hashlib.sha256(f'{self.analyzer}:{self.max_features}'.encode('utf-8'))
+        for text in texts:
+            encoded = text.encode('utf-8')
+            h.update(len(encoded).to_bytes(8, 'little'))
+            h.update(encoded)
+        return h.hexdigest()
+
+    def index(self, texts):
+        key = self.make_key(texts)
+        index = self._indexes.get(key)
+        if index is not None:
+            return index
+        path = os.path.join(self.cache_dir, key) if self.cache_dir else None
+        if path and os.path.exists(f'{path}.json') and os.path.exists(f'{path}.npy'):
+            index = ExemplarIndex.load(path)
+        else:
+            index = ExemplarIndex.build(texts, self.max_features, self.analyzer)
+            if path:
+                index.save(path)
+        self._indexes[key] = index
+        return index
+
+    def select(self, pool, questions, k):
+        """For every question, indices into `pool` of its `k` nearest exemplars, most similar first."""
+        return self.index(list(pool)).top_k(list(questions), k)
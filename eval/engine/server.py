@@ -0,0 +1,340 @@
+import os
+import sys
+import json
+import queue
+import inspect
+import argparse
+import threading
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, List, Optional
+
+import torch
+from transformers.generation.utils import LogitsProcessorList
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from engine.backends import CausalLMBackend
+from engine.stopping import AnswerStoppingCriteria
+
+try:
+    from transformers import DynamicCache
+except ImportError:  # transformers < 4.36 only knows the legacy tuples
+    DynamicCache = None
+
+DEFAULT_MAX_NEW_TOKENS = 256
+
+
+def pack_past(layers):
+    """Per-layer (key, value) tensors in the cache format the installed transformers expects."""
+    if DynamicCache is None:
+        return tuple(layers)
+    if hasattr(DynamicCache, 'from_legacy_cache'):
+        return DynamicCache.from_legacy_cache(tuple(layers))
+    return DynamicCache(layers)
+
+
+def unpack_past(past):
+    if isinstance(past, (tuple, list)):
+        return [tuple(layer) for layer in past]
+    if hasattr(past, 'to_legacy_cache'):
+        return list(past.to_legacy_cache())
+    return [(layer.keys, layer.values) for layer in past.layers]
+
+
+@dataclass
+class Request:
+    prompt_ids: List[int]
+    max_new_tokens: int
+    # called with the generated ids after every step, returns how many of them to keep once the answer is complete
+    stop: Optional[Callable[[List[int]], Optional[int]]] = None
+    processors: tuple = ()
+    future: Future = field(default_factory=Future)
+    tokens: List[int] = field(default_factory=list)
+    # tokens held in the KV cache, the last generated token is fed at the next step
+    length: int = 0
+
+
+class InferenceServer:
+    """Greedy decoding with continuous batching over one model.
+
+    Requests are queued by `submit` and picked up by a background thread. A new request is prefilled on
+    its own and joins the running batch at the next decode step; a finished one leaves the batch right
+    away, so the decode slots are never spent on padding of sequences that are already done. The KV cache
+    of the batch is kept left-padded: joining pads the shorter side on the left, leaving drops the row and
+    trims the columns that only held padding.
+    """
+
+    def __init__(self, model, tokenizer, max_batch_size=8):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.max_batch_size = max_batch_size
+        self.eos_token_id = model.generation_config.eos_token_id
+        if isinstance(self.eos_token_id, int):
+            self.eos_token_id = [self.eos_token_id]
+        # ALiBi models (Baichuan-13B) take no position ids
+        self._position_ids = 'position_ids' in inspect.signature(model.forward).parameters
+        self._queue = queue.Queue()
+        self._active = []
+        self._past = None
+        self._mask = None
+        self._thread = None
+        self._closed = False
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name='inference-server', daemon=True)
+            self._thread.start()
+        return self
+
+    def close(self):
+        self._closed = True
+        self._queue.put(None)
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def submit(self, prompt_ids, max_new_tokens=DEFAULT_MAX_NEW_TOKENS, stop=None, processors=()):
+        """Queues a prompt and returns a future resolving to the list of generated token ids."""
+        request = Request(list(prompt_ids), max_new_tokens, stop, tuple(processors))
+        self.start()
+        self._queue.put(request)
+        return request.future
+
+    def generate(self, prompt, max_new_tokens=DEFAULT_MAX_NEW_TOKENS):
+        """Blocking convenience for ad-hoc checks: text in, decoded response out."""
+        tokens = self.submit(self.tokenizer(prompt)['input_ids'], max_new_tokens).result()
+        return self.tokenizer.decode(tokens, skip_special_tokens=True)
+
+    def _loop(self):
+        with torch.no_grad():
+            while not self._closed:
+                # block while idle, otherwise only take what is already waiting
+                if not self._active and not self._admit(self._queue.get()):
+                    continue
+                while len(self._active) < self.max_batch_size and not self._queue.empty():
+                    self._admit(self._queue.get_nowait())
+                if self._active:
+                    self._step()
+
+    def _admit(self, request):
+        if request is None:
+            return False
+        try:
+            input_ids = torch.tensor([request.prompt_ids], device=self.model.device)
+            outputs = self.model(input_ids=input_ids, use_cache=True)
+        except Exception as e:
+            request.future.set_exception(e)
+            return False
+        request.length = len(request.prompt_ids)
+        if self._emit(request, outputs.logits[0, -1]):
+            return False
+        past = unpack_past(outputs.past_key_values)
+        mask = torch.ones((1, request.length), dtype=torch.long, device=input_ids.device)
+        if self._past is None:
+            self._past, self._mask = past, mask
+        else:
+            width = max(self._mask.shape[1], mask.shape[1])
+            self._past = [tuple(torch.cat([self._pad(old, width), self._pad(new, width)]) for old, new in zip(a, b))
+                          for a, b in zip(self._past, past)]
+            self._mask = torch.cat([self._pad(self._mask, width, dim=1), self._pad(mask, width, dim=1)])
+        self._active.append(request)
+        return True
+
+    @staticmethod
+    def _pad(tensor, width, dim=-2):
+        missing = width - tensor.shape[dim]
+        if missing == 0:
+            return tensor
+        shape = list(tensor.shape)
+        shape[dim] = missing
+        return torch.cat([tensor.new_zeros(shape), tensor], dim=dim)
+
+    def _step(self):
+        device = self._mask.device
+        input_ids = torch.tensor([[request.tokens[-1]] for request in self._active], device=device)
+        mask = torch.cat([self._mask, self._mask.new_ones((len(self._active), 1))], dim=1)
+        kwargs = {}
+        if self._position_ids:
+            kwargs['position_ids'] = torch.tensor([[request.length] for request in self._active], device=device)
+        try:
+            outputs = self.model(input_ids=input_ids, attention_mask=mask, past_key_values=pack_past(self._past),
+                                 use_cache=True, **kwargs)
+        except Exception as e:
+            for request in self._active:
+                request.future.set_exception(e)
+            self._active, self._past, self._mask = [], None, None
+            return
+        self._past, self._mask = unpack_past(outputs.past_key_values), mask
+        keep = []
+        for row, request in enumerate(self._active):
+            request.length += 1
+            if not self._emit(request, outputs.logits[row, -1]):
+                keep.append(row)
+        if len(keep) == len(self._active):
+            return
+        self._active = [self._active[row] for row in keep]
+        if not keep:
+            self._past, self._mask = None, None
+            return
+        index = torch.tensor(keep, device=device)
+        self._mask = self._mask.index_select(0, index)
+        # drop the leading columns that are padding for every remaining sequence
+        start = int((self._mask.sum(dim=0) > 0).nonzero()[0])
+        self._mask = self._mask[:, start:]
+        self._past = [tuple(t.index_select(0, index)[:, :, start:] for t in layer) for layer in self._past]
+
+    def _emit(self, request, scores):
+        """Appends the greedy token to `request`, resolves its future and returns True once it is done.
+
+        A raising processor or stop callback fails that request's future only, the request then leaves the
+        batch like a finished one instead of killing the serving thread.
+        """
+        try:
+            end = self._next_token(request, scores)
+        except Exception as e:
+            request.future.set_exception(e)
+            return True
+        if end is None:
+            return False
+        request.future.set_result(request.tokens[:end])
+        return True
+
+    def _next_token(self, request, scores):
+        """Appends the greedy token to `request`, returns how many tokens to keep once it is done, else None."""
+        if request.processors:
+            input_ids = torch.tensor([request.prompt_ids + request.tokens], device=scores.device)
+            scores = LogitsProcessorList(request.processors)(input_ids, scores[None])[0]
+        token = int(scores.argmax())
+        request.tokens.append(token)
+        end = None
+        if token in self.eos_token_id:
+            end = len(request.tokens)
+        elif request.stop is not None:
+            end = request.stop(request.tokens)
+        if end is None and len(request.tokens) >= request.max_new_tokens:
+            end = len(request.tokens)
+        return end
+
+
+class ServerBackend(CausalLMBackend):
+    """Evaluation backend submitting every question to an in-process `InferenceServer` at once.
+
+    Only greedy decoding is served; choice scoring still runs as static batches of `max_batch_size`,
+    it decodes a single token anyway.
+    """
+    continuous_batching = True
+
+    def __init__(self, tokenizer, load_model, decode_offset=0, max_batch_size=8):
+        super().__init__(tokenizer, load_model, decode_offset=decode_offset)
+        self.max_batch_size = max_batch_size
+        self._server = None
+
+    @property
+    def server(self):
+        if self._server is None:
+            self._server = InferenceServer(self.model, self.tokenizer, self.max_batch_size).start()
+        return self._server
+
+    def close(self):
+        """Stops the serving thread; a later `generate` starts a new one."""
+        if self._server is not None:
+            self._server.close()
+            self._server = None
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
+
+    def generate(self, prompts, generation, cot=False, early_stop=False, input_ids=None):
+        params = generation.params
+        if params.get('do_sample') or params.get('num_beams', 1) > 1:
+            raise ValueError("the inference server only decodes greedily")
+        if input_ids is None:
+            input_ids = self.tokenizer(list(prompts))['input_ids']
+        # checkpoints setting only `max_length` leave `max_new_tokens` unset
+        max_new_tokens = (params.get('max_new_tokens') or self.model.generation_config.max_new_tokens
+                          or DEFAULT_MAX_NEW_TOKENS)
+        futures = []
+        for ids in input_ids:
+            ids = [int(token) for token in ids]
+            stop = AnswerStoppingCriteria(self.tokenizer, 0, cot=cot).answer_end if early_stop else None
+            futures.append((ids, self.server.submit(ids, max_new_tokens, stop=stop, processors=generation.processors)))
+        return [self.tokenizer.decode(ids[len(ids) - self.decode_offset:] + future.result()) for ids, future in futures]
+
+    def choice_scores(self, prompts, generation, choice_ids, input_ids=None):
+        scores = []
+        for start in range(0, len(prompts), self.max_batch_size):
+            end = start + self.max_batch_size
+            scores += super().choice_scores(
+                prompts[start:end], generation, choice_ids, None if input_ids is None else input_ids[start:end])
+        return scores
+
+
+def make_http_server(server, host='127.0.0.1', port=8000):
+    """JSON endpoint `POST /generate {"prompt": ..., "max_new_tokens": ...}` in front of `server`.
+
+    Every HTTP request runs in its own thread and blocks on its future, so concurrent clients share the
+    continuous batch.
+    """
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            if self.path != '/generate':
+                self.send_error(404)
+                return
+            try:
+                body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+                if not isinstance(body, dict) or not isinstance(body.get('prompt'), str):
+                    raise ValueError('expected a JSON object with a string "prompt"')
+                prompt, max_new_tokens = body['prompt'], int(body.get('max_new_tokens', DEFAULT_MAX_NEW_TOKENS))
+            except (TypeError, ValueError) as e:
+                self.send_error(400, str(e))
+                return
+            try:
+                response = server.generate(prompt, max_new_tokens)
+            except Exception as e:
+                # the model or a processor failed, the client still gets an answer
+                self.send_error(500, str(e))
+                return
+            payload = json.dumps({'response': response}, ensure_ascii=False).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json; charset=utf-8')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+    return ThreadingHTTPServer((host, port), Handler)
+
+
+if __name__ == '__main__':
+    from transformers import AutoTokenizer
+    from engine.loader import load_model
+
+    parser = argparse.ArgumentParser(description="Serve a checkpoint on localhost with continuous batching")
+    parser.add_argument("--model_name_or_path", type=str, required=True)
+    parser.add_argument("--lora_path", type=str, default='')
+    parser.add_argument("--device", type=str, default="cuda:0")
+    parser.add_argument("--dtype", type=str, default='auto', choices=['auto', 'fp16', 'bf16', 'fp32'])
+    parser.add_argument("--max_batch_size", type=int, default=8)
+    parser.add_argument("--host", type=str, default='127.0.0.1')
+    parser.add_argument("--port", type=int, default=8000)
+    args = parser.parse_args()
+    tokenizer = AutoTokenizer.from_pretrained(args.model_name_or_path, trust_remote_code=True)
+    model = load_model(args.model_name_or_path, args.lora_path or None, device=args.device, dtype=args.dtype)
+    with InferenceServer(model, tokenizer, args.max_batch_size) as server:
+        http_server = make_http_server(server, args.host, args.port)
+        print(f"serving {args.model_name_or_path} on http://{args.host}:{args.port}/generate")
+        try:
+            http_server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        http_server.server_close()
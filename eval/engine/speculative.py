@@ -0,0 +1,170 @@
+import copy
+import time
+from dataclasses import dataclass
+
+import torch
+from torch import nn
+from transformers.generation.utils import LogitsProcessorList
+
+from engine.backends import CausalLMBackend
+from engine.server import DEFAULT_MAX_NEW_TOKENS, pack_past, unpack_past
+from engine.stopping import AnswerStoppingCriteria
+
+
+def truncated_copy(model, num_layers):
+    """Draft model made of the first `num_layers` decoder layers of `model`, sharing its weights.
+
+    Works for the LLaMA-style layout (`model.model.layers`) of Baichuan and LLaMA; no memory is allocated.
+    """
+    inner = copy.copy(model.model)
+    inner._modules = dict(inner._modules)
+    inner.layers = nn.ModuleList(list(model.model.layers)[:num_layers])
+    draft = copy.copy(model)
+    draft._modules = dict(draft._modules)
+    draft.model = inner
+    draft.config = copy.deepcopy(model.config)
+    draft.config.num_hidden_layers = num_layers
+    inner.config = draft.config
+    return draft
+
+
+def crop_past(past, length):
+    return [tuple(t[:, :, :length] for t in layer) for layer in past]
+
+
+@dataclass
+class SpeculativeStats:
+    generated: int = 0
+    drafted: int = 0
+    accepted: int = 0
+    target_passes: int = 0
+    # prompts also decoded without the draft model, to measure the speedup and check the outputs match
+    checked: int = 0
+    mismatches: int = 0
+    checked_seconds: float = 0.
+    plain_seconds: float = 0.
+
+    def report(self):
+        acceptance = self.accepted / self.drafted if self.drafted else 0.
+        per_pass = self.generated / self.target_passes if self.target_passes else 0.
+        report = f'draft acceptance {acceptance:.1%}, {per_pass:.2f} tokens/target pass'
+        if self.checked:
+            speedup = self.plain_seconds / self.checked_seconds if self.checked_seconds else 0.
+            report += f', {speedup:.2f}x speedup over greedy on {self.checked} prompts ({self.mismatches} mismatches)'
+        return report
+
+    def reset(self):
+        self.generated = self.drafted = self.accepted = self.target_passes = 0
+        self.checked = self.mismatches = 0
+        self.checked_seconds = self.plain_seconds = 0.
+
+
+class SpeculativeBackend(CausalLMBackend):
+    """Greedy generation with draft tokens verified by the target model.
+
+    The draft model (`load_draft(target)`, e.g. a small Baichuan/LLaMA or `truncated_copy`) proposes
+    `num_draft_tokens` tokens, the target scores all of them in one forward pass and keeps the longest
+    prefix matching its own greedy choice plus its next token. Outputs are therefore identical to greedy
+    decoding with the target alone. Prompts are decoded one at a time. The first `check_prompts` prompts
+    after every stats reset (once per subject) are decoded with `generate` as well, to report the measured
+    speedup and any mismatch.
+    """
+
+    def __init__(self, tokenizer, load_model, load_draft, decode_offset=0, num_draft_tokens=4, check_prompts=0):
+        super().__init__(tokenizer, load_model, decode_offset=decode_offset)
+        self.load_draft = load_draft
+        self.num_draft_tokens = num_draft_tokens
+        self.check_prompts = check_prompts
+        self.stats = SpeculativeStats()
+        self._draft = None
+
+    @property
+    def draft(self):
+        if self._draft is None:
+            self._draft = self.load_draft(self.model)
+        return self._draft
+
+    @torch.no_grad()
+    def generate(self, prompts, generation, cot=False, early_stop=False, input_ids=None):
+        params = generation.params
+        if params.get('do_sample') or params.get('num_beams', 1) > 1:
+            raise ValueError("speculative decoding only supports greedy decoding")
+        if input_ids is None:
+            input_ids = self.tokenizer(list(prompts))['input_ids']
+        max_new_tokens = (params.get('max_new_tokens') or self.model.generation_config.max_new_tokens
+                          or DEFAULT_MAX_NEW_TOKENS)
+        # the draft is loaded here, not inside the first timed `speculate`
+        self.draft
+        responses = []
+        for i, ids in enumerate(input_ids):
+            ids = [int(token) for token in ids]
+            stop = AnswerStoppingCriteria(self.tokenizer, 0, cot=cot).answer_end if early_stop else None
+            check = self.stats.checked < self.check_prompts
+            begin = time.time()
+            tokens = self.speculate(ids, max_new_tokens, stop, generation.processors)
+            if check:
+                self.stats.checked_seconds += time.time() - begin
+                begin = time.time()
+                plain = super().generate([prompts[i]], generation, cot=cot, early_stop=early_stop, input_ids=[ids])
+                self.stats.plain_seconds += time.time() - begin
+                self.stats.checked += 1
+            response = self.tokenizer.decode(ids[len(ids) - self.decode_offset:] + tokens)
+            if check and plain[0] != response:
+                self.stats.mismatches += 1
+            responses.append(response)
+        return responses
+
+    def speculate(self, prompt_ids, max_new_tokens, stop=None, processors=()):
+        """Generated token ids for one prompt, cut after eos, `stop` or `max_new_tokens`."""
+        device = self.model.device
+        eos_token_id = self.model.generation_config.eos_token_id
+        eos_token_id = [eos_token_id] if isinstance(eos_token_id, int) else eos_token_id or []
+        sequence = list(prompt_ids)
+        generated = []
+        # the caches hold the first `*_length` tokens of `sequence`
+        target_past, target_length = None, 0
+        draft_past, draft_length = None, 0
+        while True:
+            # the target adds one token of its own after the accepted drafts
+            num_draft = min(self.num_draft_tokens, max_new_tokens - len(generated) - 1)
+            drafts = []
+            for _ in range(num_draft):
+                inputs = (sequence + drafts)[draft_length:]
+                outputs = self.draft(input_ids=torch.tensor([inputs], device=device), use_cache=True,
+                                     past_key_values=None if draft_past is None else pack_past(draft_past))
+                draft_past, draft_length = unpack_past(outputs.past_key_values), draft_length + len(inputs)
+                drafts.append(int(outputs.logits[0, -1].argmax()))
+            inputs = (sequence + drafts)[target_length:]
+            outputs = self.model(input_ids=torch.tensor([inputs], device=device), use_cache=True,
+                                 past_key_values=None if target_past is None else pack_past(target_past))
+            self.stats.target_passes += 1
+            # row j predicts the token following inputs[j], the first prediction follows the last accepted token
+            scores = outputs.logits[0, len(sequence) - target_length - 1:]
+            if processors:
+                scores = torch.cat([LogitsProcessorList(processors)(
+                    torch.tensor([sequence + drafts[:j]], device=device), scores[j:j + 1]) for j in range(len(scores))])
+            predictions = scores.argmax(dim=-1).tolist()
+            accepted = 0
+            while accepted < num_draft and drafts[accepted] == predictions[accepted]:
+                accepted += 1
+            self.stats.drafted += num_draft
+            self.stats.accepted += accepted
+            new_tokens = drafts[:accepted] + [predictions[accepted]]
+            # rejected drafts leave both caches
+            target_length = len(sequence) + accepted
+            target_past = crop_past(unpack_past(outputs.past_key_values), target_length)
+            if draft_length > target_length:
+                draft_past, draft_length = crop_past(draft_past, target_length), target_length
+            for token in new_tokens:
+                generated.append(token)
+                end = None
+                if token in eos_token_id:
+                    end = len(generated)
+                elif stop is not None:
+                    end = stop(generated)
+                if end is None and len(generated) >= max_new_tokens:
+                    end = len(generated)
+                if end is not None:
+                    self.stats.generated += end
+                    return generated[:end]
+            sequence += new_tokens
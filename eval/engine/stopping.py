@@ -0,0 +1,58 @@
+import re
+
+import torch
+from transformers.generation.stopping_criteria import StoppingCriteria
+
+# a closed run of option letters, e.g. "A\n" or "BD。"; the run must be closed so multi-choice answers are kept whole
+CHOICE_PATTERN = r'[A-Z]+(?=[^A-Z])'
+COT_PATTERN = r'所以答案是(.+?)。'
+
+
+class AnswerStoppingCriteria(StoppingCriteria):
+    """Stops generation as soon as every sequence of the batch has emitted its answer.
+
+    Without CoT a sequence is complete once a run of choice letters has been closed, with CoT once the
+    `所以答案是X。` pattern has been written. Completion is tracked per sequence in `finished_at`, the number
+    of generated tokens at which the answer was complete, so that the tokens a finished sequence keeps
+    producing while the rest of the batch is still decoding can be cut off with `truncate`.
+
+    Sequences are checked after every step, so an answer completed by the newest token lies within the
+    last `window` tokens; only those are decoded, keeping a long CoT linear instead of quadratic.
+    """
+
+    def __init__(self, tokenizer, prompt_length, cot=False, choice_pattern=CHOICE_PATTERN, cot_pattern=COT_PATTERN,
+                 window=64):
+        self.tokenizer = tokenizer
+        self.window = window
+        self.prompt_length = prompt_length
+        self.pattern = re.compile(cot_pattern if cot else choice_pattern, re.M)
+        self.eos_token_id = tokenizer.eos_token_id
+        self.finished_at = None
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs) -> bool:
+        generated = input_ids[:, self.prompt_length:]
+        if self.finished_at is None:
+            self.finished_at = [None] * input_ids.shape[0]
+        for i, finished in enumerate(self.finished_at):
+            if finished is None:
+                self.finished_at[i] = self.answer_end(generated[i].tolist())
+        return all(finished is not None for finished in self.finished_at)
+
+    def answer_end(self, tokens):
+        """Number of generated `tokens` up to the end of the answer, None while it is incomplete.
+
+        Meant to be called after every new token: an eos or answer older than `window` tokens is not seen.
+        """
+        start = max(len(tokens) - self.window, 0)
+        tail = tokens[start:]
+        if self.eos_token_id is not None and self.eos_token_id in tail:
+            return start + tail.index(self.eos_token_id) + 1
+        if self.pattern.search(self.tokenizer.decode(tail, skip_special_tokens=True)):
+            return len(tokens)
+        return None
+
+    def truncate(self, index, tokens):
+        """Cut the generated tokens of sequence `index` right after its answer."""
+        if self.finished_at is None or self.finished_at[index] is None:
+            return tokens
+        return tokens[:self.finished_at[index]]
@@ -0,0 +1,9 @@
+import os
+import sys
+
+EVAL_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# the shared engine is imported as `engine`, the metrics package as `evaluate`, the legacy reference
+# implementations from the benchmarks
+sys.path.insert(0, EVAL_DIR)
+sys.path.insert(0, os.path.join(EVAL_DIR, 'CMExam'))
+sys.path.insert(0, os.path.join(EVAL_DIR, 'benchmarks'))
@@ -0,0 +1,102 @@
+import random
+
+import pytest
+import torch
+
+from evaluate.utils import Batchify
+from batchify import WORD2IDX, LegacyBatchify, make_reviews
+
+SEQ_LEN = 6
+BATCH_SIZE = 32
+
+
+@pytest.fixture(scope='module')
+def reviews():
+    # 1000 is not a multiple of the batch size, the last batch of an epoch is short
+    return make_reviews(1000, SEQ_LEN)
+
+
+@pytest.mark.parametrize('prefetch', [False, True])
+@pytest.mark.parametrize('reuse_buffers', [False, True])
+def test_batches_match_legacy(reviews, prefetch, reuse_buffers):
+    batchify = Batchify(reviews, WORD2IDX, SEQ_LEN, BATCH_SIZE, prefetch=prefetch, reuse_buffers=reuse_buffers)
+    legacy = LegacyBatchify(batchify, BATCH_SIZE)
+    try:
+        # two epochs in order, also across the wrap-around
+        for _ in range(2 * batchify.total_step):
+            batch, expected = batchify.next_batch(), legacy.next_batch()
+            assert batchify.step == legacy.step
+            for column, reference in zip(batch, expected):
+                assert column.is_contiguous()
+                assert column.dtype == reference.dtype
+                assert torch.equal(column, reference)
+    finally:
+        batchify.close()
+
+
+def test_batch_layout(reviews):
+    batchify = Batchify(reviews, WORD2IDX, SEQ_LEN, BATCH_SIZE)
+    user, item, rating, seq, feature = batchify.next_batch()
+    assert user.shape == item.shape == rating.shape == (BATCH_SIZE,)
+    assert seq.shape == (BATCH_SIZE, SEQ_LEN + 2) and feature.shape == (BATCH_SIZE, 1)
+    assert rating.dtype == torch.float32
+    assert (seq[:, 0] == WORD2IDX['<bos>']).all()
+    assert ((seq == WORD2IDX['<eos>']).sum(dim=1) == 1).all()
+    # the training loop reshapes them
+    seq.view(-1)
+    feature.view(-1)
+
+
+@pytest.mark.parametrize('prefetch', [False, True])
+def test_kept_batches_stay_valid(reviews, prefetch):
+    batchify = Batchify(reviews, WORD2IDX, SEQ_LEN, BATCH_SIZE, prefetch=prefetch)
+    legacy = LegacyBatchify(batchify, BATCH_SIZE)
+    kept = [batchify.next_batch() for _ in range(batchify.total_step + 3)]
+    batchify.close()
+    for batch in kept:
+        assert all(torch.equal(a, b) for a, b in zip(batch, legacy.next_batch()))
+
+
+@pytest.mark.parametrize('prefetch', [False, True])
+def test_shuffled_epochs_are_permutations(reviews, prefetch):
+    batchify = Batchify(reviews, WORD2IDX, SEQ_LEN, BATCH_SIZE, shuffle=True, prefetch=prefetch, seed=0)
+    orders = []
+    for _ in range(3):
+        users = torch.cat([batchify.next_batch()[0] for _ in range(batchify.total_step)])
+        assert batchify.step == batchify.total_step
+        assert torch.equal(users.sort().values, batchify.user.sort().values)
+        orders.append(users)
+    batchify.close()
+    # the first epoch is in order, the next ones are reshuffled
+    assert torch.equal(orders[0], batchify.user)
+    assert not torch.equal(orders[1], orders[2])
+
+
+def shuffled_users(reviews, **kwargs):
+    batchify = Batchify(reviews, WORD2IDX, SEQ_LEN, BATCH_SIZE, shuffle=True, **kwargs)
+    return torch.cat([batchify.next_batch()[0] for _ in range(2 * batchify.total_step)])
+
+
+def test_shuffle_seeding(reviews):
+    assert torch.equal(shuffled_users(reviews, seed=3), shuffled_users(reviews, seed=3))
+    assert not torch.equal(shuffled_users(reviews, seed=3), shuffled_users(reviews, seed=4))
+    # without a seed the shuffles follow `random.seed`, like the `random.shuffle` they replace
+    random.seed(5)
+    first = shuffled_users(reviews)
+    random.seed(5)
+    assert torch.equal(first, shuffled_users(reviews))
+    assert not torch.equal(shuffled_users(reviews), shuffled_users(reviews))
+
+
+def test_close_stops_the_prefetch_thread(reviews):
+    batchify = Batchify(reviews, WORD2IDX, SEQ_LEN, BATCH_SIZE, prefetch=True)
+    batchify.next_batch()
+    thread = batchify._thread
+    assert thread.is_alive()
+    batchify.close()
+    assert not thread.is_alive()
+    with pytest.raises(RuntimeError):
+        batchify.next_batch()
+    # closing twice, or without ever starting the thread, is harmless
+    batchify.close()
+    Batchify(reviews, WORD2IDX, SEQ_LEN, BATCH_SIZE, prefetch=True).close()
@@ -0,0 +1,100 @@
+import os
+
+import pytest
+
+from engine.cache import GenerationCache, model_fingerprint
+from engine.core import EvalEngine
+from engine.generation import GenerationSetup
+
+
+class RecordingBackend:
+    """Echoes the prompts, recording which ones actually reached the model."""
+
+    def __init__(self):
+        self.calls = []
+
+    def generate(self, prompts, generation, cot=False, early_stop=False, input_ids=None):
+        self.calls += prompts
+        return [prompt.upper() for prompt in prompts]
+
+
+def write_dir(path, files):
+    os.makedirs(path, exist_ok=True)
+    for name, content in files.items():
+        with open(os.path.join(path, name), 'w', encoding='utf-8') as f:
+            f.write(content)
+    return str(path)
+
+
+@pytest.fixture
+def model_dir(tmp_path):
+    return write_dir(tmp_path / 'model', {'config.json': '{"hidden_size": 8}', 'model.safetensors': 'weights'})
+
+
+def test_fingerprint_changes_with_model_adapter_and_load_options(tmp_path, model_dir):
+    lora = write_dir(tmp_path / 'lora', {'adapter_config.json': '{"r": 8}', 'adapter_model.bin': 'lora weights'})
+    tokenizer = ['<unk>', 'a', 'b']  # only its class and length are used
+    base = model_fingerprint(model_dir, lora, tokenizer, evaluator='llama')
+    assert model_fingerprint(model_dir, lora, tokenizer, evaluator='llama') == base
+    variants = [
+        model_fingerprint(model_dir, None, tokenizer, evaluator='llama'),
+        model_fingerprint(model_dir, lora, tokenizer, evaluator='baichuan'),
+        model_fingerprint(model_dir, lora, tokenizer, evaluator='llama', dtype='bf16'),
+        model_fingerprint(model_dir, lora, tokenizer, evaluator='llama', lora_mode='unmerged'),
+        model_fingerprint(model_dir, lora, None, evaluator='llama'),
+    ]
+    assert len({base, *variants}) == len(variants) + 1
+
+    # adapter checkpoints are hashed by content, even at the same size
+    write_dir(lora, {'adapter_model.bin': 'LORA WEIGHTS'})
+    assert model_fingerprint(model_dir, lora, tokenizer, evaluator='llama') != base
+    write_dir(lora, {'adapter_model.bin': 'lora weights'})
+    assert model_fingerprint(model_dir, lora, tokenizer, evaluator='llama') == base
+    write_dir(model_dir, {'config.json': '{"hidden_size": 16}'})
+    assert model_fingerprint(model_dir, lora, tokenizer, evaluator='llama') != base
+
+
+def test_key_changes_with_prompt_kind_and_decoding(tmp_path):
+    cache = GenerationCache(str(tmp_path / 'cache.sqlite'), 'fingerprint')
+    greedy = GenerationSetup.create(num_beams=1, do_sample=False, max_new_tokens=10)
+    key = cache.make_key('answer', 'prompt', greedy.cache_params())
+    assert cache.make_key('answer', 'prompt', GenerationSetup.create(
+        num_beams=1, do_sample=False, max_new_tokens=10).cache_params()) == key
+    keys = {
+        cache.make_key('dist', 'prompt', greedy.cache_params()),
+        cache.make_key('answer', 'prompt ', greedy.cache_params()),
+        cache.make_key('answer', 'prompt', greedy.updated(max_new_tokens=20).cache_params()),
+        cache.make_key('answer', 'prompt', greedy.updated(do_sample=True).cache_params()),
+        cache.make_key('answer', 'prompt', {**greedy.cache_params(), 'early_stop': 'cot'}),
+    }
+    assert key not in keys and len(keys) == 5
+    cache.fingerprint = 'other fingerprint'
+    assert cache.make_key('answer', 'prompt', greedy.cache_params()) != key
+    cache.close()
+
+
+def test_engine_reuses_only_matching_generations(tmp_path):
+    path = str(tmp_path / 'cache.sqlite')
+    generation = GenerationSetup.create(processors=(), max_new_tokens=10)
+    prompts = ['a b', 'c', 'd e']
+    backend = RecordingBackend()
+    engine = EvalEngine(backend, cache=GenerationCache(path, 'model-1'), batch_size=2)
+    assert engine.generate(prompts, generation) == ['A B', 'C', 'D E']
+    engine.cache.close()
+
+    # a later run of the same model reads every response back
+    backend.calls = []
+    engine = EvalEngine(backend, cache=GenerationCache(path, 'model-1'), batch_size=2)
+    assert engine.generate(prompts + ['new'], generation) == ['A B', 'C', 'D E', 'NEW']
+    assert backend.calls == ['new']
+    backend.calls = []
+    engine.generate(prompts, generation, early_stop=True)
+    engine.generate(prompts, generation.updated(max_new_tokens=5))
+    assert sorted(backend.calls) == sorted(prompts * 2)
+    engine.cache.close()
+
+    backend.calls = []
+    engine = EvalEngine(backend, cache=GenerationCache(path, 'model-2'), batch_size=2)
+    engine.generate(prompts, generation)
+    assert sorted(backend.calls) == sorted(prompts)
+    engine.cache.close()
@@ -0,0 +1,67 @@
+import os
+
+import numpy as np
+import pytest
+
+from engine.dataset import PromptTokenCache, TokenizedPrompts
+
+
+class WordTokenizer:
+    """Whitespace tokenizer over a vocabulary file, like a tokenizer directory on disk."""
+
+    def __init__(self, path):
+        self.name_or_path = path
+        with open(os.path.join(path, 'vocab.txt'), encoding='utf-8') as f:
+            self.vocab = {word: i for i, word in enumerate(f.read().split())}
+
+    def __len__(self):
+        return len(self.vocab)
+
+    def __call__(self, texts):
+        return {'input_ids': [[self.vocab.get(word, 0) for word in text.split()] for text in texts]}
+
+
+def write_vocab(path, words):
+    os.makedirs(path, exist_ok=True)
+    with open(os.path.join(path, 'vocab.txt'), 'w', encoding='utf-8') as f:
+        f.write(words)
+    return str(path)
+
+
+@pytest.fixture
+def tokenizer(tmp_path):
+    return WordTokenizer(write_vocab(tmp_path / 'tokenizer', '<unk> a b c d e'))
+
+
+def test_prompt_token_cache_round_trips_memory_mapped(tmp_path, tokenizer):
+    prompts = ['a b c', '', 'e d unknown a'] * 3
+    expected = TokenizedPrompts.encode(tokenizer, prompts, chunk_size=2)
+    cache = PromptTokenCache(str(tmp_path / 'tokens'), tokenizer)
+    first = cache.get(prompts)
+    assert (cache.hits, cache.misses) == (0, 1)
+
+    cache = PromptTokenCache(str(tmp_path / 'tokens'), tokenizer)
+    second = cache.get(prompts)
+    assert (cache.hits, cache.misses) == (1, 0)
+    assert isinstance(second.ids, np.memmap)
+    assert len(second) == len(prompts)
+    for i in range(len(prompts)):
+        assert first[i].tolist() == second[i].tolist() == expected[i].tolist()
+    assert second.lengths().tolist() == [3, 0, 4] * 3
+
+    # prompt boundaries are part of the key
+    assert cache.make_key(['a b', 'c']) != cache.make_key(['a', 'b c'])
+    cache.get(['a', 'b c'])
+    assert cache.misses == 1
+
+
+def test_prompt_token_cache_invalidated_by_tokenizer_change(tmp_path, tokenizer):
+    prompts = ['a b c', 'd e']
+    PromptTokenCache(str(tmp_path / 'tokens'), tokenizer).get(prompts)
+    # same vocabulary size and class, only the tokenizer file differs
+    write_vocab(tokenizer.name_or_path, '<unk> e d c b a')
+    changed = WordTokenizer(tokenizer.name_or_path)
+    cache = PromptTokenCache(str(tmp_path / 'tokens'), changed)
+    tokens = cache.get(prompts)
+    assert (cache.hits, cache.misses) == (0, 1)
+    assert [tokens[i].tolist() for i in range(len(prompts))] == [[5, 4, 3], [2, 1]]
@@ -0,0 +1,94 @@
+import random
+import re
+
+import pytest
+
+from engine.dataset import PromptTokenCache
+from engine.prompts import FewShotBudget, RawPromptBuilder, RoundPromptBuilder, encode_choice
+
+
+class MergingTokenizer:
+    """One token per character, except that a paragraph break is one token.
+
+    Merges across the boundary between examples make the per-example counts of `FewShotBudget` inexact,
+    and `[Round 10]` is longer than the `[Round 1]` it counted, the way real tokenizers drift.
+    """
+    name_or_path = ''
+
+    def __len__(self):
+        return 0x10000
+
+    def __call__(self, texts):
+        return {'input_ids': [[ord(token[0]) for token in re.findall(r'\n\n|.', text, re.S)] for text in texts]}
+
+    def encode(self, text, add_special_tokens=True):
+        ids = self([text])['input_ids'][0]
+        return [1] + ids if add_special_tokens else ids
+
+
+def make_case(seed, num_questions=30, max_shots=14):
+    rng = random.Random(seed)
+    text = lambda: ''.join(rng.choice('甲乙丙丁\n') for _ in range(rng.randint(1, 40)))
+    shots = [(text(), text()) for _ in range(20)]
+    questions = [text() for _ in range(num_questions)]
+    histories = [rng.sample(shots, rng.randint(0, max_shots)) for _ in questions]
+    return questions, histories
+
+
+def count(prompt):
+    return len(MergingTokenizer()([prompt])['input_ids'][0])
+
+
+@pytest.mark.parametrize('builder', [RoundPromptBuilder(), RawPromptBuilder()])
+@pytest.mark.parametrize('max_prompt_tokens,reserve', [(60, 0), (200, 10), (400, 0), (5000, 20)])
+def test_budget_keeps_the_longest_fitting_prefix(builder, max_prompt_tokens, reserve):
+    questions, histories = make_case(0)
+    budget = FewShotBudget(MergingTokenizer(), builder, max_prompt_tokens)
+    prompts, n_shots = budget.fit(questions, histories, reserve=reserve)
+    limit = max_prompt_tokens - reserve
+    for question, history, prompt, n in zip(questions, histories, prompts, n_shots):
+        # the leading shots, in their order
+        assert prompt == builder(question, history[:n])
+        assert count(prompt) <= limit or n == 0
+        assert n == len(history) or count(builder(question, history[:n + 1])) > limit
+    if max_prompt_tokens == 5000:
+        assert n_shots == [len(history) for history in histories]
+
+
+def test_budget_drops_shots_that_only_overflow_once_assembled():
+    # ten or more rounds are longer than their one-round counts
+    questions, histories = ['问题'], [[('问', '答')] * 14]
+    dropped = 0
+    for max_prompt_tokens in range(100, 300):
+        budget = FewShotBudget(MergingTokenizer(), RoundPromptBuilder(), max_prompt_tokens)
+        recounted = []
+        count_prompts = budget.count
+        budget.count = lambda prompts, cached=True: recounted.append(cached) or count_prompts(prompts, cached)
+        prompts, n_shots = budget.fit(questions, histories)
+        dropped += False in recounted
+        assert count(prompts[0]) <= max_prompt_tokens
+        assert n_shots[0] == 14 or count(RoundPromptBuilder()(questions[0], histories[0][:n_shots[0] + 1])) > \
+            max_prompt_tokens
+    assert dropped
+
+
+def test_question_alone_over_budget_gets_no_shot():
+    budget = FewShotBudget(MergingTokenizer(), RoundPromptBuilder(), 20)
+    prompts, n_shots = budget.fit(['问' * 50, '短'], [[('问', '答')] * 3] * 2)
+    assert n_shots[0] == 0 and prompts[0] == RoundPromptBuilder()('问' * 50, [])
+    assert n_shots[1] == 0
+
+
+def test_budget_through_token_cache(tmp_path):
+    questions, histories = make_case(2)
+    tokenizer = MergingTokenizer()
+    expected = FewShotBudget(tokenizer, RoundPromptBuilder(), 250).fit(questions, histories, reserve=5)
+    for _ in range(2):  # cold and warm cache
+        cache = PromptTokenCache(str(tmp_path), tokenizer)
+        assert FewShotBudget(tokenizer, RoundPromptBuilder(), 250, cache).fit(
+            questions, histories, reserve=5) == expected
+    assert cache.misses == 0
+
+
+def test_encode_choice_skips_special_tokens():
+    assert encode_choice(MergingTokenizer(), 'A') == ord('A')
@@ -0,0 +1,79 @@
+import numpy as np
+import pytest
+
+from evaluate.metrics4rec import CSRScores, evaluate_all, evaluate_matrix
+from rank_metrics import METRICS, as_dicts, legacy_sums, make_data
+
+# `recall_at_k` divides by zero for users without relevant items
+pytestmark = pytest.mark.filterwarnings('ignore:invalid value encountered:RuntimeWarning')
+
+
+def tied_data(num_users, num_items, num_levels, seed=0, density=None):
+    """Scores drawn from a few levels, so most rows have ties across the top-k boundary.
+
+    An item is relevant when its score level is, so any order of tied items gives the same relevance list and
+    the metrics are the same whatever the tie breaking. Every third user has no relevant item at all.
+    """
+    rng = np.random.default_rng(seed)
+    scores = rng.integers(num_levels, size=(num_users, num_items)).astype(np.float64)
+    groundtruth = []
+    for user, row in enumerate(scores):
+        levels = rng.choice(num_levels, num_levels // 2, replace=False) if user % 3 else []
+        groundtruth.append(np.nonzero(np.isin(row, levels))[0].tolist())
+    if density is None:
+        return scores, groundtruth
+    keep = rng.random(scores.shape) < density
+    counts = keep.sum(axis=1)
+    indices = np.nonzero(keep)[1]
+    indptr = np.concatenate([[0], np.cumsum(counts)])
+    return CSRScores(indptr, indices, scores[keep], scores.shape), groundtruth
+
+
+def assert_sums_equal(sums, reference):
+    for name in METRICS:
+        # users without relevant items have an undefined recall, in both implementations
+        np.testing.assert_allclose(sums[name], reference[name], rtol=1e-12, err_msg=name)
+
+
+@pytest.mark.parametrize('density', [None, 0.3])
+@pytest.mark.parametrize('chunk_size', [1, 7, None])
+def test_evaluate_matrix_matches_per_user_loop(density, chunk_size):
+    scores, groundtruth = make_data(60, 40, 10, density=density)
+    sums, cnt = evaluate_matrix(scores, groundtruth, 5, seed=0, chunk_size=chunk_size)
+    assert cnt == 60
+    assert_sums_equal(sums, legacy_sums(*as_dicts(scores, groundtruth), 5))
+
+
+@pytest.mark.parametrize('density', [None, 0.3])
+@pytest.mark.parametrize('topk', [1, 5, 50])
+def test_tied_scores_and_users_without_positives(density, topk):
+    scores, groundtruth = tied_data(60, 40, 4, density=density)
+    sums, _ = evaluate_matrix(scores, groundtruth, topk, seed=0, chunk_size=7)
+    reference = legacy_sums(*as_dicts(scores, groundtruth), topk)
+    assert np.isnan(reference['recall'])
+    assert_sums_equal(sums, reference)
+
+
+def test_users_without_positives_score_zero():
+    scores, _ = make_data(10, 20, 3)
+    sums, _ = evaluate_matrix(scores, [[]] * 10, 5, seed=0)
+    reference = legacy_sums(*as_dicts(scores, [[]] * 10), 5)
+    for name in ['precision', 'ndcg', 'hit', 'map', 'mrr']:
+        assert sums[name] == reference[name] == 0.
+
+
+def test_evaluate_all_matches_per_user_loop():
+    scores, groundtruth = tied_data(30, 25, 3, seed=1, density=0.5)
+    user_item_scores, groundtruth = as_dicts(scores, groundtruth)
+    # string ids, as evaluate_all gets them from a prediction file
+    user_item_scores = {f'u{u}': {f'i{i}': s for i, s in items.items()} for u, items in user_item_scores.items()}
+    groundtruth = {f'u{u}': [f'i{i}' for i in items] for u, items in groundtruth.items()}
+    _, res = evaluate_all(user_item_scores, groundtruth, topk=5, seed=0)
+    reference = legacy_sums(user_item_scores, groundtruth, 5)
+    for name in METRICS:
+        np.testing.assert_allclose(res[name], reference[name] / len(user_item_scores), rtol=1e-12, err_msg=name)
+
+
+def test_all_tied_top_k_is_uniform():
+    sums, cnt = evaluate_matrix(np.zeros((4000, 50)), [[0]] * 4000, 5, seed=0)
+    assert sums['hit'] / cnt == pytest.approx(5 / 50, abs=0.03)
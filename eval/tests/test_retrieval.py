@@ -0,0 +1,70 @@
+import os
+import random
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from engine.retrieval import ExemplarIndex, ExemplarRetriever
+
+DATA = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'CMExam', 'data', 'test_10.csv')
+
+
+@pytest.fixture(scope='module')
+def texts():
+    df = pd.read_csv(DATA)
+    questions = (df['Question'].astype(str) + '\n' + df['Options'].astype(str)).tolist()
+    rng = random.Random(0)
+    # near-duplicates of the pool questions and a few unrelated ones
+    queries = [question[:rng.randint(5, len(question))] for question in questions] + ['无关的问题', '', ' ']
+    return questions * 3, queries
+
+
+def assert_nearest(index, queries, selected):
+    """`selected` holds the most similar exemplars, best first; which of exactly tied ones is left to the index."""
+    scores = index.embed(queries) @ np.asarray(index.vectors).T
+    expected = -np.sort(-scores, axis=1)[:, :selected.shape[1]]
+    np.testing.assert_allclose(np.take_along_axis(scores, selected, axis=1), expected, rtol=1e-6)
+
+
+@pytest.mark.parametrize('analyzer', ['chars', 'jieba'])
+def test_on_disk_index_gives_the_same_neighbours(texts, tmp_path, analyzer):
+    pool, queries = texts
+    cold = ExemplarRetriever(analyzer=analyzer).select(pool, queries, 5)
+    first = ExemplarRetriever(str(tmp_path), analyzer=analyzer).select(pool, queries, 5)
+    assert len(os.listdir(tmp_path)) == 2
+
+    retriever = ExemplarRetriever(str(tmp_path), analyzer=analyzer)
+    index = retriever.index(pool)
+    assert isinstance(index.vectors, np.memmap)
+    warm = retriever.select(pool, queries, 5)
+    assert cold.tolist() == first.tolist() == warm.tolist()
+    assert_nearest(index, queries, warm)
+
+
+def test_index_key_depends_on_pool_and_settings(texts, tmp_path):
+    pool, _ = texts
+    retriever = ExemplarRetriever(str(tmp_path))
+    key = retriever.make_key(pool)
+    assert retriever.make_key(pool[::-1]) != key
+    assert retriever.make_key(['ab', 'c']) != retriever.make_key(['a', 'bc'])
+    assert ExemplarRetriever(analyzer='jieba').make_key(pool) != key
+    assert ExemplarRetriever(max_features=16).make_key(pool) != key
+
+
+def test_saved_index_round_trips(texts, tmp_path):
+    pool, queries = texts
+    index = ExemplarIndex.build(pool, max_features=64)
+    index.save(str(tmp_path / 'index'))
+    loaded = ExemplarIndex.load(str(tmp_path / 'index'), mmap=False)
+    assert loaded.vocabulary == index.vocabulary and loaded.analyzer == index.analyzer
+    np.testing.assert_array_equal(loaded.idf, index.idf)
+    np.testing.assert_array_equal(loaded.vectors, index.vectors)
+    assert loaded.top_k(queries, 3, batch_size=4).tolist() == index.top_k(queries, 3).tolist()
+
+
+def test_k_larger_than_pool():
+    index = ExemplarIndex.build(['甲乙', '丙丁', '甲丁'])
+    selected = index.top_k(['甲'], 10)
+    assert sorted(selected[0].tolist()) == [0, 1, 2]
+    assert selected[0, 2] == 1
@@ -0,0 +1,89 @@
+import os
+
+import numpy as np
+import pytest
+import torch
+
+from evaluate.utils import Batchify, DataLoader
+from review_loader import LegacyDataLoader, make_corpus
+
+VOCAB_SIZE = 300
+COLUMNS = ('user', 'item', 'rating', 'seq', 'feature')
+
+
+def assert_same_corpus(corpus, legacy):
+    assert corpus.word_dict.idx2word == legacy.word_dict.idx2word
+    assert corpus.user_dict.idx2entity == legacy.user_dict.idx2entity
+    assert corpus.item_dict.idx2entity == legacy.item_dict.idx2entity
+    assert corpus.feature_set == legacy.feature_set
+    assert (corpus.max_rating, corpus.min_rating) == (legacy.max_rating, legacy.min_rating)
+    for split, reference in ((corpus.train, legacy.train), (corpus.valid, legacy.valid), (corpus.test, legacy.test)):
+        assert [split[i] for i in range(len(split))] == reference
+
+
+@pytest.fixture
+def corpus_dir(tmp_path):
+    make_corpus(str(tmp_path), 2000, 800, seed=1)
+    return str(tmp_path)
+
+
+def data_path(work_dir):
+    return os.path.join(work_dir, 'reviews.pickle')
+
+
+def test_uncached_matches_legacy(corpus_dir):
+    legacy = LegacyDataLoader(data_path(corpus_dir), corpus_dir, VOCAB_SIZE)
+    assert_same_corpus(DataLoader(data_path(corpus_dir), corpus_dir, VOCAB_SIZE), legacy)
+
+
+def test_warm_cache_matches_legacy_without_reading_the_pickle(corpus_dir, monkeypatch):
+    cache_dir = os.path.join(corpus_dir, 'cache')
+    legacy = LegacyDataLoader(data_path(corpus_dir), corpus_dir, VOCAB_SIZE)
+    assert_same_corpus(DataLoader(data_path(corpus_dir), corpus_dir, VOCAB_SIZE, cache_dir=cache_dir), legacy)
+
+    def fail(*args):
+        raise AssertionError('the cache was not used')
+    monkeypatch.setattr(DataLoader, 'initialize', fail)
+    corpus = DataLoader(data_path(corpus_dir), corpus_dir, VOCAB_SIZE, cache_dir=cache_dir)
+    assert isinstance(corpus.train.columns['text_ids'], np.memmap)
+    assert_same_corpus(corpus, legacy)
+
+
+def test_cache_is_invalidated_by_a_new_corpus(corpus_dir):
+    cache_dir = os.path.join(corpus_dir, 'cache')
+    DataLoader(data_path(corpus_dir), corpus_dir, VOCAB_SIZE, cache_dir=cache_dir)
+    old_key = DataLoader.make_key(data_path(corpus_dir), VOCAB_SIZE)
+    # same path, same number of reviews: only the content and the modification time differ
+    make_corpus(corpus_dir, 2000, 800, seed=2)
+    stat = os.stat(data_path(corpus_dir))
+    os.utime(data_path(corpus_dir), ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    assert DataLoader.make_key(data_path(corpus_dir), VOCAB_SIZE) != old_key
+    legacy = LegacyDataLoader(data_path(corpus_dir), corpus_dir, VOCAB_SIZE)
+    assert_same_corpus(DataLoader(data_path(corpus_dir), corpus_dir, VOCAB_SIZE, cache_dir=cache_dir), legacy)
+
+
+def test_cache_is_keyed_by_vocab_size(corpus_dir):
+    cache_dir = os.path.join(corpus_dir, 'cache')
+    DataLoader(data_path(corpus_dir), corpus_dir, VOCAB_SIZE, cache_dir=cache_dir)
+    legacy = LegacyDataLoader(data_path(corpus_dir), corpus_dir, VOCAB_SIZE // 2)
+    assert_same_corpus(DataLoader(data_path(corpus_dir), corpus_dir, VOCAB_SIZE // 2, cache_dir=cache_dir), legacy)
+
+
+def test_partial_cache_is_rebuilt(corpus_dir):
+    cache_dir = os.path.join(corpus_dir, 'cache')
+    DataLoader(data_path(corpus_dir), corpus_dir, VOCAB_SIZE, cache_dir=cache_dir)
+    # the json is written last, a run killed before it leaves only column files behind
+    os.remove(os.path.join(cache_dir, DataLoader.make_key(data_path(corpus_dir), VOCAB_SIZE) + '.json'))
+    legacy = LegacyDataLoader(data_path(corpus_dir), corpus_dir, VOCAB_SIZE)
+    assert_same_corpus(DataLoader(data_path(corpus_dir), corpus_dir, VOCAB_SIZE, cache_dir=cache_dir), legacy)
+
+
+@pytest.mark.parametrize('seq_len', [1, 5, 15])
+def test_split_tensors_match_dict_reviews(corpus_dir, seq_len):
+    corpus = DataLoader(data_path(corpus_dir), corpus_dir, VOCAB_SIZE, cache_dir=os.path.join(corpus_dir, 'cache'))
+    legacy = LegacyDataLoader(data_path(corpus_dir), corpus_dir, VOCAB_SIZE)
+    for split, reference in ((corpus.train, legacy.train), (corpus.test, legacy.test)):
+        tensors = Batchify(split, corpus.word_dict.word2idx, seq_len)
+        expected = Batchify(reference, legacy.word_dict.word2idx, seq_len)
+        for name in COLUMNS:
+            assert torch.equal(getattr(tensors, name), getattr(expected, name)), name
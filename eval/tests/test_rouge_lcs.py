@@ -0,0 +1,60 @@
+import os
+import random
+
+import pytest
+
+from evaluate import rouge
+from rouge_lcs import legacy_lcs, legacy_len_lcs, legacy_recon_lcs, make_pairs
+
+DATA = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'CMExam', 'data', 'test_10.csv')
+
+EDGE_CASES = [
+    ([], []),
+    ([], list('abc')),
+    (list('a'), []),
+    (list('a'), list('a')),
+    (list('a'), list('b')),
+    (list('a'), list('bab')),
+    # one word of bits on either side of the boundary, and several words
+    (list('ab' * 32), list('ba' * 32)),
+    (list('ab' * 32 + 'c'), list('cab' * 22)),
+    (list('abcd' * 50), list('dcba' * 40)),
+    (list('x' * 130), list('x' * 70)),
+    (list('中文解释文本') * 20, list('解释中文文本') * 15),
+]
+
+
+def random_cases(num_cases, max_length, alphabet, seed):
+    rng = random.Random(seed)
+    return [([rng.choice(alphabet) for _ in range(rng.randint(0, max_length))],
+             [rng.choice(alphabet) for _ in range(rng.randint(0, max_length))]) for _ in range(num_cases)]
+
+
+CASES = (EDGE_CASES + random_cases(300, 12, 'abc', seed=0) + random_cases(100, 200, 'abcdefgh', seed=1)
+         + random_cases(50, 150, 'ab', seed=2))
+
+
+@pytest.mark.parametrize('x, y', CASES)
+def test_len_lcs_matches_legacy(x, y):
+    assert rouge._len_lcs(x, y) == legacy_len_lcs(x, y) == rouge._len_lcs(y, x)
+
+
+@pytest.mark.parametrize('x, y', CASES)
+def test_lcs_table_and_reconstruction_match_legacy(x, y):
+    table, reference = rouge._lcs(x, y), legacy_lcs(x, y)
+    assert all(table[i, j] == value for (i, j), value in reference.items())
+    assert rouge._recon_lcs(x, y) == legacy_recon_lcs(x, y)
+
+
+def test_recon_lcs_beyond_recursion_limit():
+    x = list('ab' * 1500)
+    assert len(rouge._recon_lcs(x, x)) == len(x)
+
+
+def test_rouge_matches_legacy_dp(monkeypatch):
+    pairs = [(' '.join(x), ' '.join(y)) for x, y in EDGE_CASES + random_cases(50, 100, 'abcd', seed=3)]
+    pairs += [(' '.join(hypothesis), ' '.join(reference)) for hypothesis, reference in make_pairs(DATA, 30)]
+    hypotheses, references = zip(*pairs)
+    scores = rouge.rouge(hypotheses, references)
+    monkeypatch.setattr(rouge, '_len_lcs', legacy_len_lcs)
+    assert scores == rouge.rouge(hypotheses, references)
@@ -0,0 +1,114 @@
+import os
+import json
+import argparse
+
+import jieba
+import pandas as pd
+import pytest
+
+import evaluate_chatglm
+from evaluate.segment import Segmenter
+from evaluate.utils import bleu_score, rouge_score
+from rouge_lcs import make_pairs
+
+DATA = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'CMExam', 'data', 'test_10.csv')
+
+
+@pytest.fixture(scope='module')
+def texts():
+    pairs = make_pairs(DATA, 40)
+    return [''.join(hypothesis) for hypothesis, _ in pairs] + [''.join(reference) for _, reference in pairs] + ['', ' ']
+
+
+class CountingSegmenter(Segmenter):
+    """Records the texts actually sent to jieba."""
+
+    def __init__(self, *args, **kwargs):
+        super(CountingSegmenter, self).__init__(*args, **kwargs)
+        self.segmented = []
+
+    def cut(self, texts):
+        self.segmented += texts
+        return super(CountingSegmenter, self).cut(texts)
+
+
+def test_cache_hits_and_misses(texts, tmp_path):
+    cache_path = str(tmp_path / 'cache' / 'segments.sqlite')
+    segmenter = CountingSegmenter(cache_path)
+    expected = [jieba.lcut(text) for text in texts]
+    # duplicates are segmented once
+    assert segmenter.segment(texts + texts[:5]) == expected + expected[:5]
+    assert sorted(segmenter.segmented) == sorted(set(texts))
+    segmenter.close()
+
+    segmenter = CountingSegmenter(cache_path)
+    assert segmenter.segment(texts) == expected
+    assert segmenter.segmented == []
+    assert segmenter.segment(texts[:3] + ['新的解释文本']) == expected[:3] + [jieba.lcut('新的解释文本')]
+    assert segmenter.segmented == ['新的解释文本']
+    segmenter.close()
+
+
+def test_cache_is_keyed_by_jieba_version(texts, tmp_path):
+    cache_path = str(tmp_path / 'segments.sqlite')
+    segmenter = Segmenter(cache_path)
+    segmenter.segment(texts[:3])
+    segmenter.close()
+    segmenter = CountingSegmenter(cache_path)
+    segmenter._salt = b'jieba-other-version'
+    segmenter.segment(texts[:3])
+    assert sorted(segmenter.segmented) == sorted(set(texts[:3]))
+    segmenter.close()
+
+
+def test_pool_matches_inline(texts):
+    inline = Segmenter()
+    pool = Segmenter(num_workers=2, chunk_size=7)
+    try:
+        assert pool.segment(texts) == inline.segment(texts)
+        # the pool is kept between calls
+        assert pool.segment(texts[::-1]) == inline.segment(texts[::-1])
+    finally:
+        pool.close()
+        inline.close()
+
+
+def old_script_metrics(path):
+    """The metrics exactly as the original evaluate_chatglm.py script computed them."""
+    csv = pd.read_csv(path)
+    gt_exp = csv['Explanation'].values.tolist()
+    predict_exp = csv['explanations'].values.tolist()
+    gt_exp = [item if not pd.isna(item) else "" for item in gt_exp]
+    predict_exp = [item.replace(" ", "") if not pd.isna(item) else "" for item in predict_exp]
+    tokens_of_processed_predict_exps = [list(jieba.cut(item, cut_all=False)) for item in predict_exp]
+    tokens_of_processed_gt_exps = [list(jieba.cut(item, cut_all=False)) for item in gt_exp]
+    processed_gt_exps = [' '.join(list(item)) for item in predict_exp]
+    processed_predict_exps = [' '.join(list(item)) for item in gt_exp]
+    metrics = {f'BLEU-{n}': bleu_score(tokens_of_processed_gt_exps, tokens_of_processed_predict_exps, n_gram=n)
+               for n in (1, 2, 4)}
+    metrics.update(rouge_score(processed_gt_exps, processed_predict_exps))
+    return metrics
+
+
+@pytest.mark.parametrize('num_workers,chunksize', [(1, 10000), (2, 7)])
+def test_cli_matches_old_script(tmp_path, num_workers, chunksize):
+    pairs = make_pairs(DATA, 30, seed=1)
+    df = pd.DataFrame({'Explanation': [''.join(reference) for _, reference in pairs],
+                       'explanations': [' '.join(hypothesis) for hypothesis, _ in pairs]})
+    # missing predictions and explanations
+    df.loc[3, 'explanations'] = None
+    df.loc[8, 'Explanation'] = None
+    path = str(tmp_path / 'prediction.csv')
+    df.to_csv(path, index=False)
+    output = str(tmp_path / 'metrics.json')
+    for _ in range(2):  # cold and warm segmentation cache
+        evaluate_chatglm.main(argparse.Namespace(
+            prediction_files=[path], prediction_column='explanations', reference_column='Explanation',
+            chunksize=chunksize, num_workers=num_workers, segment_cache=str(tmp_path / 'segments.sqlite'),
+            rouge_only=False, corrected_rouge=False, output=output))
+        with open(output, encoding='utf-8') as f:
+            metrics = json.load(f)[path]
+        expected = old_script_metrics(path)
+        assert metrics.keys() == expected.keys()
+        for name, value in expected.items():
+            assert metrics[name] == pytest.approx(value, abs=1e-9), name
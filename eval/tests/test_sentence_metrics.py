@@ -0,0 +1,55 @@
+import random
+
+import pytest
+
+from evaluate import utils
+from evaluate.accumulators import FeatureMetrics, UniqueSentences
+from sentence_metrics import legacy_feature_diversity, legacy_unique_sentence_percent, make_sequences
+
+FEATURES = set(random.Random(1).sample(range(50), 10))
+
+
+@pytest.fixture(scope='module')
+def sequences():
+    return make_sequences(400, 50)
+
+
+def test_unique_sentence_percent_matches_pairwise_scan(sequences):
+    for n in (1, 2, 3, 50, len(sequences)):
+        assert utils.unique_sentence_percent(sequences[:n]) == legacy_unique_sentence_percent(sequences[:n])
+
+
+def test_unique_sentence_percent_edge_cases():
+    assert utils.unique_sentence_percent([[1, 2], [1, 2], [1, 2]]) == (1 / 3, 1)
+    # a prefix is a different sentence, and so is the empty one
+    assert utils.unique_sentence_percent([[1, 2], [1], [], [2, 1]]) == (1., 4)
+
+
+def test_feature_diversity_matches_pairwise_sum(sequences):
+    feature_batch = utils.feature_detect(sequences, FEATURES)
+    for n in (2, 3, 50, len(sequences)):
+        assert utils.feature_diversity(feature_batch[:n]) == legacy_feature_diversity(feature_batch[:n])
+    assert utils.feature_diversity([set(), set()]) == 0.
+
+
+def test_accumulators_match_batch_functions(sequences):
+    rng = random.Random(2)
+    test_features = [rng.choice(sorted(FEATURES)) for _ in sequences]
+    feature_batch = utils.feature_detect(sequences, FEATURES)
+    # fed in two halves and merged, the way parallel workers combine
+    halves = [(UniqueSentences(), FeatureMetrics(FEATURES)) for _ in range(2)]
+    for i, (seq, feature) in enumerate(zip(sequences, test_features)):
+        unique, features = halves[i * 2 // len(sequences)]
+        unique.update(seq)
+        features.update(seq, feature)
+    unique = halves[0][0].merge(halves[1][0])
+    features = halves[0][1].merge(halves[1][1]).compute()
+    assert unique.compute() == utils.unique_sentence_percent(sequences)
+    assert features['diversity'] == utils.feature_diversity(feature_batch)
+    assert features['matching_ratio'] == utils.feature_matching_ratio(feature_batch, test_features)
+    assert features['coverage_ratio'] == utils.feature_coverage_ratio(feature_batch, FEATURES)
+
+
+def test_empty_accumulators():
+    assert UniqueSentences().compute() == (0., 0)
+    assert FeatureMetrics(FEATURES).compute() == {'matching_ratio': 0., 'coverage_ratio': 0., 'diversity': 0.}
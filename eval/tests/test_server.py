@@ -0,0 +1,111 @@
+import json
+import threading
+import urllib.error
+import urllib.request
+
+import pytest
+import torch
+from transformers import GPT2Config, GPT2LMHeadModel
+
+from engine.generation import GenerationSetup
+from engine.server import InferenceServer, ServerBackend, make_http_server
+
+VOCAB_SIZE = 64
+
+
+class CharTokenizer:
+    """One id per character, enough for the server and the HTTP endpoint."""
+    pad_token = '<pad>'
+
+    def __call__(self, text):
+        return {'input_ids': [1 + ord(char) % (VOCAB_SIZE - 2) for char in text]}
+
+    def decode(self, ids, skip_special_tokens=False):
+        return ''.join(chr(ord('a') + token % 26) for token in ids)
+
+
+@pytest.fixture(scope='module')
+def model():
+    torch.manual_seed(0)
+    config = GPT2Config(vocab_size=VOCAB_SIZE, n_positions=320, n_embd=32, n_layer=2, n_head=2,
+                        bos_token_id=0, eos_token_id=VOCAB_SIZE - 1)
+    return GPT2LMHeadModel(config).eval()
+
+
+def prompts():
+    generator = torch.Generator().manual_seed(1)
+    return [torch.randint(1, VOCAB_SIZE - 1, (length,), generator=generator).tolist() for length in (3, 17, 1, 9, 30, 5)]
+
+
+def greedy(model, prompt_ids, max_new_tokens):
+    output = model.generate(torch.tensor([prompt_ids]), attention_mask=torch.ones(1, len(prompt_ids), dtype=torch.long),
+                            max_new_tokens=max_new_tokens, do_sample=False, pad_token_id=0)
+    return output[0, len(prompt_ids):].tolist()
+
+
+def test_continuous_batching_matches_greedy_generate(model):
+    lengths = [4 + 5 * i for i in range(len(prompts()))]
+    expected = [greedy(model, ids, n) for ids, n in zip(prompts(), lengths)]
+    # fewer slots than requests, so requests join and leave a running batch
+    with InferenceServer(model, CharTokenizer(), max_batch_size=3) as server:
+        futures = [server.submit(ids, n) for ids, n in zip(prompts(), lengths)]
+        assert [future.result(timeout=60) for future in futures] == expected
+
+
+def test_failing_stop_callback_fails_only_its_request(model):
+    def failing_stop(tokens):
+        if len(tokens) == 2:
+            raise RuntimeError('stop failed')
+
+    expected = [greedy(model, ids, 6) for ids in prompts()]
+    with InferenceServer(model, CharTokenizer(), max_batch_size=4) as server:
+        futures = [server.submit(ids, 6, stop=failing_stop if i == 1 else None) for i, ids in enumerate(prompts())]
+        with pytest.raises(RuntimeError, match='stop failed'):
+            futures[1].result(timeout=60)
+        for i, future in enumerate(futures):
+            if i != 1:
+                assert future.result(timeout=60) == expected[i]
+        # the serving thread survived
+        assert server.submit(prompts()[0], 6).result(timeout=60) == expected[0]
+
+
+def test_backend_without_max_new_tokens_uses_the_default(model, monkeypatch):
+    # a checkpoint that only sets `max_length`
+    monkeypatch.setattr(model.generation_config, 'max_new_tokens', None)
+    backend = ServerBackend(CharTokenizer(), lambda: model, max_batch_size=2)
+    try:
+        responses = backend.generate(['ab', 'cde'], GenerationSetup.create(processors=()), input_ids=prompts()[:2])
+    finally:
+        backend.close()
+    assert responses == [CharTokenizer().decode(greedy(model, ids, 256)) for ids in prompts()[:2]]
+
+
+def post(port, body):
+    request = urllib.request.Request(f'http://127.0.0.1:{port}/generate', data=body, method='POST')
+    try:
+        with urllib.request.urlopen(request, timeout=60) as response:
+            return response.status, json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        return e.code, None
+
+
+def test_http_endpoint(model, monkeypatch):
+    with InferenceServer(model, CharTokenizer(), max_batch_size=2) as server:
+        http = make_http_server(server, port=0)
+        threading.Thread(target=http.serve_forever, daemon=True).start()
+        port = http.server_address[1]
+        try:
+            status, body = post(port, json.dumps({'prompt': 'hello', 'max_new_tokens': 4}).encode())
+            assert status == 200
+            assert body['response'] == CharTokenizer().decode(greedy(model, CharTokenizer()('hello')['input_ids'], 4))
+            for bad in (b'[1]', b'not json', json.dumps({'max_new_tokens': 4}).encode(),
+                        json.dumps({'prompt': 'x', 'max_new_tokens': 'many'}).encode()):
+                assert post(port, bad)[0] == 400
+
+            def fail(prompt, max_new_tokens):
+                raise RuntimeError('out of memory')
+            monkeypatch.setattr(server, 'generate', fail)
+            assert post(port, json.dumps({'prompt': 'hello'}).encode())[0] == 500
+        finally:
+            http.shutdown()
+            http.server_close()
@@ -0,0 +1,53 @@
+import random
+
+import pytest
+
+from engine.stopping import AnswerStoppingCriteria
+
+ALPHABET = list('的是病人症状治疗ABCD，。所以答案\n')
+EOS = len(ALPHABET)
+
+
+class ListTokenizer:
+    """One token per character of `ALPHABET`, plus an eos."""
+    eos_token_id = EOS
+
+    def decode(self, tokens, skip_special_tokens=False):
+        return ''.join(ALPHABET[token] for token in tokens if token != EOS)
+
+
+def encode(text):
+    return [ALPHABET.index(char) for char in text]
+
+
+def first_stop(answer_end, tokens):
+    """(tokens generated, tokens kept) at the first step the answer is complete, checked after every token."""
+    for n in range(1, len(tokens) + 1):
+        end = answer_end(tokens[:n])
+        if end is not None:
+            return n, end
+    return None
+
+
+def full_decode_end(criteria, tokens):
+    if EOS in tokens:
+        return tokens.index(EOS) + 1
+    return len(tokens) if criteria.pattern.search(ListTokenizer().decode(tokens)) else None
+
+
+@pytest.mark.parametrize('cot', [False, True])
+def test_window_finds_the_same_stop_as_full_decoding(cot):
+    rng = random.Random(0)
+    for _ in range(200):
+        body = [rng.randrange(len(ALPHABET)) for _ in range(rng.randint(0, 300))]
+        tokens = body + encode(rng.choice(['所以答案是B。', '所以答案是ABD。', 'C\n', '', '所以答案是']))
+        if rng.random() < 0.2:
+            tokens.insert(rng.randrange(len(tokens) + 1), EOS)
+        criteria = AnswerStoppingCriteria(ListTokenizer(), 0, cot=cot, window=16)
+        assert first_stop(criteria.answer_end, tokens) == first_stop(lambda t: full_decode_end(criteria, t), tokens)
+
+
+def test_answer_after_a_long_reasoning():
+    criteria = AnswerStoppingCriteria(ListTokenizer(), 0, cot=True, window=16)
+    answer = encode('病人症状，' * 500 + '所以答案是C。')
+    assert first_stop(criteria.answer_end, answer + encode('治疗')) == (len(answer), len(answer))
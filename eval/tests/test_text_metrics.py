@@ -0,0 +1,78 @@
+import os
+
+import pytest
+
+from evaluate.accumulators import TextMetrics
+from evaluate.suite import jieba_tokens, text_metrics
+from evaluate.utils import bleu_score, rouge_score
+from rouge_lcs import make_pairs
+
+DATA = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'CMExam', 'data', 'test_10.csv')
+
+# empty and whitespace-only predictions, the way `clean` in evaluate_chatglm.py leaves missing ones
+EDGE_CASES = [('', '参考解释'), ('  ', '参考解释'), ('答案', ' '), ('完全一致', '完全一致')]
+
+
+@pytest.fixture(scope='module')
+def pairs():
+    pairs = [(''.join(hypothesis), ''.join(reference)) for hypothesis, reference in make_pairs(DATA, 60)]
+    return pairs[:30] + EDGE_CASES + pairs[30:]
+
+
+def legacy_metrics(hypotheses, references, legacy_rouge=True):
+    """Scores as the original evaluate_chatglm.py computed them, BLEU on characters."""
+    metrics = {f'BLEU-{n}': bleu_score([list(r) for r in references], [list(h) for h in hypotheses], n_gram=n)
+               for n in (1, 2, 4)}
+    spaced_hypotheses = [' '.join(list(h)) for h in hypotheses]
+    spaced_references = [' '.join(list(r)) for r in references]
+    if legacy_rouge:
+        # the script passed the space-joined predictions as references
+        metrics.update(rouge_score(spaced_hypotheses, spaced_references))
+    else:
+        metrics.update(rouge_score(spaced_references, spaced_hypotheses))
+    return metrics
+
+
+@pytest.mark.parametrize('legacy_rouge', [True, False])
+def test_text_metrics_matches_legacy_scores(pairs, legacy_rouge):
+    hypotheses, references = zip(*pairs)
+    metrics = text_metrics(hypotheses, references, legacy_rouge=legacy_rouge)
+    expected = legacy_metrics(hypotheses, references, legacy_rouge)
+    assert metrics.keys() == expected.keys()
+    for name, value in expected.items():
+        assert metrics[name] == pytest.approx(value, abs=1e-9), name
+
+
+def test_legacy_rouge_swaps_precision_and_recall(pairs):
+    hypotheses, references = zip(*pairs)
+    legacy = text_metrics(hypotheses, references, bleu_orders=())
+    corrected = text_metrics(hypotheses, references, bleu_orders=(), legacy_rouge=False)
+    for name in ('rouge_1', 'rouge_2', 'rouge_l'):
+        assert legacy[f'{name}/p_score'] == pytest.approx(corrected[f'{name}/r_score'])
+        assert legacy[f'{name}/r_score'] == pytest.approx(corrected[f'{name}/p_score'])
+
+
+@pytest.mark.parametrize('tokenize', [list, jieba_tokens])
+@pytest.mark.parametrize('legacy_rouge', [True, False])
+def test_workers_give_the_same_scores(pairs, tokenize, legacy_rouge):
+    hypotheses, references = zip(*pairs)
+    single = text_metrics(hypotheses, references, tokenize=tokenize, legacy_rouge=legacy_rouge)
+    assert text_metrics(hypotheses, references, tokenize=tokenize, num_workers=2, legacy_rouge=legacy_rouge) == single
+
+
+def test_edge_cases_alone_with_workers():
+    hypotheses, references = zip(*(EDGE_CASES * 2))
+    assert text_metrics(hypotheses, references, num_workers=2) == text_metrics(hypotheses, references)
+
+
+def test_accumulator_matches_text_metrics(pairs):
+    hypotheses, references = zip(*pairs)
+    halves = [TextMetrics(), TextMetrics()]
+    for i, (hypothesis, reference) in enumerate(pairs):
+        halves[i * 2 // len(pairs)].update(hypothesis, reference)
+    metrics = halves[0].merge(halves[1]).compute()
+    expected = text_metrics(hypotheses, references)
+    assert metrics.keys() == expected.keys()
+    for name, value in expected.items():
+        assert metrics[name] == pytest.approx(value), name
+    assert TextMetrics().compute() == {}
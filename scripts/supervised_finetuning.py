@@ -1,10 +1,14 @@
 import math
 import os
+import random
+import sys
 from dataclasses import dataclass, field
 from glob import glob
 from typing import List, Optional, Dict, Sequence
 
+import pandas as pd
 import torch
+import torch.distributed as dist
 from datasets import load_dataset
 from loguru import logger
 from peft import LoraConfig, TaskType, get_peft_model, PeftModel, prepare_model_for_int8_training
@@ -19,6 +23,7 @@ from transformers import (
     AutoTokenizer,
     HfArgumentParser,
     Trainer,
+    TrainerCallback,
     TrainingArguments,
     set_seed,
     BitsAndBytesConfig,
@@ -30,6 +35,10 @@ from transformers.deepspeed import is_deepspeed_zero3_enabled
 from transformers.trainer import TRAINING_ARGS_NAME
 from transformers.trainer_pt_utils import LabelSmoother
 
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'eval'))
+from engine.dataset import PromptTokenCache, TokenizedPrompts
+from engine.prompts import encode_choice
+
 MODEL_CLASSES = {
     "bloom": (AutoConfig, BloomForCausalLM, BloomTokenizerFast),
     "chatglm": (AutoConfig, AutoModel, AutoTokenizer),
@@ -156,6 +165,18 @@ class DataTrainingArguments:
         default=None,
         metadata={"help": "The number of processes to use for the preprocessing."},
     )
+    benchmark_file: Optional[str] = field(
+        default=None,
+        metadata={"help": "CMExam or C-Eval csv whose zero-shot accuracy is logged at every evaluation"},
+    )
+    benchmark_token_budget: Optional[int] = field(
+        default=50000,
+        metadata={"help": "Questions of benchmark_file, in a seeded random order, are scored up to this many prompt tokens"},
+    )
+    benchmark_token_cache_dir: Optional[str] = field(
+        default=None, metadata={"help": "Directory where the tokenized benchmark prompts are cached between runs"},
+    )
+    benchmark_batch_size: Optional[int] = field(default=8, metadata={"help": "Questions per benchmark forward pass"})
 
     def __post_init__(self):
         if self.max_train_samples is not None and 0 < self.max_train_samples <= 1000:
@@ -287,6 +308,100 @@ class SavePeftModelTrainer(Trainer):
             self.model.save_pretrained(output_dir)
 
 
+class ExamBenchmarkCallback(TrainerCallback):
+    """
+    Logs the zero-shot accuracy on a medical exam subset (CMExam or C-Eval csv) at every evaluation.
+
+    The questions are tokenized once, through the eval prompt token cache when `token_cache_dir` is set, and
+    a seeded random sample of them fitting in `token_budget` prompt tokens is kept, so the cost per evaluation
+    is bounded and every subject of the file is represented. Each rank scores an interleaved shard with the
+    in-memory model, reading the option letter logits at the last prompt token, and the counts are all-reduced.
+    """
+
+    def __init__(self, trainer, tokenizer, benchmark_file, token_budget=50000, batch_size=8, token_cache_dir=None,
+                 seed=42):
+        self.trainer = trainer
+        self.tokenizer = tokenizer
+        self.batch_size = batch_size
+        self.token_cache_dir = token_cache_dir
+        self.items = self.load_benchmark(benchmark_file, token_budget, seed)
+
+    def load_benchmark(self, benchmark_file, token_budget, seed=42):
+        """Tokenized (prompt ids, answer index) pairs, in the zero-shot prompt format of eval/."""
+        df = pd.read_csv(benchmark_file)
+        if 'Options' in df.columns:  # CMExam
+            choices = ['A', 'B', 'C', 'D', 'E']
+            prompts = df['Question'].astype(str) + '\n' + df['Options'].astype(str) + '\n答案：'
+            answers = df['Answer']
+        else:  # C-Eval
+            choices = ['A', 'B', 'C', 'D']
+            prompts = df['question'].astype(str)
+            for choice in choices:
+                prompts = prompts + f'\n{choice}. ' + df[choice].astype(str)
+            prompts = prompts + '\n答案：'
+            answers = df['answer']
+        self.choice_ids = [encode_choice(self.tokenizer, choice) for choice in choices]
+        if self.token_cache_dir:
+            tokens = PromptTokenCache(self.token_cache_dir, self.tokenizer).get(list(prompts))
+        else:
+            tokens = TokenizedPrompts.encode(self.tokenizer, list(prompts))
+        # the file is sorted by subject, a prefix would only cover the first ones
+        order = list(range(len(df)))
+        random.Random(seed).shuffle(order)
+        items, num_tokens = [], 0
+        for i in order:
+            answer, input_ids = answers.iloc[i], tokens[i].tolist()
+            if answer not in choices:
+                # multiple-answer questions cannot be scored with a single letter
+                continue
+            if num_tokens + len(input_ids) > token_budget:
+                continue
+            items.append((input_ids, choices.index(answer)))
+            num_tokens += len(input_ids)
+        logger.info(f"Exam benchmark: {len(items)} of {len(df)} questions, {num_tokens} prompt tokens "
+                    f"from {benchmark_file}")
+        return items
+
+    @torch.no_grad()
+    def score(self, model):
+        if dist.is_available() and dist.is_initialized():
+            rank, world_size = dist.get_rank(), dist.get_world_size()
+        else:
+            rank, world_size = 0, 1
+        shard = self.items[rank::world_size]
+        # every rank runs the same number of forward passes, ZeRO-3 gathers the weights collectively
+        num_batches = math.ceil(math.ceil(len(self.items) / world_size) / self.batch_size)
+        device = next(model.parameters()).device
+        pad_token_id = self.tokenizer.pad_token_id or 0
+        counts = torch.zeros(2, device=device)  # correct, total
+        training = model.training
+        model.eval()
+        for start in range(0, num_batches * self.batch_size, self.batch_size):
+            batch, weight = shard[start:start + self.batch_size], 1
+            if not batch:
+                batch, weight = self.items[:1], 0
+            lengths = torch.tensor([len(input_ids) for input_ids, _ in batch])
+            # right padding, so positions are the same as for the unpadded prompt
+            input_ids = torch.full((len(batch), int(lengths.max())), pad_token_id, dtype=torch.long)
+            attention_mask = torch.zeros_like(input_ids)
+            for row, (ids, _) in enumerate(batch):
+                input_ids[row, :len(ids)] = torch.tensor(ids)
+                attention_mask[row, :len(ids)] = 1
+            logits = model(input_ids=input_ids.to(device), attention_mask=attention_mask.to(device)).logits
+            scores = logits[torch.arange(len(batch), device=device), lengths.to(device) - 1][:, self.choice_ids]
+            answers = torch.tensor([answer for _, answer in batch], device=device)
+            counts[0] += weight * (scores.argmax(dim=-1) == answers).sum()
+            counts[1] += weight * len(batch)
+        model.train(training)
+        if world_size > 1:
+            dist.all_reduce(counts)
+        return (100 * counts[0] / counts[1].clamp(min=1)).item()
+
+    def on_evaluate(self, args, state, control, model=None, **kwargs):
+        if self.items:
+            self.trainer.log({"eval_exam_accuracy": self.score(model)})
+
+
 def save_model(output_dir, model, tokenizer, args):
     """Save the model and the tokenizer."""
     os.makedirs(output_dir, exist_ok=True)
@@ -644,6 +759,11 @@ def main():
         data_collator=data_collator,
     )
 
+    if data_args.benchmark_file is not None:
+        trainer.add_callback(ExamBenchmarkCallback(
+            trainer, tokenizer, data_args.benchmark_file, data_args.benchmark_token_budget,
+            data_args.benchmark_batch_size, data_args.benchmark_token_cache_dir, training_args.seed))
+
     # Training
     if training_args.do_train:
         logger.info("*** Train ***")